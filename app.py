@@ -17,6 +17,8 @@ if "course_structure" not in st.session_state:
 
     st.session_state.course_structure = {}
     course_names = file_manager.get_all_courses()
+    # Processed files of every course in a single query, cached across sessions
+    catalog = st.session_state.db_manager.get_catalog(course_names)
 
     for course in course_names:
         # Initialize the course dictionary first
@@ -24,17 +26,13 @@ if "course_structure" not in st.session_state:
         lecture_names = file_manager.get_course_lectures(course)
         for lecture in lecture_names:
             local_files = file_manager.get_files_in_lecture(course, lecture)
-            if local_files:
-                db_files = st.session_state.db_manager.get_files_in_lecture(course, lecture)
-
-                # Create list of tuples with (file_name, processed_status)
-                file_status = [
-                    (file_path.name, file_path.name in db_files)
-                    for file_path in local_files
-                ]
-                st.session_state.course_structure[course][lecture] = file_status
-            else:
-                st.session_state.course_structure[course][lecture] = []
+            db_files = catalog[course].get(lecture, set())
+
+            # Create list of tuples with (file_name, processed_status)
+            st.session_state.course_structure[course][lecture] = [
+                (file_path.name, file_path.name in db_files)
+                for file_path in local_files
+            ]
 
 home_page = st.Page("portal/home.py", title="Home", icon="🏠")
 teacher_page = st.Page("portal/teacher.py", title="Teacher", icon="👨‍🏫")
@@ -0,0 +1,122 @@
+"""
+Peak RSS of handing an audio file to the transcription client, buffered vs streamed.
+
+Each run happens in a fresh subprocess against a synthetic (sparse) audio file and an
+httpx transport that drains the request body the way a socket would, so nothing
+leaves the machine. With streaming the peak should stay flat as the file grows.
+
+    python -m benchmarks.audio_upload_memory --sizes 64 256 1024
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+import httpx
+
+from utility.transcription import DeepgramTranscriber
+
+CANNED_RESPONSE = {
+    "metadata": {"request_id": "benchmark"},
+    "results": {
+        "channels": [
+            {
+                "alternatives": [
+                    {
+                        "transcript": "Benchmark sentence.",
+                        "confidence": 1.0,
+                        "words": [],
+                        "paragraphs": {
+                            "transcript": "Benchmark sentence.",
+                            "paragraphs": [
+                                {
+                                    "sentences": [
+                                        {"text": "Benchmark sentence.", "start": 0.0, "end": 1.0}
+                                    ],
+                                    "start": 0.0,
+                                    "end": 1.0,
+                                    "num_words": 2,
+                                }
+                            ],
+                        },
+                    }
+                ]
+            }
+        ]
+    },
+}
+
+
+class DrainTransport(httpx.BaseTransport):
+    """
+    Consumes the upload piece by piece, like a socket would, then answers with a
+    canned Deepgram response. (httpx.MockTransport reads the whole body up front.)
+    """
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        received = 0
+        for chunk in request.stream:
+            received += len(chunk)
+        assert received == int(request.headers["Content-Length"])
+        return httpx.Response(200, json=CANNED_RESPONSE)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_worker(audio_file_path: str, mode: str) -> dict:
+    file_size = os.path.getsize(audio_file_path)
+    # A single piece the size of the file reproduces the old read-everything upload
+    chunk_size = file_size if mode == "buffer" else 1 << 20
+    transcriber = DeepgramTranscriber(
+        api_key="benchmark",
+        upload_chunk_size=chunk_size,
+        transport=DrainTransport(),
+    )
+    baseline = peak_rss_mb()
+    transcriber.transcribe(audio_file_path)
+    return {
+        "mode": mode,
+        "file_mb": round(file_size / (1 << 20)),
+        "peak_rss_growth_mb": round(peak_rss_mb() - baseline, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 256, 1024], help="File sizes in MB")
+    parser.add_argument("--worker", nargs=2, metavar=("AUDIO_FILE", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(*args.worker)))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size_mb in args.sizes:
+            audio_file_path = os.path.join(tmp_dir, f"synthetic_{size_mb}mb.mp3")
+            with open(audio_file_path, "wb") as f:
+                f.truncate(size_mb << 20)
+
+            for mode in ["buffer", "stream"]:
+                output = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.audio_upload_memory", "--worker", audio_file_path, mode],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                )
+                results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    print(f"{'mode':<8}{'file (MB)':>12}{'peak RSS growth (MB)':>24}")
+    for result in results:
+        print(f"{result['mode']:<8}{result['file_mb']:>12}{result['peak_rss_growth_mb']:>24}")
+
+
+if __name__ == "__main__":
+    main()
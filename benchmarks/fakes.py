@@ -0,0 +1,304 @@
+"""
+Deterministic local stand-ins for the remote services, used by the benchmarks.
+"""
+from contextlib import contextmanager
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional
+from unittest import mock
+import json
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import pyarrow.parquet as pq
+import pypdfium2 as pdfium
+
+from utility.audio import find_silences, probe_duration
+from utility.search_backend import matches_filter, tokenize
+
+
+class FakeSnowflakeConnection:
+    """
+    A sqlite-backed stand-in for a Snowflake connection.
+
+    It understands the statements DatabaseManager sends (DDL, INSERT, PUT, COPY INTO,
+    Cortex Search DDL) and models the network with a fixed cost per round trip plus
+    a transfer cost per byte sent. The modelled time is slept, so wall-clock timings
+    include it, and also accumulated in network_time for reporting.
+
+    Args:
+        round_trip (float): Seconds per statement sent to the server
+        bandwidth (float): Upload bandwidth in bytes per second, 0 for unlimited
+    """
+
+    def __init__(self, round_trip: float = 0.0, bandwidth: float = 0.0):
+        # Autocommit like Snowflake, explicit BEGIN/COMMIT/ROLLBACK open and close transactions
+        self.db = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+        self.stage_dir = Path(tempfile.mkdtemp(prefix="fake_stage_"))
+        self.round_trip = round_trip
+        self.bandwidth = bandwidth
+        self.round_trips = 0
+        self.bytes_sent = 0
+        self.network_time = 0.0
+
+    def _send(self, num_bytes: int, round_trip: bool = True):
+        cost = (self.round_trip if round_trip else 0.0) + (num_bytes / self.bandwidth if self.bandwidth else 0.0)
+        self.round_trips += round_trip
+        self.bytes_sent += num_bytes
+        self.network_time += cost
+        if cost:
+            time.sleep(cost)
+
+    def cursor(self) -> "FakeCursor":
+        return FakeCursor(self)
+
+    def close(self):
+        self.db.close()
+        shutil.rmtree(self.stage_dir, ignore_errors=True)
+
+
+class FakeCursor:
+    def __init__(self, conn: FakeSnowflakeConnection):
+        self.conn = conn
+        self._results = []
+
+    def execute(self, query: str, params=None):
+        statement = " ".join(query.split())
+        self.conn._send(len(statement) + len(json.dumps(params or [])))
+        upper = statement.upper()
+
+        if upper.startswith(("CREATE DATABASE", "CREATE SCHEMA", "CREATE TEMPORARY STAGE")):
+            self._results = []
+        elif "CORTEX SEARCH SERVICE" in upper:
+            self._results = []
+        elif "INFORMATION_SCHEMA.TABLES" in upper:
+            # Snowflake reports unquoted names upper case
+            tables = self.conn.db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+            self._results = [(name.upper(),) for name, in tables]
+        elif upper.startswith("PUT "):
+            self._put(statement)
+        elif upper.startswith("COPY INTO "):
+            self._copy_into(statement)
+        elif upper.startswith("ALTER TABLE") and "ADD COLUMN IF NOT EXISTS" in upper:
+            self._add_column(statement)
+        else:
+            self._results = self.conn.db.execute(query, params or ()).fetchall()
+        return self
+
+    def executemany(self, query: str, data: list[tuple]):
+        # Bound rows travel as JSON in a single request
+        self.conn._send(len(query) + len(json.dumps(data)))
+        self.conn.db.executemany(query, data)
+        return self
+
+    def _put(self, statement: str):
+        source, target = re.match(r"PUT 'file://(.+?)' @(\S+)", statement).groups()
+        # The file itself is uploaded as part of the same request
+        self.conn._send(Path(source).stat().st_size, round_trip=False)
+        target_dir = self.conn.stage_dir / target
+        target_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copy(source, target_dir / Path(source).name)
+        self._results = []
+
+    def _copy_into(self, statement: str):
+        table_name, location = re.match(r"COPY INTO (\S+) FROM @(\S+)", statement).groups()
+        location = self.conn.stage_dir / location
+        files = [location] if location.is_file() else sorted(location.glob("*"))
+        loaded = 0
+        for file_path in files:
+            table = pq.read_table(file_path)
+            columns = ", ".join(table.column_names)
+            placeholders = ", ".join("?" for _ in table.column_names)
+            rows = list(zip(*(table.column(name).to_pylist() for name in table.column_names)))
+            self.conn.db.executemany(f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})", rows)
+            loaded += len(rows)
+            if "PURGE = TRUE" in statement.upper():
+                file_path.unlink()
+        self._results = [(str(location), "LOADED", loaded)]
+
+    def _add_column(self, statement: str):
+        # sqlite has no ADD COLUMN IF NOT EXISTS
+        table_name, column = re.match(r"ALTER TABLE (\S+) ADD COLUMN IF NOT EXISTS (\S+)", statement, re.I).groups()
+        existing = [row[1].lower() for row in self.conn.db.execute(f"PRAGMA table_info({table_name})")]
+        if column.lower() not in existing:
+            self.conn.db.execute(re.sub(r"IF NOT EXISTS ", "", statement, flags=re.I))
+        self._results = []
+
+    def fetchall(self):
+        return self._results
+
+    def close(self):
+        pass
+
+
+class FakeS3:
+    """
+    An in-memory stand-in for an S3 client, enough for uploading and deleting objects.
+    Uploads cost a round trip plus size / bandwidth, slept like FakeSnowflakeConnection.
+    """
+
+    def __init__(self, round_trip: float = 0.0, bandwidth: float = 0.0):
+        self.round_trip = round_trip
+        self.bandwidth = bandwidth
+        self.objects: dict[tuple[str, str], bytes] = {}
+        self.uploads = 0
+        self.multipart_uploads = 0
+        self.bytes_sent = 0
+
+    def upload_file(self, Filename: str, Bucket: str, Key: str, Config=None):
+        data = Path(Filename).read_bytes()
+        if Config is not None and len(data) >= Config.multipart_threshold:
+            self.multipart_uploads += 1
+        self.uploads += 1
+        self.bytes_sent += len(data)
+        cost = self.round_trip + (len(data) / self.bandwidth if self.bandwidth else 0.0)
+        if cost:
+            time.sleep(cost)
+        self.objects[(Bucket, Key)] = data
+
+    def delete_object(self, Bucket: str, Key: str):
+        self.objects.pop((Bucket, Key), None)
+
+
+class FakeTextract:
+    """
+    A stand-in for the asynchronous Textract text detection API over FakeS3 objects.
+
+    A job finishes job_overhead + pages * page_time seconds after it was started, jobs run
+    independently of each other, and results are returned one page per response. The
+    detected lines are the lines of each page's text layer.
+    """
+
+    def __init__(self, s3: FakeS3, job_overhead: float = 1.0, page_time: float = 0.1):
+        self.s3 = s3
+        self.job_overhead = job_overhead
+        self.page_time = page_time
+        self.jobs: dict[str, dict] = {}
+        self.started = 0
+        self.polls = 0
+
+    def start_document_text_detection(self, DocumentLocation: dict) -> dict:
+        location = DocumentLocation["S3Object"]
+        data = self.s3.objects[(location["Bucket"], location["Name"])]
+        pdf = pdfium.PdfDocument(data)
+        try:
+            pages = [pdf[idx].get_textpage().get_text_range() for idx in range(len(pdf))]
+        finally:
+            pdf.close()
+
+        job_id = f"job-{len(self.jobs)}"
+        self.jobs[job_id] = {"pages": pages, "done_at": time.monotonic() + self.job_overhead + len(pages) * self.page_time}
+        self.started += 1
+        return {"JobId": job_id}
+
+    def get_document_text_detection(self, JobId: str, NextToken: Optional[str] = None) -> dict:
+        self.polls += 1
+        job = self.jobs[JobId]
+        if time.monotonic() < job["done_at"]:
+            return {"JobStatus": "IN_PROGRESS"}
+
+        page_idx = int(NextToken or 0)
+        lines = [line.strip() for line in re.split(r"[\r\n]+", job["pages"][page_idx]) if line.strip()]
+        blocks = [{"BlockType": "PAGE", "Page": page_idx + 1}]
+        blocks += [{"BlockType": "LINE", "Page": page_idx + 1, "Text": line} for line in lines]
+        response = {"JobStatus": "SUCCEEDED", "Blocks": blocks}
+        if page_idx + 1 < len(job["pages"]):
+            response["NextToken"] = str(page_idx + 1)
+        return response
+
+
+class SilenceTranscriber:
+    """
+    A stand-in transcriber that hears one sentence in every stretch of sound between
+    silences, so its timestamps follow the audio it is given. Each call takes
+    overhead + audio seconds * realtime_factor, slept like the other fakes.
+    """
+
+    def __init__(self, overhead: float = 1.0, realtime_factor: float = 0.005, model: str = "fake"):
+        self.overhead = overhead
+        self.realtime_factor = realtime_factor
+        self.model = model
+        self.options = {}
+        self.calls = 0
+        self.audio_seconds = 0.0
+
+    def transcribe(self, audio_file_path: str) -> tuple[str, list[dict]]:
+        self.calls += 1
+        duration = probe_duration(audio_file_path)
+        self.audio_seconds += duration
+        # Shorter than the pauses in the benchmark audio, so half a pause at a segment edge still counts
+        silences = find_silences(audio_file_path, 0.0, duration, min_silence=0.3)
+
+        sentences = []
+        sound_start = 0.0
+        for silence_start, silence_end in silences + [(duration, duration)]:
+            if silence_start - sound_start > 0.05:
+                length = silence_start - sound_start
+                sentences.append({"text": f"A {length:.0f} second sentence.", "start": round(sound_start, 3), "end": round(silence_start, 3)})
+            sound_start = silence_end
+
+        time.sleep(self.overhead + duration * self.realtime_factor)
+        return " ".join(sentence["text"] for sentence in sentences), sentences
+
+
+class FakeCortexSearchService:
+    """
+    A stand-in for a Cortex Search service over in-memory rows, ranking by the number of
+    query words a row contains. Results come back on .results, like the real response.
+    """
+
+    def __init__(self, rows: list[dict], latency: float = 0.0):
+        self.rows = rows
+        self.latency = latency
+        self._tokens = [set(tokenize(row["text"])) for row in rows]
+        self.calls = 0
+
+    def search(self, query: str, columns: list[str], limit: int, filter: Optional[dict] = None):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        query_tokens = set(tokenize(query))
+        scored = [
+            (len(query_tokens & tokens), idx)
+            for idx, (row, tokens) in enumerate(zip(self.rows, self._tokens))
+            if matches_filter(row, filter or {})
+        ]
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        results = [{column: self.rows[idx][column] for column in columns} for _, idx in scored[:limit]]
+        return SimpleNamespace(results=results)
+
+
+class FakeComplete:
+    """
+    A stand-in for snowflake.cortex.Complete. Rewrite prompts get the question back as is,
+    answers are a fixed text streamed word by word. Each call sleeps latency seconds.
+    """
+
+    def __init__(self, answer: str = "Risk stratification ranks patients by their predicted risk.", latency: float = 0.0):
+        self.answer = answer
+        self.latency = latency
+        self.calls = 0
+
+    def __call__(self, model: str, prompt: list[dict], stream: bool = False, session=None):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if not stream:
+            return prompt[-1]["content"].removeprefix("Question to reformulate: ")
+        return iter(re.findall(r"\S+\s*", self.answer))
+
+
+@contextmanager
+def fake_cortex(services: dict[str, FakeCortexSearchService], complete: FakeComplete):
+    """
+    Point pipeline.retrieve at fake Cortex services while the block runs. The session to
+    pass to ContentRetriever is yielded, services are keyed by service name.
+    """
+    schema = SimpleNamespace(cortex_search_services=services)
+    root = SimpleNamespace(databases={"benchmark": SimpleNamespace(schemas={"benchmark": schema})})
+    session = SimpleNamespace(get_current_database=lambda: "benchmark", get_current_schema=lambda: "benchmark")
+    with mock.patch("pipeline.retrieve.Root", lambda _: root), mock.patch("pipeline.retrieve.Complete", complete):
+        yield session
@@ -0,0 +1,80 @@
+"""
+Rows/sec of DatabaseManager.insert_data, bound-parameter INSERT vs staged PUT + COPY.
+
+Runs against FakeSnowflakeConnection, which models the network as a cost per round
+trip plus upload bandwidth. Bound rows are sent as JSON, the bulk path uploads one
+compressed Parquet file, so the crossover depends on both knobs.
+
+    python -m benchmarks.insert_throughput --rows 100 1000 10000 --round-trip-ms 50 --bandwidth-mbps 5
+"""
+import argparse
+import random
+import time
+
+from benchmarks.fakes import FakeSnowflakeConnection
+from utility.database_manager import DatabaseManager
+
+WORDS = "the model learns a risk score from patient records and imaging features over time".split()
+
+
+def synthetic_video_rows(num_rows: int, seed: int = 0) -> list[tuple]:
+    """Rows shaped like 60s transcript windows (~150 words each)"""
+    rnd = random.Random(seed)
+    return [
+        (
+            " ".join(rnd.choice(WORDS) for _ in range(150)),
+            i * 50.0,
+            i * 50.0 + 60.0,
+            f"lecture {i % 13} video.mp4",
+            f"lecture_{i % 13}",
+        )
+        for i in range(num_rows)
+    ]
+
+
+def run(num_rows: int, bulk: bool, round_trip: float, bandwidth: float) -> dict:
+    conn = FakeSnowflakeConnection(round_trip=round_trip, bandwidth=bandwidth)
+    db_manager = DatabaseManager(conn, database="benchmark", schema="benchmark")
+    db_manager.create_table("course")
+    rows = synthetic_video_rows(num_rows)
+
+    conn.round_trips = conn.bytes_sent = 0
+    start = time.perf_counter()
+    db_manager.insert_data("course", rows, "video", bulk=bulk)
+    elapsed = time.perf_counter() - start
+    round_trips, bytes_sent = conn.round_trips, conn.bytes_sent
+
+    loaded = db_manager._run_query("SELECT COUNT(*) FROM course_video", return_results=True)[0][0]
+    assert loaded == num_rows, f"expected {num_rows} rows, found {loaded}"
+    conn.close()
+    return {
+        "path": "bulk" if bulk else "insert",
+        "rows": num_rows,
+        "rows_per_sec": num_rows / elapsed,
+        "round_trips": round_trips,
+        "mb_sent": bytes_sent / (1 << 20),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--round-trip-ms", type=float, default=50.0)
+    parser.add_argument("--bandwidth-mbps", type=float, default=5.0, help="Upload bandwidth in MB/s, 0 for unlimited")
+    args = parser.parse_args()
+
+    round_trip = args.round_trip_ms / 1000
+    bandwidth = args.bandwidth_mbps * (1 << 20)
+
+    print(f"{'path':<8}{'rows':>8}{'rows/sec':>12}{'round trips':>13}{'MB sent':>10}")
+    for num_rows in args.rows:
+        for bulk in [False, True]:
+            result = run(num_rows, bulk, round_trip, bandwidth)
+            print(
+                f"{result['path']:<8}{result['rows']:>8}{result['rows_per_sec']:>12.0f}"
+                f"{result['round_trips']:>13}{result['mb_sent']:>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
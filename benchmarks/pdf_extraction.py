@@ -0,0 +1,75 @@
+"""
+Time to extract the bundled courses/ PDFs: one Textract job per file, page-parallel jobs, and the local text layer first.
+
+S3 and Textract are the in-memory fakes from benchmarks.fakes, so the waits are real
+sleeps: uploads cost bytes / bandwidth and every job finishes a fixed overhead plus a
+per-page time after it starts. The fake OCR output is each page's own text layer, so
+every mode produces the same sections and they are checked against each other.
+
+    python -m benchmarks.pdf_extraction --bandwidth-mbps 5 --job-overhead 1 --page-ms 300 --pages-per-job 2
+"""
+from pathlib import Path
+import argparse
+import time
+
+from benchmarks.fakes import FakeS3, FakeTextract
+from utility.data_models import Note
+from utility.textract import TextractExtractor
+
+
+def run(file_path: str, use_text_layer: bool, s3: FakeS3, textract: FakeTextract, **extractor_args) -> dict:
+    extractor = TextractExtractor(s3, textract, "bucket", poll_interval=0.05, max_poll_interval=0.2, **extractor_args)
+    note = Note(file_path=file_path, use_text_layer=use_text_layer, textract=extractor)
+    started = textract.started
+    start = time.perf_counter()
+    num_pages, _, chunks = note._load_document()
+    assert not s3.objects, "uploaded batches were not deleted"
+    return {
+        "chunks": chunks,
+        "pages": num_pages,
+        "textract_pages": len(note.ocr_pages),
+        "jobs": textract.started - started,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--courses-dir", default="courses")
+    parser.add_argument("--bandwidth-mbps", type=float, default=5.0, help="Upload bandwidth in MB/s")
+    parser.add_argument("--job-overhead", type=float, default=1.0, help="Seconds per Textract job")
+    parser.add_argument("--page-ms", type=float, default=300.0, help="Textract milliseconds per page")
+    parser.add_argument("--pages-per-job", type=int, default=2, help="Pages per job in the page-parallel mode")
+    args = parser.parse_args()
+
+    s3 = FakeS3(bandwidth=args.bandwidth_mbps * (1 << 20))
+    textract = FakeTextract(s3, job_overhead=args.job_overhead, page_time=args.page_ms / 1000)
+    modes = {
+        "one job": dict(use_text_layer=False, pages_per_job=1 << 16, max_jobs_in_flight=1),
+        "parallel": dict(use_text_layer=False, pages_per_job=args.pages_per_job),
+        "hybrid": dict(use_text_layer=True, pages_per_job=args.pages_per_job),
+    }
+
+    print(f"{'file':<24}{'pages':>6}" + "".join(f"{mode + ' s':>12}" for mode in modes) + f"{'jobs':>6}{'speedup':>9}")
+    totals = dict.fromkeys(modes, 0.0)
+    for file_path in sorted(Path(args.courses_dir).glob("*/*/*.pdf")):
+        results = {mode: run(str(file_path), s3=s3, textract=textract, **mode_args) for mode, mode_args in modes.items()}
+        texts = [[chunk.text for chunk in result["chunks"]] for result in results.values()]
+        assert all(text == texts[0] for text in texts), f"extraction modes disagree on {file_path.name}"
+
+        for mode, result in results.items():
+            totals[mode] += result["seconds"]
+        print(
+            f"{file_path.name:<24}{results['hybrid']['pages']:>6}"
+            + "".join(f"{result['seconds']:>12.3f}" for result in results.values())
+            + f"{results['parallel']['jobs']:>6}{results['one job']['seconds'] / results['parallel']['seconds']:>8.1f}x"
+        )
+    print(
+        f"{'total':<30}" + "".join(f"{seconds:>12.3f}" for seconds in totals.values())
+        + f"{'':>6}{totals['one job'] / totals['parallel']:>8.1f}x"
+    )
+    print(f"S3: {s3.uploads} uploads, {s3.multipart_uploads} multipart, {s3.bytes_sent / (1 << 20):.1f} MB; Textract: {textract.polls} polls")
+
+
+if __name__ == "__main__":
+    main()
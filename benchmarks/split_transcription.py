@@ -0,0 +1,65 @@
+"""
+Wall-clock time of transcribing a long lecture whole vs cut on silences into concurrent segments.
+
+The lecture is synthetic audio, tone "sentences" with pauses between them, and the
+transcriber is SilenceTranscriber from benchmarks.fakes, which takes a fixed overhead
+plus a per-audio-second time and reports one sentence per stretch of sound. Both runs
+must find the same sentences at the same absolute times.
+
+    python -m benchmarks.split_transcription --minutes 60 --segment-minutes 10 --workers 4
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.fakes import SilenceTranscriber
+from utility.transcription import SegmentedTranscriber
+from utility.ffmpeg import run_ffmpeg
+
+
+def synthetic_lecture(file_path: str, minutes: float):
+    """Mono 16 kHz FLAC in Ogg (so segments are stream copied) of 6.5 second sentences separated by 0.8 second pauses"""
+    sound = "sin(440*2*PI*t)*gt(mod(t\\,7.3)\\,0.8)"
+    run_ffmpeg([
+        "-y", "-f", "lavfi", "-i", f"aevalsrc={sound}:s=16000:d={minutes * 60}",
+        "-ac", "1", "-c:a", "flac", file_path,
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--minutes", type=float, default=60.0, help="Lecture length")
+    parser.add_argument("--segment-minutes", type=float, default=10.0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--overhead", type=float, default=1.0, help="Seconds per transcription request")
+    parser.add_argument("--realtime-factor", type=float, default=0.005, help="Seconds per second of audio")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        audio_file_path = os.path.join(tmp_dir, "lecture.ogg")
+        synthetic_lecture(audio_file_path, args.minutes)
+
+        results = {}
+        for mode in ["whole", "split"]:
+            fake = SilenceTranscriber(overhead=args.overhead, realtime_factor=args.realtime_factor)
+            transcriber = fake if mode == "whole" else SegmentedTranscriber(
+                fake, segment_seconds=args.segment_minutes * 60, max_workers=args.workers
+            )
+            start = time.perf_counter()
+            _, sentences = transcriber.transcribe(audio_file_path)
+            results[mode] = (time.perf_counter() - start, sentences, fake.calls)
+
+    (whole_time, whole, _), (split_time, split, calls) = results["whole"], results["split"]
+    assert len(whole) == len(split), f"{len(whole)} sentences whole vs {len(split)} split"
+    assert all(list(a) == list(b) for a, b in zip(whole, split)), "sentence shape differs"
+    drift = max(max(abs(a["start"] - b["start"]), abs(a["end"] - b["end"])) for a, b in zip(whole, split))
+
+    print(f"{'mode':<8}{'requests':>10}{'seconds':>10}{'sentences':>11}")
+    print(f"{'whole':<8}{1:>10}{whole_time:>10.2f}{len(whole):>11}")
+    print(f"{'split':<8}{calls:>10}{split_time:>10.2f}{len(split):>11}")
+    print(f"speedup {whole_time / split_time:.1f}x, largest timestamp difference {drift * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
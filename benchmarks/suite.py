@@ -0,0 +1,267 @@
+"""
+Offline timing suite for the ingest, chunking and retrieval hot paths, with saved baselines to compare against.
+
+Every case runs against the deterministic fakes in benchmarks.fakes with their latencies
+set to zero, so the timings are the local work only and need no credentials or network.
+A case is run once to warm up and then --repeat times, the median and fastest run are
+kept. compare flags every case whose fastest run (or median, with --stat) got slower
+by more than --threshold and exits with status 1 if any did. The fastest run is the
+least disturbed by other load on the machine.
+
+    python -m benchmarks.suite run --save .cache/benchmarks/baseline.json
+    python -m benchmarks.suite run --save .cache/benchmarks/current.json --only chunk_text
+    python -m benchmarks.suite compare .cache/benchmarks/baseline.json .cache/benchmarks/current.json --threshold 0.2
+"""
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Callable
+import argparse
+import fnmatch
+import io
+import json
+import logging
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+from langchain_core.documents import Document
+
+from benchmarks.fakes import FakeComplete, FakeCortexSearchService, FakeS3, FakeSnowflakeConnection, FakeTextract, fake_cortex
+from benchmarks.insert_throughput import synthetic_video_rows
+from pipeline.context import ContextBudget
+from pipeline.retrieve import ContentRetriever
+from utility.data_models import Note, Video
+from utility.database_manager import DatabaseManager
+from utility.textract import TextractExtractor
+from utility.transcription import FakeTranscriber
+
+WORDS = (
+    "risk model patient imaging feature label cohort outcome bias survival censoring screening "
+    "mammography density trial treatment effect causal estimate dataset validation error"
+).split()
+LECTURES = [f"lecture_{idx}" for idx in range(12)]
+
+# name -> setup returning the function to time
+CASES: dict[str, Callable[[], Callable[[], object]]] = {}
+
+
+def case(name: str):
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+def synthetic_text(rnd: random.Random, num_words: int) -> str:
+    sentences, words = [], [rnd.choice(WORDS) for _ in range(num_words)]
+    for start in range(0, num_words, 12):
+        sentences.append(" ".join(words[start : start + 12]).capitalize() + ".")
+    return " ".join(sentences)
+
+
+def synthetic_chunks(num_rows: int, seed: int = 0) -> dict[str, list[dict]]:
+    """Chunk rows of a course, shaped like the pdf and video tables"""
+    rnd = random.Random(seed)
+    pdf = [
+        {"text": synthetic_text(rnd, 120), "file_name": f"{lecture} notes.pdf", "lecture_name": lecture, "page_num": idx % 30 + 1}
+        for idx, lecture in ((idx, rnd.choice(LECTURES)) for idx in range(num_rows))
+    ]
+    video = [
+        {
+            "text": synthetic_text(rnd, 150), "file_name": f"{lecture} video.mp4", "lecture_name": lecture,
+            "start_time": idx % 60 * 50.0, "end_time": idx % 60 * 50.0 + 60.0,
+        }
+        for idx, lecture in ((idx, rnd.choice(LECTURES)) for idx in range(num_rows))
+    ]
+    return {"pdf": pdf, "video": video}
+
+
+for num_sentences in [1_000, 10_000, 100_000]:
+    @case(f"chunk_text/{num_sentences}")
+    def _(num_sentences=num_sentences):
+        transcript = FakeTranscriber(num_sentences=num_sentences).sentences
+        video = Video(file_path="synthetic.mp4", transcriber=FakeTranscriber(), cache=None)
+        return lambda: video._chunk_text(transcript, 60, 10)
+
+
+@case("note_split_pages/500")
+def _():
+    rnd = random.Random(0)
+    # Extracted pages are full of hard line breaks and runs of spaces
+    pages = [
+        Document(
+            page_content="\n".join(f"  {line}   " for line in synthetic_text(rnd, 400).split(". ")),
+            metadata={"page": idx + 1, "extraction": "text_layer"},
+        )
+        for idx in range(500)
+    ]
+    note = Note(file_path="synthetic.pdf")
+    return lambda: note._split_pages(pages)
+
+
+@case("note_textract")
+def _():
+    pdf_paths = sorted(Path("courses").glob("*/*/*.pdf"))
+    if not pdf_paths:
+        return None
+    s3 = FakeS3()
+    extractor = TextractExtractor(s3, FakeTextract(s3, job_overhead=0.0, page_time=0.0), "benchmark", poll_interval=0.001)
+    note = Note(file_path=str(pdf_paths[0]), use_text_layer=False, textract=extractor)
+    return note._load_document
+
+
+for bulk in [False, True]:
+    @case(f"insert_data/{'bulk' if bulk else 'bound'}/2000")
+    def _(bulk=bulk):
+        db_manager = DatabaseManager(FakeSnowflakeConnection(), database="benchmark", schema="benchmark")
+        db_manager.create_table("course")
+        rows = synthetic_video_rows(2000)
+        return lambda: db_manager.insert_data("course", rows, "video", bulk=bulk)
+
+
+def fake_retriever(num_rows: int = 2000) -> ContentRetriever:
+    """A ContentRetriever over fake Cortex services, with every cache off so each call does the full work"""
+    chunks = synthetic_chunks(num_rows)
+    services = {f"course_{content_type}": FakeCortexSearchService(rows) for content_type, rows in chunks.items()}
+    with fake_cortex(services, FakeComplete()) as session:
+        return ContentRetriever(
+            session, "course", use_cache=False, use_answer_cache=False, search_backend="cortex",
+            context_budget=ContextBudget(),
+        )
+
+
+@case("retrieve/2000")
+def _():
+    retriever = fake_retriever()
+    return lambda: retriever.retrieve("how is risk estimated from imaging features", LECTURES[:6])
+
+
+@case("parse_docs")
+def _():
+    retriever = fake_retriever()
+    documents = retriever.retrieve("how is risk estimated from imaging features", LECTURES[:6])
+    return lambda: retriever._parse_docs(documents)
+
+
+@case("chat_turn")
+def _():
+    retriever = fake_retriever()
+    complete = FakeComplete()
+    history = [
+        {"role": "user", "content": "What is risk stratification?"},
+        {"role": "assistant", "content": "It ranks patients by their predicted risk of an outcome."},
+    ]
+
+    def turn():
+        # Run inside the patch, the rewrite and the answer both call Complete
+        with fake_cortex({}, complete):
+            query, documents = retriever.retrieve_for_turn("and how is it validated?", history, LECTURES[:6])
+            return "".join(retriever.complete(query, documents, history, lecture_names=LECTURES[:6], standalone_query=query))
+    return turn
+
+
+def run_case(setup: Callable, repeat: int, min_sample: float = 0.05) -> dict:
+    """
+    Time a case. Fast cases are called in a loop long enough to last min_sample seconds,
+    so timer resolution and scheduling noise stay small next to every sample.
+
+    Returns:
+        dict: Seconds per call of the median and fastest sample, with the sample counts
+    """
+    # Progress prints of the code under test would drown the report
+    with redirect_stdout(io.StringIO()):
+        fn = setup()
+        if fn is None:
+            return {"skipped": True}
+        start = time.perf_counter()
+        fn()
+        loops = max(1, math.ceil(min_sample / max(time.perf_counter() - start, 1e-9)))
+
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(loops):
+                fn()
+            times.append((time.perf_counter() - start) / loops)
+    return {"median": statistics.median(times), "min": min(times), "runs": repeat, "loops": loops}
+
+
+def run(args):
+    selected = {name: setup for name, setup in CASES.items() if not args.only or any(fnmatch.fnmatch(name, f"{pattern}*") for pattern in args.only)}
+    results = {}
+    print(f"{'case':<32}{'median ms':>12}{'min ms':>10}")
+    for name, setup in selected.items():
+        results[name] = run_case(setup, args.repeat)
+        if results[name].get("skipped"):
+            print(f"{name:<32}{'skipped':>12}")
+        else:
+            print(f"{name:<32}{results[name]['median'] * 1000:>12.2f}{results[name]['min'] * 1000:>10.2f}")
+
+    if args.save:
+        report = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} cpus",
+            "results": results,
+        }
+        Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved to {args.save}")
+
+
+def compare(args) -> int:
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    with open(args.current, "r") as f:
+        current = json.load(f)
+    if baseline.get("machine") != current.get("machine"):
+        print(f"Warning: baseline from {baseline.get('machine')}, current from {current.get('machine')}")
+
+    regressions = 0
+    stat = args.stat
+    print(f"{'case':<32}{'baseline ms':>13}{'current ms':>12}{'change':>9}  ({stat})")
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if result.get("skipped") or not before or before.get("skipped"):
+            continue
+        change = result[stat] / before[stat] - 1
+        flag = ""
+        if change > args.threshold:
+            regressions += 1
+            flag = "  SLOWER"
+        print(f"{name:<32}{before[stat] * 1000:>13.2f}{result[stat] * 1000:>12.2f}{change:>+9.0%}{flag}")
+
+    print(f"{regressions} of {len(current['results'])} cases slower than the baseline by more than {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Time the cases")
+    run_parser.add_argument("--only", nargs="+", help="Case name prefixes (glob patterns) to run")
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--save", help="Write the results to this JSON file")
+
+    compare_parser = commands.add_parser("compare", help="Flag cases that got slower than a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown, 0.2 is 20%%")
+    compare_parser.add_argument("--stat", choices=["min", "median"], default="min")
+
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Keeps every part of the completion prompt within a token budget.
+"""
+from dataclasses import dataclass, asdict, field
+import math
+import re
+
+from pipeline.fusion import split_sentences
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the token count of text without a tokenizer. Words count one token per five
+    characters (at least one) and every punctuation mark counts one, a rough match for
+    BPE tokenizers on English text.
+    """
+    return sum(
+        math.ceil(len(piece) / 5) if piece[0].isalnum() else 1
+        for piece in re.findall(r"\w+|[^\w\s]", text)
+    )
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Keep the leading sentences of text that fit in max_tokens, cutting the first one by words if it alone is too long"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    kept, used = [], 0
+    for sentence in split_sentences(text):
+        tokens = estimate_tokens(sentence)
+        if used + tokens > max_tokens:
+            break
+        kept.append(sentence)
+        used += tokens
+    if kept:
+        return " ".join(kept)
+
+    words, used = [], 0
+    for word in text.split():
+        used += estimate_tokens(word)
+        if used > max_tokens:
+            break
+        words.append(word)
+    return " ".join(words)
+
+
+@dataclass
+class ContextBudget:
+    """
+    Maximum tokens per part of the completion prompt. Passages are budgeted per content
+    type, and content types without an entry in passages get default_passages.
+    """
+
+    system: int = 200
+    history: int = 600
+    passages: dict[str, int] = field(default_factory=lambda: {"pdf": 800, "video": 800})
+    default_passages: int = 800
+
+    def for_content(self, content_type: str) -> int:
+        """Token budget for passages of content_type"""
+        return self.passages.get(content_type, self.default_passages)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def budget_history(chat_history: list[dict], max_tokens: int) -> tuple[list[dict], int]:
+    """
+    Keep the most recent exchanges that fit in max_tokens, dropping the oldest first. An
+    exchange is a user message with the replies that follow it, and is kept or dropped as
+    a whole so the model never sees an answer without its question. Replies at the start
+    of the history whose question was already cut are dropped.
+
+    Returns:
+        tuple: Contains (kept messages, their token count)
+    """
+    exchanges = []
+    for message in chat_history:
+        if message["role"] == "user" or not exchanges:
+            exchanges.append([message])
+        else:
+            exchanges[-1].append(message)
+    if exchanges and exchanges[0][0]["role"] != "user":
+        exchanges.pop(0)
+
+    kept, used = [], 0
+    for exchange in reversed(exchanges):
+        tokens = sum(estimate_tokens(message["content"]) for message in exchange)
+        if used + tokens > max_tokens:
+            break
+        kept[:0] = exchange
+        used += tokens
+    return kept, used
+
+
+def budget_passages(passages: list[dict], budget: ContextBudget) -> tuple[list[dict], dict]:
+    """
+    Keep ranked passages while their content type has budget left. The passage that
+    crosses the budget is cut at a sentence boundary, so lower ranked content goes first.
+
+    Returns:
+        tuple: Contains (kept passages, tokens used per content type)
+    """
+    used = {content_type: 0 for content_type in budget.passages}
+    kept = []
+    for passage in passages:
+        content_type = passage["content_type"]
+        limit = budget.for_content(content_type)
+        remaining = limit - used.setdefault(content_type, 0)
+        if remaining <= 0:
+            continue
+        text = truncate_to_tokens(passage["text"], remaining)
+        if not text:
+            used[content_type] = limit
+            continue
+        kept.append({**passage, "text": text})
+        used[content_type] += estimate_tokens(text)
+    return kept, used
@@ -0,0 +1,444 @@
+"""
+Scores the course retriever on a question bank across chunking and lecture filter settings.
+
+Replaces the question loop of evaluation.ipynb. Every question of every configuration runs
+through the production ContentRetriever, concurrently, and is scored by three LLM judges on
+Cortex (groundedness, answer relevance and context relevance, 0 to 1 as in TruLens). Model
+calls are held to --rate per second. Answers and judge scores are cached on disk by a hash
+of the model and the exact prompt, so re-running unchanged configurations only repeats the
+searches, and answers keep the latencies measured when they were generated.
+
+Every chunk configuration, the ingested 60s/10s one included, is built as a local search
+index from the cached transcripts of the course videos, nothing is transcribed again, and
+searches the course's local PDF index. Their rows differ only in the video chunks. The
+Cortex Search services of the ingested chunks are scored as a separate "cortex baseline",
+whose latencies and rankings are not comparable with the local rows. The "course" filter
+searches every lecture, the "lecture" filter only the one named after the question's CSV
+file. Questions whose CSV names no processed lecture are skipped under the "lecture"
+filter, with a warning.
+
+    python -m pipeline.evaluate machine_learning_for_health --chunk-configs 30:5 120:20 --filters course lecture
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+import argparse
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from snowflake.cortex import Complete
+
+from pipeline.retrieve import ContentRetriever
+from pipeline.warmup import load_questions
+from utility.data_models import Video, chunk_transcript
+from utility.database_manager import DatabaseManager
+from utility.file_manager import FileManager
+from utility.search_backend import LocalSearchBackend
+
+logger = logging.getLogger(__name__)
+
+FILTERS = ["course", "lecture"]
+# The chunk_size and overlap ContentProcessor ingests videos with
+INGESTED_CHUNK_CONFIG = (60, 10)
+METRICS = ["groundedness", "answer_relevance", "context_relevance"]
+# Set on every row that got that far, a configuration whose questions all failed has none of them
+RESULT_COLUMNS = ["error", "retrieve_ms", "prompt_tokens", "answer_cached", "complete_ms", "ttft_ms", *METRICS]
+
+JUDGE_SYSTEM_PROMPT = """
+You are a strict grader of a teaching assistant's answers. Follow the scoring rubric exactly, give a short reason, then end with a line of the form "Score: N" where N is an integer from 0 to 3.
+"""
+JUDGE_PROMPTS = {
+    "groundedness": """
+How well is the ANSWER supported by the CONTEXT? 3 means every claim in the answer is stated in or directly follows from the context, 2 means most claims are, 1 means few are, 0 means none are or the answer contradicts the context. An answer that only says it does not know scores 3.
+
+CONTEXT: {context}
+
+ANSWER: {answer}
+""",
+    "answer_relevance": """
+How relevant is the ANSWER to the QUESTION? 3 means it fully answers the question, 2 means it answers most of it, 1 means it is only loosely related, 0 means it is unrelated or only says it does not know.
+
+QUESTION: {question}
+
+ANSWER: {answer}
+""",
+    "context_relevance": """
+How relevant is the CONTEXT to the QUESTION? 3 means it contains what is needed to answer the question, 2 means it contains most of it, 1 means it is only loosely related, 0 means it is unrelated.
+
+QUESTION: {question}
+
+CONTEXT: {context}
+""",
+}
+
+
+def parse_score(judgement: str) -> Optional[float]:
+    """Get the 0-3 score of a judge's reply scaled to 0-1, None if it gave none"""
+    match = re.search(r"Score:\s*\**\s*([0-3])\b", judgement) or re.search(r"\b([0-3])\s*(?:/\s*3)?\s*$", judgement.strip())
+    return int(match.group(1)) / 3 if match else None
+
+
+class EvalCache:
+    """
+    Disk cache of answers and judge scores, keyed by a hash of everything that went into them.
+
+    Entries are appended to a JSON lines file and never change once written, so the file is
+    read once and then only appended to.
+
+    Args:
+        path (str): JSON lines file of the entries
+    """
+
+    def __init__(self, path: str = ".cache/eval/results.jsonl"):
+        self.path = Path(path)
+        self._entries: Optional[dict[str, dict]] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _load(self) -> dict[str, dict]:
+        if self._entries is None:
+            self._entries = {}
+            if self.path.exists():
+                with open(self.path, "r") as f:
+                    for line in f:
+                        if line.strip():
+                            entry = json.loads(line)
+                            self._entries[entry["key"]] = entry["value"]
+        return self._entries
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            return self._load().get(key)
+
+    def put(self, key: str, value: dict):
+        with self._lock:
+            self._load()[key] = value
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"key": key, "value": value}) + "\n")
+
+
+class RateLimiter:
+    """Spaces calls shared by several threads at least 1 / rate seconds apart"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_time)
+            self._next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+@dataclass(frozen=True)
+class EvalConfig:
+    """
+    One retriever configuration to score.
+
+    Attributes:
+        chunk_config (Optional[tuple[int, int]]): (chunk_size, overlap) of the video chunks in seconds, searched locally. None for the Cortex Search baseline
+        filter (str): "course" to search every lecture, "lecture" for the question's own lecture
+    """
+
+    chunk_config: Optional[tuple[int, int]] = None
+    filter: str = "course"
+
+    @property
+    def name(self) -> str:
+        chunks = "cortex baseline" if self.chunk_config is None else "{}s/{}s".format(*self.chunk_config)
+        return f"{chunks} {self.filter}"
+
+
+class Evaluator:
+    """
+    Runs and scores questions against configurations of a course's ContentRetriever.
+
+    Args:
+        session (Optional[Session]): Snowpark session of the course data
+        course_name (str): Course to evaluate
+        lecture_names (list[str]): Processed lectures of the course
+        model_name (str): Model answering the questions
+        judge_model (str): Model scoring the answers
+        cache (Optional[EvalCache]): Cache of answers and scores, None to always call the models
+        rate (float): Model calls per second across every worker
+        workers (int): Questions evaluated at the same time
+        complete (Callable): Cortex Complete or a stand-in with the same signature
+        index_dir (str): Where the re-chunked video indexes are built
+    """
+
+    def __init__(
+        self,
+        session,
+        course_name: str,
+        lecture_names: list[str],
+        model_name: str = "mistral-large2",
+        judge_model: str = "mistral-large2",
+        cache: Optional[EvalCache] = None,
+        rate: float = 2.0,
+        workers: int = 8,
+        complete: Callable = Complete,
+        index_dir: str = ".cache/eval/indexes",
+    ):
+        self.session = session
+        self.course_name = course_name
+        self.lecture_names = lecture_names
+        self.model_name = model_name
+        self.judge_model = judge_model
+        self.cache = cache
+        self.limiter = RateLimiter(rate)
+        self.workers = workers
+        self.complete = complete
+        self.index_dir = Path(index_dir)
+        self._transcripts: Optional[list[tuple[str, str, list[dict]]]] = None
+
+    def cached_transcripts(self) -> list[tuple[str, str, list[dict]]]:
+        """
+        Get the sentences of every course video whose transcript is cached. Videos without
+        one are left out of the re-chunked indexes with a warning.
+
+        Returns:
+            list: (lecture name, file name, sentences) per video
+        """
+        if self._transcripts is None:
+            file_manager = FileManager()
+            self._transcripts = []
+            for lecture_name in sorted(file_manager.get_course_lectures(self.course_name)):
+                lecture_path = file_manager.base_path / self.course_name / lecture_name
+                for video_path in sorted(lecture_path.glob("*.mp4")):
+                    video = Video(file_path=str(video_path))
+                    if video._load_cached_transcript():
+                        self._transcripts.append((lecture_name, video_path.name, video.sentence_level_transcript))
+                    else:
+                        logger.warning(f"No cached transcript for {video_path}, left out of the re-chunked indexes")
+        return self._transcripts
+
+    def build_video_indexes(self, chunk_configs: list[tuple[int, int]]) -> dict[tuple[int, int], str]:
+        """
+        Build a local video index per chunk configuration from the cached transcripts,
+        chunking every transcript for all of them in one pass. Indexes of unchanged
+        transcripts and configurations are reused.
+
+        Returns:
+            dict: Maps (chunk_size, overlap) -> index directory
+        """
+        transcripts = self.cached_transcripts()
+        digest = EvalCache.make_key(transcripts)[:12]
+        index_dirs = {
+            (chunk_size, overlap): str(self.index_dir / f"{self.course_name}_video_{chunk_size}_{overlap}_{digest}")
+            for chunk_size, overlap in chunk_configs
+        }
+        missing = [config for config, index_dir in index_dirs.items() if not LocalSearchBackend.exists(index_dir)]
+        if not missing:
+            return index_dirs
+
+        rows = {config: [] for config in missing}
+        for lecture_name, file_name, sentences in transcripts:
+            for config, chunks in chunk_transcript(sentences, missing).items():
+                rows[config].extend(
+                    {"text": chunk.text, "start_time": chunk.start, "end_time": chunk.end, "file_name": file_name, "lecture_name": lecture_name}
+                    for chunk in chunks
+                )
+        for config, config_rows in rows.items():
+            logger.info(f"Indexing {len(config_rows)} video chunks of {config[0]}s with {config[1]}s overlap")
+            LocalSearchBackend.build(index_dirs[config], config_rows)
+        return index_dirs
+
+    def retriever_for(self, config: EvalConfig, index_dirs: dict[tuple[int, int], str]) -> ContentRetriever:
+        """The production retriever, with the backend and video chunks of the configuration and every cache off"""
+        retriever = ContentRetriever(
+            self.session, self.course_name, model_name=self.model_name, use_cache=False, use_answer_cache=False,
+            search_backend="cortex" if config.chunk_config is None else "local",
+        )
+        if config.chunk_config is not None:
+            retriever.video_service = LocalSearchBackend(index_dirs[config.chunk_config])
+            retriever.search_targets["video"] = (retriever.video_service, retriever.video_columns)
+        return retriever
+
+    def _answer(self, retriever: ContentRetriever, messages: list[dict]) -> tuple[dict, bool]:
+        """
+        Get the model's answer to a prompt with its latencies, from the cache if it was asked before.
+
+        Returns:
+            tuple: Contains (answer with complete_ms and ttft_ms, whether it was cached)
+        """
+        key = EvalCache.make_key("answer", self.model_name, messages)
+        cached = self.cache.get(key) if self.cache else None
+        if cached is not None:
+            return cached, True
+
+        self.limiter.wait()
+        start_time = time.perf_counter()
+        pieces, ttft = [], None
+        for piece in self.complete(model=self.model_name, prompt=messages, stream=True):
+            if ttft is None:
+                ttft = time.perf_counter() - start_time
+            pieces.append(piece)
+        answer = {
+            "text": "".join(pieces).strip(),
+            "complete_ms": (time.perf_counter() - start_time) * 1000,
+            "ttft_ms": (ttft or 0.0) * 1000,
+        }
+        if self.cache:
+            self.cache.put(key, answer)
+        return answer, False
+
+    def judge(self, metric: str, **inputs) -> Optional[float]:
+        """Score one metric between 0 and 1, None if the judge gave no score"""
+        messages = [
+            {"role": "system", "content": JUDGE_SYSTEM_PROMPT},
+            {"role": "user", "content": JUDGE_PROMPTS[metric].format(**inputs)},
+        ]
+        key = EvalCache.make_key("judge", self.judge_model, messages)
+        cached = self.cache.get(key) if self.cache else None
+        if cached is not None:
+            return cached["score"]
+
+        self.limiter.wait()
+        judgement = self.complete(model=self.judge_model, prompt=messages)
+        score = parse_score(judgement)
+        if score is None:
+            logger.warning(f"No score in {metric} judgement: {judgement[-200:]}")
+        elif self.cache:
+            self.cache.put(key, {"score": score, "judgement": judgement})
+        return score
+
+    def evaluate_question(self, config: EvalConfig, retriever: ContentRetriever, question: str, lecture: str) -> dict:
+        """Retrieve, answer and judge one question"""
+        row = {"config": config.name, "lecture": lecture, "question": question}
+        lecture_names = [lecture] if config.filter == "lecture" else self.lecture_names
+        try:
+            if lecture not in self.lecture_names and config.filter == "lecture":
+                raise ValueError(f"{lecture} is not a processed lecture of {self.course_name}")
+            start_time = time.perf_counter()
+            documents = retriever.retrieve(question, lecture_names)
+            row["retrieve_ms"] = (time.perf_counter() - start_time) * 1000
+
+            messages, passages, tokens = retriever.build_prompt(question, documents, [])
+            row["prompt_tokens"] = tokens["total"]
+            answer, row["answer_cached"] = self._answer(retriever, messages)
+            row.update(complete_ms=answer["complete_ms"], ttft_ms=answer["ttft_ms"], answer=answer["text"])
+
+            context = "\n\n".join(passage["text"] for passage in passages)
+            row["groundedness"] = self.judge("groundedness", context=context, answer=answer["text"])
+            row["answer_relevance"] = self.judge("answer_relevance", question=question, answer=answer["text"])
+            # Scored per passage and averaged, as the notebook's TruLens feedback did
+            scores = [self.judge("context_relevance", question=question, context=passage["text"]) for passage in passages]
+            scores = [score for score in scores if score is not None]
+            row["context_relevance"] = float(np.mean(scores)) if scores else None
+        except Exception as e:
+            logger.warning(f"{config.name}: failed on {question}: {e}")
+            row["error"] = str(e)
+        return row
+
+    def run(self, configs: list[EvalConfig], questions: dict[str, list[str]]) -> pd.DataFrame:
+        """
+        Evaluate every question under every configuration, workers questions at a time.
+
+        Args:
+            configs (list[EvalConfig]): Configurations to score
+            questions (dict[str, list[str]]): Maps lecture name -> its questions
+
+        Returns:
+            pd.DataFrame: One row per configuration and question
+        """
+        chunk_configs = sorted({config.chunk_config for config in configs if config.chunk_config is not None})
+        index_dirs = self.build_video_indexes(chunk_configs) if chunk_configs else {}
+        retrievers = {config: self.retriever_for(config, index_dirs) for config in configs}
+
+        unmatched = [lecture for lecture in questions if lecture not in self.lecture_names]
+        if unmatched and any(config.filter == "lecture" for config in configs):
+            logger.warning(
+                f"No processed lecture of {self.course_name} named {', '.join(unmatched)}, "
+                f"their questions are skipped under the lecture filter"
+            )
+        tasks = [
+            (config, retrievers[config], question, lecture)
+            for config in configs
+            for lecture, lecture_questions in questions.items()
+            if config.filter != "lecture" or lecture in self.lecture_names
+            for question in lecture_questions
+        ]
+        rows = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="evaluate") as executor:
+            for done, row in enumerate(executor.map(lambda task: self.evaluate_question(*task), tasks), start=1):
+                rows.append(row)
+                if done % 20 == 0 or done == len(tasks):
+                    logger.info(f"Evaluated {done}/{len(tasks)}")
+        return pd.DataFrame(rows)
+
+
+def summarize(results: pd.DataFrame) -> pd.DataFrame:
+    """One row per configuration with the mean scores next to the latency percentiles"""
+    missing = [column for column in RESULT_COLUMNS if column not in results]
+    results = results.assign(**{column: np.nan for column in missing})
+    summary = results.groupby("config", sort=False).agg(
+        questions=("question", "size"),
+        errors=("error", "count"),
+        groundedness=("groundedness", "mean"),
+        answer_relevance=("answer_relevance", "mean"),
+        context_relevance=("context_relevance", "mean"),
+        retrieve_p50_ms=("retrieve_ms", "median"),
+        retrieve_p95_ms=("retrieve_ms", lambda ms: ms.quantile(0.95)),
+        ttft_p50_ms=("ttft_ms", "median"),
+        complete_p50_ms=("complete_ms", "median"),
+        prompt_tokens=("prompt_tokens", "mean"),
+        cached=("answer_cached", "mean"),
+    )
+    latencies = [column for column in summary if column.endswith("_ms")]
+    return summary.round({metric: 3 for metric in METRICS} | {column: 0 for column in latencies} | {"prompt_tokens": 0, "cached": 2})
+
+
+def parse_chunk_config(value: str) -> tuple[int, int]:
+    chunk_size, overlap = value.split(":")
+    return int(chunk_size), int(overlap)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score the course retriever across chunking and filter settings")
+    parser.add_argument("course_name")
+    parser.add_argument("--questions-dir", default="qna_for_eval")
+    parser.add_argument("--chunk-configs", nargs="*", type=parse_chunk_config, default=[], help="Video chunk_size:overlap in seconds besides the ingested 60:10, e.g. 30:5 120:20")
+    parser.add_argument("--filters", nargs="+", choices=FILTERS, default=FILTERS)
+    parser.add_argument("--model-name", default="mistral-large2")
+    parser.add_argument("--judge-model", default="mistral-large2")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=2.0, help="Model calls per second")
+    parser.add_argument("--no-cache", action="store_true", help="Call the models even for prompts answered before")
+    parser.add_argument("--save", help="Write the per-question results to this CSV file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    snow_conn = st.connection("snowflake")
+    lectures = sorted(DatabaseManager(snow_conn).get_catalog([args.course_name])[args.course_name])
+    if not lectures:
+        raise SystemExit(f"{args.course_name} has no processed lectures")
+
+    evaluator = Evaluator(
+        snow_conn.session(), args.course_name, lectures, model_name=args.model_name, judge_model=args.judge_model,
+        cache=None if args.no_cache else EvalCache(), rate=args.rate, workers=args.workers,
+    )
+    chunk_configs = [None, INGESTED_CHUNK_CONFIG, *(config for config in dict.fromkeys(args.chunk_configs) if config != INGESTED_CHUNK_CONFIG)]
+    configs = [EvalConfig(chunk_config, filter) for chunk_config in chunk_configs for filter in args.filters]
+    results = evaluator.run(configs, load_questions(args.questions_dir))
+
+    if args.save:
+        Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+        results.to_csv(args.save, index=False)
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(summarize(results).to_string())
@@ -0,0 +1,110 @@
+"""
+Turns the per-service search results of a turn into one ranked, non-redundant context.
+"""
+import re
+
+
+def split_sentences(text: str) -> list[str]:
+    return [sentence for sentence in re.split(r"(?<=[.!?])\s+", text.strip()) if sentence]
+
+
+def _sentence_key(sentence: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", sentence.lower()))
+
+
+def reciprocal_rank_fusion(documents: dict[str, list[dict]], k: int = 60) -> list[dict]:
+    """
+    Rank the results of every service together by reciprocal rank, 1 / (k + rank).
+
+    Returns:
+        list[dict]: Copies of the results with content_type and score keys, best first
+    """
+    fused = [
+        {**doc, "content_type": content_type, "score": 1.0 / (k + rank)}
+        for content_type, docs in documents.items()
+        for rank, doc in enumerate(docs, start=1)
+    ]
+    return sorted(fused, key=lambda doc: doc["score"], reverse=True)
+
+
+def _join_texts(texts: list[str]) -> str:
+    """Join texts in order, dropping sentences that were already included"""
+    seen, sentences = set(), []
+    for text in texts:
+        for sentence in split_sentences(text):
+            key = _sentence_key(sentence)
+            if key not in seen:
+                seen.add(key)
+                sentences.append(sentence)
+    return " ".join(sentences)
+
+
+def merge_video_windows(docs: list[dict], max_gap: float = 0.0) -> list[dict]:
+    """
+    Merge video results from the same file whose time spans overlap or are at most max_gap
+    seconds apart into one span. A merged result keeps the best score of its windows and
+    its text has the repeated overlap sentences removed.
+    """
+    others = [doc for doc in docs if doc["content_type"] != "video"]
+    by_file: dict[str, list[dict]] = {}
+    for doc in docs:
+        if doc["content_type"] == "video":
+            by_file.setdefault(doc["file_name"], []).append(doc)
+
+    merged = []
+    for windows in by_file.values():
+        windows = sorted(windows, key=lambda doc: float(doc["start_time"]))
+        group = [windows[0]]
+        for window in windows[1:]:
+            if float(window["start_time"]) <= max(float(doc["end_time"]) for doc in group) + max_gap:
+                group.append(window)
+            else:
+                merged.append(_merge_group(group))
+                group = [window]
+        merged.append(_merge_group(group))
+
+    return sorted(others + merged, key=lambda doc: doc["score"], reverse=True)
+
+
+def _merge_group(group: list[dict]) -> dict:
+    if len(group) == 1:
+        return group[0]
+    best = max(group, key=lambda doc: doc["score"])
+    return {
+        **best,
+        "text": _join_texts([doc["text"] for doc in group]),
+        "start_time": min(float(doc["start_time"]) for doc in group),
+        "end_time": max(float(doc["end_time"]) for doc in group),
+    }
+
+
+def dedup_sentences(docs: list[dict]) -> list[dict]:
+    """Drop sentences already present in a higher ranked result, and results left empty"""
+    seen, deduped = set(), []
+    for doc in docs:
+        sentences = []
+        for sentence in split_sentences(doc["text"]):
+            key = _sentence_key(sentence)
+            if key and key not in seen:
+                seen.add(key)
+                sentences.append(sentence)
+        if sentences:
+            deduped.append({**doc, "text": " ".join(sentences)})
+    return deduped
+
+
+def fuse_documents(documents: dict[str, list[dict]], limit: int = 6, k: int = 60, max_gap: float = 0.0) -> list[dict]:
+    """
+    Fuse the results of every service into a single ranked context.
+
+    Args:
+        documents (dict): Maps content type -> results in service rank order
+        limit (int): Maximum number of results to keep after merging
+        k (int): Reciprocal rank fusion constant
+        max_gap (float): Largest gap in seconds between video windows that are merged
+
+    Returns:
+        list[dict]: Results with content_type and score keys, best first
+    """
+    fused = merge_video_windows(reciprocal_rank_fusion(documents, k), max_gap)
+    return dedup_sentences(fused)[:limit]
@@ -1,27 +1,407 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Optional, Union
+import asyncio
+import logging
+import threading
+import time
+
+from snowflake.snowpark import Session
+
+from pipeline.warmup import warm_up_course
+from utility.cache import answer_cache, invalidate_course
 from utility.data_models import Video, Note
 from utility.database_manager import DatabaseManager
+from utility.file_manager import FileManager, file_hash
+from utility.search_backend import build_local_indexes, configured_backend
+from utility.page_renders import page_cache
+from utility.tracing import tracer
+from utility.transcription import DeepgramTranscriber, SegmentedTranscriber
+from utility.video_clips import clip_cache
+
+logger = logging.getLogger(__name__)
+
+STAGES = ["upload", "extract", "chunk", "load"]
+
+
+@dataclass
+class IngestJob:
+    """A single file moving through the ingestion stages"""
+
+    course_name: str
+    content_type: str
+    lecture_name: str
+    file_path: Path
+    # Manifest entry from the last successful ingestion of this file, if any
+    previous: Optional[dict] = None
+    source: Optional[Union[Note, Video]] = None
+    content_hash: Optional[str] = None
+    extractor_version: Optional[str] = None
+    chunk_config: Optional[str] = None
+    # Set when the file is unchanged since it was last ingested
+    skipped: bool = False
+    # Handoff from one stage to the next: S3 key, audio path or extracted pages
+    payload: Any = None
+    rows: Optional[list[tuple]] = None
 
 
 class ContentProcessor:
-    def __init__(self, db_manager: DatabaseManager):
+    def __init__(
+        self,
+        db_manager: DatabaseManager,
+        max_workers: int = 4,
+        queue_size: int = 2,
+        chunk_size: int = 60,
+        overlap: int = 10,
+        segment_seconds: Optional[float] = 600.0,
+        max_segment_workers: int = 8,
+        warmup_questions_dir: Optional[str] = "qna_for_eval",
+        search_lag: float = 60.0,
+        session: Optional[Session] = None,
+    ):
         self.db_manager = db_manager
+        self.queue_size = queue_size
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        # Long lectures are transcribed as concurrent segments, with one pool bounding the
+        # requests in flight across every video. None sends every lecture whole.
+        self.transcriber = (
+            SegmentedTranscriber(DeepgramTranscriber(), segment_seconds, max_workers=max_segment_workers)
+            if segment_seconds
+            else DeepgramTranscriber()
+        )
+        # Question bank answered into the answer cache after every ingestion, None to skip
+        self.warmup_questions_dir = warmup_questions_dir
+        # TARGET_LAG of the Cortex Search services, waited out before warming up
+        self.search_lag = search_lag
+        # The app's Snowpark session the warm-up answers with, None to skip the warm-up
+        self.session = session
+        # Concurrent jobs per stage. Loading stays at 1 so inserts are serialized.
+        self.stage_limits = {"upload": max_workers, "extract": max_workers, "chunk": 1, "load": 1}
+
+    def _fingerprint(self, job: IngestJob):
+        """Sets the source, content hash, extractor version and chunk config the manifest compares"""
+        if job.content_type == "pdf":
+            job.source = Note(file_path=str(job.file_path))
+            job.content_hash = file_hash(job.file_path)
+            job.extractor_version = f"pdfium+textract/{Note.extractor_version}"
+            job.chunk_config = "page"
+        else:
+            job.source = Video(file_path=str(job.file_path), transcriber=self.transcriber)
+            # The shared transcript cache memoizes the hash by path, size and mtime, so an unchanged file is read once per process
+            job.content_hash = job.source.cache.file_hash(str(job.file_path)) if job.source.cache else file_hash(job.file_path)
+            job.extractor_version = f"{job.source.transcriber.model}/{Video.extractor_version}"
+            job.chunk_config = f"{self.chunk_size}/{self.overlap}"
+
+    def _upload(self, job: IngestJob):
+        """
+        Skips files unchanged since their last ingestion. Otherwise PDFs are uploaded to S3
+        and videos have their audio extracted (unless the transcript is cached).
+        """
+        self._fingerprint(job)
+        if job.previous and all(
+            job.previous[key] == getattr(job, key) for key in ["content_hash", "extractor_version", "chunk_config"]
+        ):
+            job.skipped = True
+            return
+
+        if job.content_type == "pdf":
+            job.payload = job.source._upload()
+        elif not job.source._load_cached_transcript():
+            job.payload = job.source._extract_audio()
+
+    def _extract(self, job: IngestJob):
+        """Reads the text layer or runs Textract, or Deepgram, and prepares page images and video clipping for the portals"""
+        if job.content_type == "pdf":
+            job.payload = job.source._extract(job.payload)
+        elif job.payload is not None:
+            job.source._transcribe_audio(job.payload)
+
+        # Previews fall back to rendering on demand, so a failure here is not fatal
+        cache = page_cache if job.content_type == "pdf" else clip_cache
+        try:
+            cache.prepare(str(job.file_path))
+        except Exception as e:
+            logger.warning(f"Failed to prepare previews of {job.file_path}: {e}")
+
+    def _chunk(self, job: IngestJob):
+        """Turns the extracted content into table rows"""
+        file_name, lecture_name = job.file_path.name, job.lecture_name
+        if job.content_type == "pdf":
+            note = job.source
+            note.num_pages, note.content, note.chunks = note._split_pages(job.payload)
+            job.rows = [(chunk.text, chunk.page_num, file_name, lecture_name, chunk.extraction) for chunk in note.chunks]
+        else:
+            video = job.source
+            video.process_content(self.chunk_size, self.overlap)
+            job.rows = [(chunk.text, chunk.start, chunk.end, file_name, lecture_name) for chunk in video.chunks]
+        job.payload = None
+
+    def _load(self, jobs: list[IngestJob]) -> list[tuple[IngestJob, Optional[Exception]]]:
+        """
+        Replaces the previous chunks (if any) of a batch of files in one transaction and
+        records them in the manifest. If the batch fails, every file is retried on its own
+        so one bad file does not fail the others.
+
+        Returns:
+            list: (job, error or None) per file
+        """
+        def file_chunks(job: IngestJob) -> dict:
+            return {
+                "content_type": job.content_type,
+                "lecture_name": job.lecture_name,
+                "file_name": job.file_path.name,
+                "rows": job.rows,
+                "content_hash": job.content_hash,
+                "extractor_version": job.extractor_version,
+                "chunk_config": job.chunk_config,
+            }
+
+        course_name = jobs[0].course_name
+        with tracer.span("ingest.load", files=len(jobs), rows=sum(len(job.rows) for job in jobs)):
+            try:
+                self.db_manager.replace_files_chunks(course_name, [file_chunks(job) for job in jobs])
+                return [(job, None) for job in jobs]
+            except Exception as e:
+                if len(jobs) == 1:
+                    return [(jobs[0], e)]
+                logger.warning(f"Loading {len(jobs)} files together failed, loading them one by one: {e}")
+
+            results = []
+            for job in jobs:
+                try:
+                    self.db_manager.replace_files_chunks(course_name, [file_chunks(job)])
+                    results.append((job, None))
+                except Exception as e:
+                    results.append((job, e))
+            return results
+
+    async def _run_stage(
+        self,
+        stage: str,
+        handler: Callable[[IngestJob], None],
+        executor: Optional[ThreadPoolExecutor],
+        inbox: asyncio.Queue,
+        outbox: Optional[asyncio.Queue],
+        status,
+        failed: list[tuple[str, str]],
+    ):
+        """
+        Pulls jobs from inbox, runs the blocking handler off the event loop and pushes
+        the job to outbox. A full outbox blocks the workers, which is what throttles the
+        stages upstream. Streamlit calls only happen here, on the event loop thread.
+        """
+        loop = asyncio.get_running_loop()
+
+        async def worker():
+            while (job := await inbox.get()) is not None:
+                status.update(label=f"{stage.capitalize()}: {job.file_path.name}")
+                try:
+                    await loop.run_in_executor(executor, tracer.propagate(self._run_handler), stage, handler, job)
+                except Exception as e:
+                    logger.exception(f"Failed to {stage} {job.file_path}")
+                    status.write(f"❌ {job.file_path.name} ({stage}): {e}")
+                    failed.append((job.file_path.name, str(e)))
+                    continue
+
+                if job.skipped:
+                    status.write(f"⏭️ {job.file_path.name} is unchanged, skipped")
+                elif outbox is not None:
+                    await outbox.put(job)
+                else:
+                    status.write(f"✅ {job.file_path.name}")
+
+        await asyncio.gather(*(worker() for _ in range(self.stage_limits[stage])))
+
+    async def _run_load_stage(self, executor: ThreadPoolExecutor, inbox: asyncio.Queue, status, failed: list[tuple[str, str]]):
+        """
+        Collects chunked files until they add up to bulk_load_threshold rows, or the stages
+        upstream are done, and loads them as one batch. A single lecture is far below the
+        threshold, so loading file by file would never use the staged bulk load.
+        """
+        loop = asyncio.get_running_loop()
+        batch, done = [], False
+        while not done:
+            job = await inbox.get()
+            if job is None:
+                done = True
+            else:
+                batch.append(job)
+            if not batch or (not done and sum(len(job.rows) for job in batch) < self.db_manager.bulk_load_threshold):
+                continue
+
+            status.update(label=f"Load: {len(batch)} files")
+            try:
+                results = await loop.run_in_executor(executor, tracer.propagate(self._load), batch)
+            except Exception as e:
+                results = [(job, e) for job in batch]
+            for job, error in results:
+                if error is None:
+                    status.write(f"✅ {job.file_path.name}")
+                else:
+                    logger.error(f"Failed to load {job.file_path}: {error}")
+                    status.write(f"❌ {job.file_path.name} (load): {error}")
+                    failed.append((job.file_path.name, str(error)))
+            batch = []
+
+    @staticmethod
+    def _run_handler(stage: str, handler: Callable[[IngestJob], None], job: IngestJob):
+        with tracer.span(f"ingest.{stage}", file=job.file_path.name, content_type=job.content_type) as span:
+            handler(job)
+            span.set_attribute("skipped", job.skipped)
+
+    async def _process_files_async(
+        self, course_name: str, files_to_upload: dict, manifest: dict, status
+    ) -> list[tuple[str, str]]:
+        jobs = [
+            IngestJob(course_name, content_type, lecture_name, path, previous=manifest.get((lecture_name, path.name)))
+            for content_type in ["pdf", "video"]
+            for lecture_name, path in files_to_upload[content_type]
+        ]
+
+        queues = {stage: asyncio.Queue(maxsize=self.queue_size) for stage in STAGES}
+        handlers = {"upload": self._upload, "extract": self._extract, "chunk": self._chunk}
+        failed = []
+
+        async def feed():
+            for job in jobs:
+                await queues["upload"].put(job)
+            for _ in range(self.stage_limits["upload"]):
+                await queues["upload"].put(None)
+
+        async def run(stage: str, next_stage: Optional[str], executor: Optional[ThreadPoolExecutor]):
+            outbox = queues[next_stage] if next_stage else None
+            await self._run_stage(stage, handlers[stage], executor, queues[stage], outbox, status, failed)
+            # Once every worker of this stage is done, release the workers downstream
+            if next_stage:
+                for _ in range(self.stage_limits[next_stage]):
+                    await outbox.put(None)
+
+        # Inserts always run on the same dedicated thread so the connection is never shared
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-load") as load_executor:
+            await asyncio.gather(
+                feed(),
+                run("upload", "extract", None),
+                run("extract", "chunk", None),
+                run("chunk", "load", None),
+                self._run_load_stage(load_executor, queues["load"], status, failed),
+            )
+
+        return failed
+
+    def _record_legacy_files(self, course_name: str, status) -> int:
+        """
+        Adds manifest entries for files ingested before the manifest existed, so upgrading
+        does not transcribe and extract a whole course again. Files with chunks and no entry
+        are recorded with the hash of the file on disk and the current extractor version and
+        chunk config, as if this version had ingested them. Files no longer on disk are
+        recorded too, so _remove_deleted_files drops their chunks.
+
+        Returns:
+            int: Number of files recorded
+        """
+        unrecorded = self.db_manager.get_unrecorded_files(course_name)
+        if not unrecorded:
+            return 0
+
+        status.update(label="Recording previously ingested files")
+        file_manager = FileManager()
+        entries = []
+        for (lecture_name, file_name), (content_type, num_chunks) in unrecorded.items():
+            file_path = file_manager.base_path / course_name / lecture_name / file_name
+            if not file_path.exists():
+                entries.append((file_name, lecture_name, content_type, None, None, None, num_chunks))
+                continue
+            job = IngestJob(course_name, content_type, lecture_name, file_path)
+            self._fingerprint(job)
+            entries.append((file_name, lecture_name, content_type, job.content_hash, job.extractor_version, job.chunk_config, num_chunks))
+        self.db_manager.record_files(course_name, entries)
+        logger.info(f"Recorded {len(entries)} files of {course_name} ingested before the manifest")
+        return len(entries)
+
+    def _remove_deleted_files(self, course_name: str, manifest: dict, status):
+        file_manager = FileManager()
+        for (lecture_name, file_name), entry in manifest.items():
+            if not (file_manager.base_path / course_name / lecture_name / file_name).exists():
+                status.update(label=f"Removing deleted file: {file_name}")
+                self.db_manager.remove_file(course_name, entry["content_type"], lecture_name, file_name)
+                status.write(f"🗑️ {file_name} was deleted, removed its chunks")
+
+    def _start_warm_up(self, course_name: str, status) -> Optional[threading.Thread]:
+        """
+        Answers the question bank again in the background, since the course's cached answers
+        were just dropped. With Cortex Search the new chunks are only searchable after the
+        services' target lag, so that is waited out first. The warm-up reuses the session
+        the processor was given rather than opening another one, and without one nothing
+        is warmed up.
+
+        Returns:
+            Optional[threading.Thread]: The warm-up thread, None if it was not started
+        """
+        if self.warmup_questions_dir is None or self.session is None:
+            return None
+        lectures = sorted(self.db_manager.get_catalog([course_name])[course_name])
+        if not lectures:
+            return None
+
+        generation = answer_cache.generation(course_name)
+        delay = self.search_lag if configured_backend() == "cortex" else 0.0
+
+        def run():
+            time.sleep(delay)
+            try:
+                for scope, (answered, cached) in warm_up_course(
+                    self.session, course_name, lectures, self.warmup_questions_dir, generation=generation
+                ).items():
+                    logger.info(f"Warm-up of {course_name} ({scope}): {answered} answered, {cached} already cached")
+            except Exception as e:
+                logger.warning(f"Warm-up of {course_name} failed: {e}")
+
+        thread = threading.Thread(target=run, name=f"warmup-{course_name}", daemon=True)
+        thread.start()
+        status.write("🔥 Warming up the answer cache in the background")
+        return thread
+
+    def process_files(self, course_name: str, files_to_upload: dict, status) -> list[tuple[str, str]]:
+        """
+        Ingests files through a staged pipeline: upload -> extract -> chunk -> load.
+
+        Files whose content hash, extractor version and chunk config match the manifest are
+        skipped, changed files have their chunks replaced atomically, and chunks of files that
+        were deleted from the course folder are removed.
+
+        Stages are connected by bounded queues (queue_size) and run up to stage_limits[stage]
+        files at a time, so one file is chunked while the next is still transcribing. Chunked
+        files are loaded in batches of at least the database's bulk_load_threshold rows, one
+        transaction per batch, serialized on a single thread. A failing file is reported
+        through status and skipped without aborting the others.
+
+        Returns:
+            list[tuple[str, str]]: (file_name, error) for every file that failed
+        """
+        total = len(files_to_upload['pdf']) + len(files_to_upload['video'])
+        with tracer.span("ingest", course=course_name, files=total) as span:
+            # Courses created before the manifest existed get one here
+            self.db_manager.create_table(course_name)
+            self._record_legacy_files(course_name, status)
+            manifest = self.db_manager.get_manifest(course_name)
+            self._remove_deleted_files(course_name, manifest, status)
+
+            failed = asyncio.run(self._process_files_async(course_name, files_to_upload, manifest, status))
+            span.set_attribute("failed", len(failed))
+
+            status.update(label="Creating search service")
+            with tracer.span("ingest.search_service"):
+                self.db_manager.create_search_service(course_name)
+            if configured_backend() == "local":
+                status.update(label="Building local search index")
+                with tracer.span("ingest.local_index"):
+                    build_local_indexes(self.db_manager, course_name)
+            self.db_manager.invalidate_catalog(course_name)
+            invalidate_course(course_name)
+            self._start_warm_up(course_name, status)
 
-    def process_files(self, course_name: str, files_to_upload: dict, status):
-        for pdf_file in files_to_upload['pdf']:
-            lecture_name, pdf_file_path = pdf_file
-            status.update(label=f"Processing PDF: {pdf_file_path.name}")
-            note = Note(file_path=str(pdf_file_path))
-            note.process_content()
-            data = [(chunk.text, chunk.page_num, pdf_file_path.name, lecture_name) for chunk in note.chunks]
-            self.db_manager.insert_data(course_name, data, "pdf")
-        
-        for video_file in files_to_upload['video']:
-            lecture_name, video_file_path = video_file
-            status.update(label=f"Processing Video: {video_file_path.name}")
-            video = Video(file_path=str(video_file_path))
-            video.process_content()
-            data = [(chunk.text, chunk.start, chunk.end, video_file_path.name, lecture_name) for chunk in video.chunks]
-            self.db_manager.insert_data(course_name, data, "video")
-
-        status.update(label="Creating search service")
-        self.db_manager.create_search_service(course_name)
+        if failed:
+            status.update(label=f"{len(failed)} of {total} files failed to process", state="error", expanded=True)
+        return failed
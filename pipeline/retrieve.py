@@ -1,37 +1,179 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Iterator, Optional
+import copy
+import logging
+import re
+import threading
+import time
+
 from snowflake.cortex import Complete
 from snowflake.snowpark import Session
 from snowflake.core import Root
 
+from pipeline.context import ContextBudget, budget_history, budget_passages, estimate_tokens, truncate_to_tokens
+from pipeline.fusion import fuse_documents
+from utility.cache import answer_cache, embed_text, retrieval_cache
+from utility.search_backend import (
+    CortexSearchBackend,
+    LocalSearchBackend,
+    SearchBackend,
+    configured_backend,
+    local_index_dir,
+)
+from utility.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Searches are I/O bound, so a pool shared by every retriever is enough
+_search_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="search")
+# Speculative retrieves wait on the search pool, so they run on their own threads
+_speculation_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculate")
+
+# Words that only make sense with earlier turns in mind
+REFERENCE_WORDS = {
+    "former", "latter", "above", "previous", "earlier", "aforementioned", "same", "again",
+    "else", "another", "one", "ones",
+}
+# Pronouns can also point back to a subject named earlier in the same question
+PRONOUNS = {"it", "its", "they", "them", "their", "theirs", "he", "him", "his", "she", "her", "hers"}
+# Demonstratives are references unless they follow a noun ("the model that predicts")
+DEMONSTRATIVES = {"this", "that", "these", "those"}
+FUNCTION_WORDS = {
+    "is", "are", "was", "were", "be", "do", "does", "did", "can", "could", "would", "should",
+    "of", "about", "on", "in", "for", "with", "by", "to", "from", "and", "or", "but",
+    "what", "why", "how", "when", "where", "which", "who", "explain", "mean", "means",
+}
+CLAUSE_BREAKS = {"and", "or", "but", "because", "so", "which", "when", "if", "while", "where"}
+# Openers of a follow-up ("and why?", "what about mammography?", "more examples")
+FOLLOW_UP_PREFIXES = (
+    "and", "but", "so", "also", "then", "or", "what about", "how about", "why not",
+    "more", "elaborate", "explain more", "tell me more", "go on", "continue", "example",
+)
+
+
+def is_standalone(query: str, min_words: int = 4) -> bool:
+    """
+    Cheap check for whether a question can be understood without the chat history.
+
+    A question is treated as a follow-up when it is very short, starts like a follow-up,
+    contains a reference word, uses a pronoun before naming anything it could point to,
+    or uses a demonstrative on its own ("an example of that"). Misses only cost retrieval
+    quality on a single turn, so the check errs on the side of rewriting.
+    """
+    words = re.findall(r"[a-z']+", query.lower())
+    if len(words) < min_words:
+        return False
+    if " ".join(words).startswith(FOLLOW_UP_PREFIXES):
+        return False
+
+    first_clause = True
+    for idx, word in enumerate(words):
+        previous = words[idx - 1] if idx else None
+        if word in REFERENCE_WORDS:
+            return False
+        if word in PRONOUNS and first_clause:
+            return False
+        if word in DEMONSTRATIVES and (previous is None or previous in FUNCTION_WORDS):
+            return False
+        if word in CLAUSE_BREAKS and idx:
+            first_clause = False
+    return True
+
+
 class ContentRetriever():
 
     def __init__(
         self,
-        session: Session,
+        session: Optional[Session],
         course_name: str,
         model_name: str = "mistral-large2",
         msg_limit: int = 6,
+        search_timeout: float = 10.0,
+        use_cache: bool = True,
+        use_answer_cache: bool = True,
+        rewrite_mode: str = "auto",
+        speculative_retrieval: bool = True,
+        speculation_threshold: float = 0.95,
+        search_backend: Optional[str] = None,
+        candidate_pool: int = 8,
+        context_limit: int = 6,
+        context_budget: Optional[ContextBudget] = None,
     ):
+        # Passed to every Cortex call, the active session is ambiguous once the app holds two
+        self.session = session
         self.course_name = course_name
         self.model_name = model_name
         self.msg_limit = msg_limit
+        self.search_timeout = search_timeout
+        self.use_cache = use_cache
+        self.use_answer_cache = use_answer_cache
+        # "auto" skips the rewrite for standalone questions, "always" rewrites every follow-up turn
+        if rewrite_mode not in ("auto", "always"):
+            raise ValueError(f"Unknown rewrite mode: {rewrite_mode}")
+        self.rewrite_mode = rewrite_mode
+        # The speculative search updates the stats from another thread, read them with stats()
+        self._stats_lock = threading.Lock()
+        # Skipped rewrites are credited with the average latency of the rewrites that ran
+        self.rewrite_stats = {"turns": 0, "rewrites": 0, "skipped": 0, "rewrite_time": 0.0, "time_saved": 0.0}
+        # Retrieve with the raw query while the rewrite runs, kept when the rewrite is this similar
+        self.speculative_retrieval = speculative_retrieval
+        self.speculation_threshold = speculation_threshold
+        self.speculation_stats = {"speculations": 0, "hits": 0, "misses": 0, "time_saved": 0.0}
         self.system_prompt = """
         You are a knowledgeable teaching assistant helping university students learn from their lecture materials. Use the provided context from lecture videos and notes to answer questions. If the context doesn't contain relevant information, simply state that you don't know. Keep responses friendly but concise, using no more than three sentences. For general greetings or casual conversation, respond naturally without needing context.
         """
 
-        root = Root(session)
-        db, schema = (
-            session.get_current_database(),
-            session.get_current_schema(),
-        )
+        # Results fetched per service, fused into at most context_limit prompt passages
+        self.candidate_pool = candidate_pool
+        self.context_limit = context_limit
+        self.context_budget = context_budget or ContextBudget()
+        # Estimated prompt tokens per part of the last completion
+        self.context_tokens: dict[str, int] = {}
+        # "cortex" or "local", defaults to the one in secrets.toml
+        self.search_backend = search_backend or configured_backend()
+        if self.search_backend == "cortex":
+            root = Root(session)
+            db, schema = (
+                session.get_current_database(),
+                session.get_current_schema(),
+            )
 
-        source = root.databases[db].schemas[schema]
-        self.pdf_service = source.cortex_search_services[f'{course_name}_pdf']
-        self.video_service = source.cortex_search_services[f'{course_name}_video']
+            source = root.databases[db].schemas[schema]
+            self.pdf_service = CortexSearchBackend(source.cortex_search_services[f'{course_name}_pdf'])
+            self.video_service = CortexSearchBackend(source.cortex_search_services[f'{course_name}_video'])
+        else:
+            self.pdf_service = self._local_backend(session, "pdf")
+            self.video_service = self._local_backend(session, "video")
 
         base_columns = ["text", "file_name", "lecture_name"]
         self.pdf_columns = base_columns + ["page_num"]
         self.video_columns = base_columns + ["start_time", "end_time"]
 
+        # Every content type is searched concurrently, new ones only need an entry here
+        self.search_targets: dict[str, tuple[SearchBackend, list[str]]] = {
+            "pdf": (self.pdf_service, self.pdf_columns),
+            "video": (self.video_service, self.video_columns),
+        }
+        # Per backend: calls, timeouts, errors, total and last latency in seconds
+        self.search_stats = {
+            content_type: {"calls": 0, "timeouts": 0, "errors": 0, "total_time": 0.0, "last_time": None}
+            for content_type in self.search_targets
+        }
+
+    def _local_backend(self, session: Optional[Session], content_type: str) -> LocalSearchBackend:
+        """Open the course's local index, building it from the chunk tables if it is missing"""
+        index_dir = local_index_dir(self.course_name, content_type)
+        if not LocalSearchBackend.exists(index_dir):
+            if session is None:
+                raise FileNotFoundError(f"No local search index at {index_dir}")
+            table_name = f"{self.course_name}_{content_type}"
+            rows = [
+                {column.lower(): value for column, value in row.as_dict().items()}
+                for row in session.sql(f"SELECT * FROM {table_name}").collect()
+            ]
+            LocalSearchBackend.build(index_dir, rows)
+        return LocalSearchBackend(index_dir)
+
     def contextualize(self, query: str, chat_history: list[dict]) -> str:
         """
         Contextualize the query with the chat history. 
@@ -46,37 +188,341 @@ class ContentRetriever():
         messages = [{"role": "system", "content": context_prompt}]
         messages.extend(chat_history[-self.msg_limit:])
         messages.append({"role": "user", "content": f'Question to reformulate: {query}'})
-        return Complete(model=self.model_name, prompt=messages)
+        return Complete(model=self.model_name, prompt=messages, session=self.session)
+
+    def standalone_query(self, query: str, chat_history: list[dict]) -> str:
+        """
+        Get a question that can be searched without the chat history, only calling
+        contextualize when there is history and the question looks like a follow-up.
+        """
+        if not chat_history:
+            return query
 
-    def complete(self, query: str, documents: dict, chat_history: list[dict]):
+        stats = self.rewrite_stats
+        if self.rewrite_mode == "auto" and is_standalone(query):
+            with self._stats_lock:
+                stats["turns"] += 1
+                stats["skipped"] += 1
+                if stats["rewrites"]:
+                    stats["time_saved"] += stats["rewrite_time"] / stats["rewrites"]
+            logger.info(f"Skipped rewrite of standalone question: {query}")
+            return query
+
+        start_time = time.perf_counter()
+        with tracer.span("contextualize", model=self.model_name, history_messages=len(chat_history)):
+            context_query = self.contextualize(query, chat_history)
+        with self._stats_lock:
+            stats["turns"] += 1
+            stats["rewrites"] += 1
+            stats["rewrite_time"] += time.perf_counter() - start_time
+        return context_query
+
+    def retrieve_for_turn(
+        self, query: str, chat_history: list[dict], lecture_names: list[str], limit: Optional[int] = None
+    ) -> tuple[str, dict]:
+        """
+        Get the standalone question of a chat turn and its documents.
+
+        When the question needs a rewrite, retrieval with the raw query starts alongside it.
+        The speculative documents are used if the rewritten question is effectively the same
+        (identical once normalized, or embedding similarity of at least speculation_threshold),
+        otherwise the rewritten question is searched once the rewrite returns.
+
+        Returns:
+            tuple: Contains (standalone question, documents)
+        """
+        needs_rewrite = bool(chat_history) and (self.rewrite_mode == "always" or not is_standalone(query))
+        with tracer.span("retrieve_for_turn", course=self.course_name, needs_rewrite=needs_rewrite) as span:
+            if not (needs_rewrite and self.speculative_retrieval):
+                context_query = self.standalone_query(query, chat_history)
+                return context_query, self.retrieve(context_query, lecture_names, limit)
+            return self._retrieve_speculatively(query, chat_history, lecture_names, limit, span)
+
+    def _retrieve_speculatively(
+        self, query: str, chat_history: list[dict], lecture_names: list[str], limit: Optional[int], span
+    ) -> tuple[str, dict]:
+        """Rewrite the question while retrieving with the raw one, see retrieve_for_turn"""
+
+        def speculate():
+            start_time = time.perf_counter()
+            documents = self.retrieve(query, lecture_names, limit)
+            return documents, time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        speculation = _speculation_executor.submit(tracer.propagate(speculate))
+        rewrite_start = time.perf_counter()
+        context_query = self.standalone_query(query, chat_history)
+        rewrite_time = time.perf_counter() - rewrite_start
+
+        stats = self.speculation_stats
+        if self._same_query(query, context_query):
+            try:
+                documents, retrieve_time = speculation.result()
+            except Exception as e:
+                logger.warning(f"Speculative retrieval failed: {e}")
+            else:
+                # Run one after the other, the turn would have waited for both
+                time_saved = max(rewrite_time + retrieve_time - (time.perf_counter() - start_time), 0.0)
+                with self._stats_lock:
+                    stats["speculations"] += 1
+                    stats["hits"] += 1
+                    stats["time_saved"] += time_saved
+                span.set_attribute("speculation", "hit")
+                return context_query, documents
+
+        # The speculative search keeps running and still fills the retrieval cache
+        with self._stats_lock:
+            stats["speculations"] += 1
+            stats["misses"] += 1
+        span.set_attribute("speculation", "miss")
+        return context_query, self.retrieve(context_query, lecture_names, limit)
+
+    def stats(self) -> dict:
+        """A consistent copy of the rewrite, speculation and search stats"""
+        with self._stats_lock:
+            return copy.deepcopy(
+                {"rewrite": self.rewrite_stats, "speculation": self.speculation_stats, "search": self.search_stats}
+            )
+
+    def _same_query(self, query: str, other: str) -> bool:
+        if self._normalize_query(query) == self._normalize_query(other):
+            return True
+        return float(embed_text(query) @ embed_text(other)) >= self.speculation_threshold
+
+    def complete(
+        self,
+        query: str,
+        documents: dict,
+        chat_history: list[dict],
+        lecture_names: Optional[list[str]] = None,
+        standalone_query: Optional[str] = None,
+    ) -> Iterator[str]:
         """
         Get a completion from the Snowflake Cortex model.
         Chat history must contain a role key and a content key.
         The role key must be either "system", "user", or "assistant".
+
+        When lecture_names is given, answers are looked up in the semantic answer cache by
+        the standalone question (the query itself when there is no chat history), and a hit
+        is streamed back without calling the model. Fully streamed answers are added to it.
         """
-        messages = [{"role": "system", "content": self.system_prompt}]
-        messages.extend(chat_history[-self.msg_limit :])
-        prompt = f'Context: {self._parse_docs(documents)}\nQuestion: {query}\nAnswer:'
+        cache_query = standalone_query or (query if not chat_history else None)
+        use_answer_cache = self.use_answer_cache and lecture_names is not None and cache_query
+        if use_answer_cache:
+            with tracer.span("answer_cache_lookup") as span:
+                answer = answer_cache.lookup(self.course_name, self.model_name, lecture_names, cache_query, session=self.session)
+                span.set_attribute("hit", answer is not None)
+            if answer is not None:
+                logger.info(f"Answer cache hit for: {cache_query}")
+                return self._stream_text(answer)
+
+        with tracer.span("build_prompt"):
+            messages = self._build_messages(query, documents, chat_history)
+        # Ends once the caller has consumed the stream
+        span = tracer.start_span("complete", model=self.model_name, prompt_tokens=self.context_tokens.get("total", 0))
+        response_stream = self._trace_stream(Complete(model=self.model_name, prompt=messages, stream=True, session=self.session), span)
+        if not use_answer_cache:
+            return response_stream
+        return self._cache_stream(response_stream, lecture_names, cache_query)
+
+    def build_prompt(self, query: str, documents: dict, chat_history: list[dict]) -> tuple[list[dict], list[dict], dict]:
+        """
+        Assemble the completion prompt with every part trimmed to context_budget. Leaves the
+        retriever untouched, so it can be called from several threads at once.
+
+        Returns:
+            tuple: Contains (messages, the context passages in them, estimated tokens per part)
+        """
+        budget = self.context_budget
+        passages, tokens = self._budget_context(documents)
+        system_prompt = truncate_to_tokens(self.system_prompt, budget.system)
+        history, history_tokens = budget_history(chat_history[-self.msg_limit :], budget.history)
+
+        messages = [{"role": "system", "content": system_prompt}]
+        messages.extend(history)
+        prompt = f'Context: {self._render_passages(passages)}\nQuestion: {query}\nAnswer:'
         messages.append({"role": "user", "content": prompt})
 
-        return Complete(model=self.model_name, prompt=messages, stream=True)
+        tokens.update(
+            system=estimate_tokens(system_prompt),
+            history=history_tokens,
+            question=estimate_tokens(query),
+            total=sum(estimate_tokens(message["content"]) for message in messages),
+        )
+        return messages, passages, tokens
+
+    def _build_messages(self, query: str, documents: dict, chat_history: list[dict]) -> list[dict]:
+        """Build the completion prompt and record its estimated tokens per part in context_tokens"""
+        messages, _, self.context_tokens = self.build_prompt(query, documents, chat_history)
+        logger.info(f"Prompt tokens: {self.context_tokens}")
+        return messages
+
+    def _cache_stream(self, response_stream: Iterator[str], lecture_names: list[str], cache_query: str) -> Iterator[str]:
+        """Passes the stream through, caching the answer once it was consumed to the end"""
+        pieces = []
+        for piece in response_stream:
+            pieces.append(piece)
+            yield piece
+
+        answer = "".join(pieces).strip()
+        if answer:
+            answer_cache.add(self.course_name, self.model_name, lecture_names, cache_query, answer, session=self.session)
+
+    @staticmethod
+    def _trace_stream(response_stream: Iterator[str], span) -> Iterator[str]:
+        """Passes the stream through, recording the time to the first piece and the piece count on span"""
+        if not span:
+            return response_stream
 
-    def retrieve(self, query: str, lecture_names: list[str], limit: int = 3) -> dict:
+        def traced():
+            pieces, error = 0, None
+            try:
+                for piece in response_stream:
+                    if not pieces:
+                        span.set_attribute("time_to_first_token_ms", round(span.duration_ms, 1))
+                    pieces += 1
+                    yield piece
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                span.set_attribute("pieces", pieces)
+                span.end(error)
+        return traced()
+
+    @staticmethod
+    def _stream_text(text: str) -> Iterator[str]:
+        """Stream a cached answer word by word, like the model would"""
+        yield from re.findall(r"\S+\s*|\s+", text)
+
+    def retrieve(
+        self, query: str, lecture_names: list[str], limit: Optional[int] = None, timeout: Optional[float] = None
+    ) -> dict:
+        """
+        Retrieve up to limit (defaults to candidate_pool) documents from every search service concurrently.
+
+        A service that does not answer within timeout (defaults to search_timeout) or fails
+        contributes no documents, so the turn still gets the other results. Only when every
+        service fails is the first error raised.
+
+        Complete results are cached process wide by normalized query, course, lecture filter
+        and limit. Ingesting or deleting the course drops its entries.
         """
-        Retrieve documents from cortex search service.
+        limit = self.candidate_pool if limit is None else limit
+        cache_key = (
+            self.course_name,
+            self._normalize_query(query),
+            tuple(sorted(set(lecture_names))),
+            limit,
+        )
+        with tracer.span("retrieve", limit=limit, lectures=len(lecture_names)) as span:
+            if self.use_cache:
+                cached = retrieval_cache.get(cache_key)
+                span.set_attribute("cache_hit", cached is not None)
+                if cached is not None:
+                    return {content_type: list(docs) for content_type, docs in cached.items()}
+
+            documents, complete = self._search(query, lecture_names, limit, timeout)
+            # Partial results from a slow or failing service are not worth keeping
+            if self.use_cache and complete:
+                retrieval_cache.set(cache_key, {content_type: list(docs) for content_type, docs in documents.items()})
+            return documents
+
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        return " ".join(query.lower().split()).rstrip("?!. ")
+
+    def _search(self, query: str, lecture_names: list[str], limit: int, timeout: Optional[float]) -> tuple[dict, bool]:
+        """
+        Returns:
+            tuple: Contains (documents, whether every service answered)
         """
         filter_query = {
             "@or": [{"@eq": {"lecture_name": lecture}} for lecture in lecture_names]
         }
-        pdf_documents = self.pdf_service.search(
-            query, columns=self.pdf_columns, limit=limit, filter=filter_query
-        )
-        video_documents = self.video_service.search(
-            query, columns=self.video_columns, limit=limit, filter=filter_query
-        )
-        return {'pdf': pdf_documents.results, 'video': video_documents.results}
+        timeout = self.search_timeout if timeout is None else timeout
+
+        latencies = {}
+
+        def search(content_type, service, columns):
+            start_time = time.perf_counter()
+            try:
+                with tracer.span(f"search.{content_type}", backend=self.search_backend) as span:
+                    results = service.search(query, columns=columns, limit=limit, filter=filter_query)
+                    span.set_attribute("results", len(results))
+                    return results
+            finally:
+                latencies[content_type] = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        futures = {
+            content_type: _search_executor.submit(tracer.propagate(search), content_type, service, columns)
+            for content_type, (service, columns) in self.search_targets.items()
+        }
+        wait(futures.values(), timeout=timeout)
+        elapsed = time.perf_counter() - start_time
+
+        # Gathered for this call first, the speculative search of the same turn runs concurrently
+        documents, errors, times, outcomes = {}, [], {}, {}
+        for content_type, future in futures.items():
+            documents[content_type] = []
+            if not future.done():
+                # The call keeps running in the background, its result is dropped
+                times[content_type], outcomes[content_type] = elapsed, "timeouts"
+                logger.warning(f"{content_type} search timed out after {timeout}s")
+            else:
+                times[content_type] = latencies[content_type]
+                if future.exception() is not None:
+                    outcomes[content_type] = "errors"
+                    errors.append(future.exception())
+                    logger.warning(f"{content_type} search failed: {future.exception()}")
+                else:
+                    documents[content_type] = future.result()
+
+        with self._stats_lock:
+            for content_type, seconds in times.items():
+                stats = self.search_stats[content_type]
+                stats["calls"] += 1
+                if content_type in outcomes:
+                    stats[outcomes[content_type]] += 1
+                stats["last_time"] = seconds
+                stats["total_time"] += seconds
+
+        if len(errors) == len(futures):
+            raise errors[0]
+
+        logger.info("Search latency: " + ", ".join(f"{content_type}={seconds:.3f}s" for content_type, seconds in times.items()))
+        return documents, all(future.done() and future.exception() is None for future in futures.values())
+
+    def build_context(self, documents: dict) -> list[dict]:
+        """
+        Fuse the results of every service into one ranked context, with overlapping video
+        windows merged and repeated sentences dropped, then trim it to the PDF and video budgets.
+        """
+        passages, self.context_tokens = self._budget_context(documents)
+        return passages
+
+    def _budget_context(self, documents: dict) -> tuple[list[dict], dict]:
+        """build_context without recording the tokens, returns (passages, tokens per content type)"""
+        passages = fuse_documents(documents, limit=self.context_limit)
+        return budget_passages(passages, self.context_budget)
 
     def _parse_docs(self, documents: dict) -> str:
-        pdf_content = '\n'.join([doc['text'] for doc in documents['pdf']])
-        video_content = '\n'.join([doc['text'] for doc in documents['video']])
-        return f'PDF Content: {pdf_content}\nVideo Content: {video_content}'
+        """Render the budgeted context of documents"""
+        return self._render_passages(self.build_context(documents))
+
+    def _render_passages(self, passages: list[dict]) -> str:
+        """Label every passage with its source and join them into the prompt context"""
+        rendered = []
+        for doc in passages:
+            if doc["content_type"] == "pdf":
+                source = f'{doc["file_name"]}, page {int(doc["page_num"])}'
+            else:
+                source = f'{doc["file_name"]}, {self._format_time(doc["start_time"])}-{self._format_time(doc["end_time"])}'
+            rendered.append(f'[{doc["content_type"].upper()}: {source}]\n{doc["text"]}')
+        return '\n\n'.join(rendered)
+
+    @staticmethod
+    def _format_time(seconds) -> str:
+        minutes, seconds = divmod(int(float(seconds)), 60)
+        return f'{minutes:02d}:{seconds:02d}'
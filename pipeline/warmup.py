@@ -0,0 +1,129 @@
+"""
+Pre-answers a question bank into the semantic answer cache, so common questions are
+served without waiting on the model.
+
+Ingesting a course drops its cached answers and warms them up again in the background
+with the same question bank. Run it by hand for another bank or after changing the model:
+
+    python -m pipeline.warmup machine_learning_for_health --questions-dir qna_for_eval --per-lecture
+
+Every CSV in the questions directory needs a Question column. Questions are answered for
+the scope the student portal searches by default (every processed lecture) and, with
+--per-lecture, also for the lecture named after the CSV file when it exists.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+import argparse
+import logging
+
+import pandas as pd
+import streamlit as st
+
+from pipeline.retrieve import ContentRetriever
+from utility.cache import answer_cache
+from utility.database_manager import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+
+def load_questions(questions_dir: str) -> dict[str, list[str]]:
+    """
+    Returns:
+        dict: Maps the CSV file name (without extension) -> questions
+    """
+    return {
+        csv_path.stem: pd.read_csv(csv_path)["Question"].dropna().tolist()
+        for csv_path in sorted(Path(questions_dir).glob("*.csv"))
+    }
+
+
+def warm_up(
+    retriever: ContentRetriever,
+    questions: list[str],
+    lecture_names: list[str],
+    max_workers: int = 4,
+    generation: Optional[int] = None,
+) -> tuple[int, int]:
+    """
+    Answers every question not already cached for the given lectures, max_workers at a time.
+    When generation is given, questions not started yet are dropped once the course's
+    answers are invalidated again, since they would be answered from outdated chunks.
+
+    Returns:
+        tuple: Contains (number of questions answered, number already cached)
+    """
+    def answer(question: str) -> Optional[bool]:
+        if generation is not None and answer_cache.generation(retriever.course_name) != generation:
+            return None
+        cached = answer_cache.lookup(
+            retriever.course_name, retriever.model_name, lecture_names, question, session=retriever.session
+        )
+        if cached is not None:
+            return False
+        documents = retriever.retrieve(question, lecture_names)
+        # Consuming the stream is what stores the answer
+        "".join(retriever.complete(question, documents, [], lecture_names=lecture_names))
+        logger.info(f"Answered: {question}")
+        return True
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="warmup") as executor:
+        results = list(executor.map(answer, questions))
+    return results.count(True), results.count(False)
+
+
+def warm_up_course(
+    session,
+    course_name: str,
+    lecture_names: list[str],
+    questions_dir: str = "qna_for_eval",
+    per_lecture: bool = True,
+    model_name: str = "mistral-large2",
+    max_workers: int = 4,
+    generation: Optional[int] = None,
+) -> dict[str, tuple[int, int]]:
+    """
+    Pre-answers the question bank for the scope the student portal searches by default
+    (every lecture) and, with per_lecture, for each lecture a CSV is named after. A bank
+    none of whose CSVs names a lecture of the course belongs to another course and is skipped.
+
+    Returns:
+        dict: Maps the scope, lectures joined by ", " -> (answered, already cached)
+    """
+    question_bank = load_questions(questions_dir)
+    if not any(lecture in question_bank for lecture in lecture_names):
+        logger.info(f"No questions in {questions_dir} for the lectures of {course_name}, skipping the warm-up")
+        return {}
+
+    retriever = ContentRetriever(session, course_name, model_name=model_name)
+    scopes = [(lecture_names, [q for questions in question_bank.values() for q in questions])]
+    if per_lecture:
+        scopes += [([lecture], question_bank[lecture]) for lecture in lecture_names if lecture in question_bank]
+
+    return {
+        ", ".join(scope_lectures): warm_up(retriever, questions, scope_lectures, max_workers, generation)
+        for scope_lectures, questions in scopes
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-answer a question bank into the answer cache")
+    parser.add_argument("course_name")
+    parser.add_argument("--questions-dir", default="qna_for_eval")
+    parser.add_argument("--per-lecture", action="store_true", help="Also answer each CSV for its own lecture")
+    parser.add_argument("--model-name", default="mistral-large2")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    snow_conn = st.connection("snowflake")
+    db_manager = DatabaseManager(snow_conn)
+    lectures = sorted(db_manager.get_catalog([args.course_name])[args.course_name])
+    if not lectures:
+        raise SystemExit(f"{args.course_name} has no processed lectures")
+
+    results = warm_up_course(
+        snow_conn.session(), args.course_name, lectures, args.questions_dir, args.per_lecture, args.model_name, args.workers
+    )
+    for scope, (answered, cached) in results.items():
+        print(f"{scope}: {answered} answered, {cached} already cached")
@@ -1,13 +1,28 @@
 import streamlit as st
 from streamlit_pdf_viewer import pdf_viewer
 
+from utility.database_manager import snowpark_session
 from utility.file_manager import FileManager
+from utility.page_renders import page_cache
+from utility.tracing import NOOP_SPAN, tracer
+from utility.video_clips import clip_cache
 from pipeline.retrieve import ContentRetriever
 
 
-@st.cache_resource
-def init_snow_session():
-    return st.connection('snowflake').session()
+def show_turn_timing(breakdown: list[dict]):
+    """Sidebar table of where the time of the last chat turn went"""
+    st.sidebar.caption("Last turn timing")
+    st.sidebar.dataframe(
+        [
+            {
+                "step": "\u2003" * span["depth"] + span["name"],
+                "start ms": round(span["start_ms"]),
+                "ms": round(span["duration_ms"]),
+            }
+            for span in breakdown
+        ],
+        hide_index=True,
+    )
 
 @st.dialog("📄 Full PDF Viewer", width="large")
 def full_pdf_viewer(pdf_path, page_num):
@@ -36,10 +51,13 @@ def student_portal():
 
     course = st.sidebar.selectbox("Select Course", course_names)
     clear_chat = st.sidebar.button("Clear Chat")
+    # Only offered while tracing is on, spans are what the breakdown is made of
+    show_timing = tracer.enabled and st.sidebar.toggle("Show timing breakdown")
 
     if clear_chat:
         st.session_state.messages = []
         st.session_state.artifacts = {}
+        st.session_state.turn_timing = []
 
     if (
         "content_retriever" not in st.session_state
@@ -54,10 +72,12 @@ def student_portal():
                     st.session_state.available_lectures.append(lecture)
                     break
         
-        session = init_snow_session()
+        session = snowpark_session()
         st.session_state.content_retriever = ContentRetriever(session, course)
 
     file_manager = FileManager()
+    # Covers the answer and the artifacts shown with it, ended once both are on screen
+    turn_span = NOOP_SPAN
 
     # Main content area
     col1, col2 = st.columns([3, 2])
@@ -84,22 +104,13 @@ def student_portal():
 
         if query := st.chat_input("Ask a question about the lecture series"):
             user_msg.chat_message("user", avatar="👤").write(query)
+            turn_span = tracer.start_span("chat_turn", course=course, history_messages=len(st.session_state.messages))
 
-            with ai_msg.chat_message("assistant", avatar="🤖"):
+            with tracer.activate(turn_span), ai_msg.chat_message("assistant", avatar="🤖"):
                 with st.spinner("Searching for relevant documents.."):
-                    if st.session_state.messages:
-                        context_query = (
-                            st.session_state.content_retriever.contextualize(
-                                query, st.session_state.messages
-                            )
-                        )
-                        documents = st.session_state.content_retriever.retrieve(
-                            context_query, st.session_state.selected_lectures
-                        )
-                    else:
-                        documents = st.session_state.content_retriever.retrieve(
-                            query, st.session_state.selected_lectures
-                        )
+                    context_query, documents = st.session_state.content_retriever.retrieve_for_turn(
+                        query, st.session_state.messages, st.session_state.selected_lectures
+                    )
 
                     if documents["pdf"]:
                         pdf_doc = documents["pdf"][0]
@@ -131,7 +142,11 @@ def student_portal():
                         st.session_state.artifacts["video"] = None
 
                     response_stream = st.session_state.content_retriever.complete(
-                        query, documents, st.session_state.messages
+                        query,
+                        documents,
+                        st.session_state.messages,
+                        lecture_names=st.session_state.selected_lectures,
+                        standalone_query=context_query,
                     )
 
                 response_str = st.write_stream(response_stream)
@@ -157,7 +172,20 @@ def student_portal():
                         full_pdf_viewer(pdf_path, page_num)
 
                 with st.container(height=300):
-                    pdf_viewer(pdf_path, scroll_to_page=page_num, key=f"preview_pdf_{pdf_path}_{page_num}")
+                    # Only the cited page and its neighbours, the full PDF is behind the button
+                    try:
+                        with tracer.activate(turn_span), tracer.span("render.pdf_pages", page=page_num):
+                            pages = page_cache.render_pages(pdf_path, [page_num - 1, page_num, page_num + 1])
+                    except Exception:
+                        pages = {}
+
+                    if page_num in pages:
+                        st.image(pages[page_num], caption=f"Page {page_num}")
+                        neighbours = [num for num in [page_num - 1, page_num + 1] if num in pages]
+                        for col, num in zip(st.columns(2), neighbours):
+                            col.image(pages[num], caption=f"Page {num}")
+                    else:
+                        pdf_viewer(pdf_path, scroll_to_page=page_num, key=f"preview_pdf_{pdf_path}_{page_num}")
             else:
                 st.info("This lecture does not contain notes")
 
@@ -167,10 +195,19 @@ def student_portal():
                 start_time = video_artifact["start_time"]
                 end_time = video_artifact["end_time"]
 
+                # Serve a clip of the answer's span instead of the whole lecture
+                try:
+                    with tracer.activate(turn_span), tracer.span("render.video_clip", seconds=round(end_time - start_time)):
+                        video_path, clip_start, clip_end = clip_cache.get_clip(
+                            str(video_artifact["file_path"]), start_time, end_time
+                        )
+                except Exception:
+                    video_path, clip_start, clip_end = str(video_artifact["file_path"]), start_time, end_time
+
                 st.video(
-                    str(video_artifact["file_path"]),
-                    start_time=start_time,
-                    end_time=end_time,
+                    video_path,
+                    start_time=clip_start,
+                    end_time=clip_end,
                 )
                 with st.expander("🔍 Video Transcript"):
                     start_hours = int(start_time // 3600)
@@ -191,5 +228,11 @@ def student_portal():
         else:
             st.info("Chat with us to display relevant artifacts")
 
+    if turn_span:
+        turn_span.end()
+        st.session_state.turn_timing = turn_span.breakdown()
+    if show_timing and st.session_state.get("turn_timing"):
+        show_turn_timing(st.session_state.turn_timing)
+
 
 student_portal()
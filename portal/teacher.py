@@ -1,8 +1,9 @@
 import streamlit as st
 from streamlit_pdf_viewer import pdf_viewer
 from pathlib import Path
-from utility.database_manager import DatabaseManager
+from utility.database_manager import DatabaseManager, snowpark_session
 from utility.file_manager import FileManager
+from utility.page_renders import page_cache
 from pipeline.ingest import ContentProcessor
 
 
@@ -15,8 +16,22 @@ def preview_file(file_path):
     if file_path.endswith(".mp4"):
         st.video(file_path)
     elif file_path.endswith(".pdf"):
+        try:
+            num_pages = page_cache.page_count(file_path)
+        except Exception:
+            num_pages = 0
+
+        if not num_pages:
+            with st.container(height=600):
+                pdf_viewer(file_path)
+            return
+
+        # Render one page at a time instead of loading the whole PDF on every rerun
+        page_num = 1
+        if num_pages > 1:
+            page_num = st.slider("Page", 1, num_pages, 1, key=f"preview_page_{file_path}")
         with st.container(height=600):
-            pdf_viewer(file_path)
+            st.image(page_cache.render(file_path, page_num), caption=f"Page {page_num} of {num_pages}")
 
 
 def show_file_btn(file_path, processed, files_to_upload, is_admin=False, key=None):
@@ -70,7 +85,7 @@ def teacher_portal():
 
     file_manager = FileManager()
     db_manager = st.session_state.db_manager
-    content_processor = ContentProcessor(db_manager)
+    content_processor = ContentProcessor(db_manager, session=snowpark_session())
 
     course_names = list(st.session_state.course_structure.keys())
     
@@ -125,17 +140,21 @@ def teacher_portal():
                             key=f"file_uploader_{course}_{lecture}"
                         )
                         if uploaded_files:
+                            saved_uploads = st.session_state.setdefault("saved_uploads", set())
                             for file in uploaded_files:
+                                # The uploader keeps its files across reruns, only handle each upload once
+                                if file.file_id in saved_uploads:
+                                    continue
+                                saved_uploads.add(file.file_id)
                                 file_manager.save_uploaded_file(course, lecture, file)
-                                if file.name not in [
-                                    f[0]
+                                # A re-uploaded file goes back to pending, ingestion skips it if unchanged
+                                st.session_state.course_structure[course][lecture] = [
+                                    f
                                     for f in st.session_state.course_structure[course][
                                         lecture
                                     ]
-                                ]:
-                                    st.session_state.course_structure[course][
-                                        lecture
-                                    ].append((file.name, False))
+                                    if f[0] != file.name
+                                ] + [(file.name, False)]
                             st.success(f"Uploaded {len(uploaded_files)} files to {lecture}")
 
                 with st.container(height=500):
@@ -202,17 +221,22 @@ def teacher_portal():
                         if st.button("Process Lectures", key=f"process_btn_{course}"):
                             if files_to_upload['pdf'] or files_to_upload['video']:
                                 with st.status("Processing files...", expanded=False) as status:
-                                    content_processor.process_files(
+                                    failed = content_processor.process_files(
                                         course, files_to_upload, status
                                     )
                                 # Update file status after processing
+                                catalog = db_manager.get_catalog([course])[course]
                                 for lecture in st.session_state.course_structure[course]:
-                                    db_files = db_manager.get_files_in_lecture(course, lecture)
+                                    db_files = catalog.get(lecture, set())
                                     st.session_state.course_structure[course][lecture] = [
                                         (file_name, file_name in db_files)
                                         for file_name, _ in st.session_state.course_structure[course][lecture]]
-                                st.success("Files processed successfully!")
-                                st.rerun()
+                                if failed:
+                                    # Keep the status panel with the per-file errors on screen
+                                    st.warning(f"{len(failed)} files failed, the rest were processed")
+                                else:
+                                    st.success("Files processed successfully!")
+                                    st.rerun()
                             else:
                                 st.warning("No files to process")
 
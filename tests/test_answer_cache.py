@@ -0,0 +1,155 @@
+import json
+
+import numpy as np
+import pytest
+
+from benchmarks import suite
+from utility.cache import CortexEmbedder, SemanticAnswerCache, embed_text, same_meaning_markers
+
+COURSE, MODEL, LECTURES = "course", "mistral-large2", ["lecture_4", "lecture_7"]
+
+# Wording barely changes, meaning flips
+MEANING_FLIPS = [
+    ("Why does the model overfit on small cohorts?", "Why does the model not overfit on small cohorts?"),
+    ("Why doesn't the model overfit on small cohorts?", "Why does the model overfit on small cohorts?"),
+    ("Is mammography screening recommended for women under 40?", "Is mammography screening recommended for women over 40?"),
+    ("Is CT more sensitive than MRI for cardiac imaging?", "Is MRI more sensitive than CT for cardiac imaging?"),
+    ("What does lecture 4 add to the risk model of lecture 7?", "What does lecture 7 add to the risk model of lecture 4?"),
+    ("What are the two types of censoring in survival analysis of patient cohorts?", "What are the three types of censoring in survival analysis of patient cohorts?"),
+]
+
+
+def constant_embed(text: str) -> np.ndarray:
+    """Every question looks identical, so only the meaning markers decide"""
+    return np.ones(8, dtype=np.float32) / np.sqrt(8)
+
+
+@pytest.fixture
+def lexical_cache(tmp_path):
+    # Hashed n-grams score these pairs above the threshold, the markers must reject them
+    return SemanticAnswerCache(cache_dir=str(tmp_path), threshold=0.85, embed=embed_text)
+
+
+@pytest.mark.parametrize("cached, asked", MEANING_FLIPS + [(b, a) for a, b in MEANING_FLIPS])
+def test_meaning_flips_miss(lexical_cache, cached, asked):
+    assert float(embed_text(cached) @ embed_text(asked)) >= lexical_cache.threshold
+    lexical_cache.add(COURSE, MODEL, LECTURES, cached, "cached answer")
+    assert lexical_cache.lookup(COURSE, MODEL, LECTURES, asked) is None
+
+
+@pytest.mark.parametrize("cached, asked", MEANING_FLIPS)
+def test_meaning_flips_miss_whatever_the_embedding(tmp_path, cached, asked):
+    cache = SemanticAnswerCache(cache_dir=str(tmp_path), threshold=0.9, embed=constant_embed)
+    cache.add(COURSE, MODEL, LECTURES, cached, "cached answer")
+    assert cache.lookup(COURSE, MODEL, LECTURES, asked) is None
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("What is risk stratification?", "What is risk stratification used for?"),
+    ("Why do models overfit with 10 features?", "why do models overfit with ten features"),
+    ("What is censoring in survival analysis?", "Explain censoring in survival analysis"),
+])
+def test_paraphrases_keep_their_markers(cached, asked):
+    assert same_meaning_markers(cached, asked)
+
+
+def test_paraphrase_hits(tmp_path):
+    cache = SemanticAnswerCache(cache_dir=str(tmp_path), threshold=0.9, embed=constant_embed)
+    cache.add(COURSE, MODEL, LECTURES, "What is risk stratification?", "It ranks patients by risk.")
+    assert cache.lookup(COURSE, MODEL, LECTURES, "What is risk stratification used for?") == "It ranks patients by risk."
+    assert cache.lookup(COURSE, MODEL, LECTURES[:1], "What is risk stratification?") is None
+
+
+def test_entries_keep_their_embedding(tmp_path):
+    calls = []
+
+    def counting_embed(text: str) -> np.ndarray:
+        calls.append(text)
+        return embed_text(text)
+
+    SemanticAnswerCache(cache_dir=str(tmp_path), embed=counting_embed).add(COURSE, MODEL, LECTURES, "What is censoring?", "answer")
+    calls.clear()
+    reopened = SemanticAnswerCache(cache_dir=str(tmp_path), threshold=0.5, embed=counting_embed)
+    assert reopened.lookup(COURSE, MODEL, LECTURES, "Explain censoring") == "answer"
+    assert calls == ["Explain censoring"]
+
+
+def test_lookup_embeds_only_when_an_entry_could_match(tmp_path):
+    calls = []
+
+    def counting_embed(text: str) -> np.ndarray:
+        calls.append(text)
+        return embed_text(text)
+
+    cache = SemanticAnswerCache(cache_dir=str(tmp_path), threshold=0.5, embed=counting_embed)
+    cache.add(COURSE, MODEL, LECTURES, "Why do models overfit with 10 features?", "answer")
+    calls.clear()
+
+    # Asked verbatim, then with markers no entry shares: neither needs an embedding
+    assert cache.lookup(COURSE, MODEL, LECTURES, "why do models overfit with 10 features") == "answer"
+    assert cache.lookup(COURSE, MODEL, LECTURES, "Why do models overfit with 20 features?") is None
+    assert cache.lookup(COURSE, MODEL, LECTURES, "Why don't models overfit with 10 features?") is None
+    assert cache.lookup(COURSE, MODEL, LECTURES[:1], "Why do models overfit with 10 features?") is None
+    assert calls == []
+
+    assert cache.lookup(COURSE, MODEL, LECTURES, "When do models overfit with ten features?") == "answer"
+    assert calls == ["When do models overfit with ten features?"]
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 3
+
+
+def test_file_is_trimmed(tmp_path):
+    cache = SemanticAnswerCache(cache_dir=str(tmp_path), max_entries=10, embed=embed_text)
+    for idx in range(40):
+        cache.add(COURSE, MODEL, LECTURES, f"Question number {idx}?", f"answer {idx}")
+
+    with open(tmp_path / f"{COURSE}.jsonl") as f:
+        queries = [json.loads(line)["query"] for line in f]
+    assert len(queries) <= 12
+    assert queries[-1] == "Question number 39?"
+    reopened = SemanticAnswerCache(cache_dir=str(tmp_path), threshold=0.99, max_entries=10, embed=embed_text)
+    assert reopened.lookup(COURSE, MODEL, LECTURES, "Question number 39?") == "answer 39"
+    assert reopened.lookup(COURSE, MODEL, LECTURES, "Question number 5?") is None
+
+
+def test_invalidate_drops_answers_and_bumps_generation(tmp_path):
+    cache = SemanticAnswerCache(cache_dir=str(tmp_path), embed=embed_text)
+    cache.add(COURSE, MODEL, LECTURES, "What is censoring?", "answer")
+    cache.invalidate(COURSE)
+    assert cache.generation(COURSE) == 1
+    assert cache.lookup(COURSE, MODEL, LECTURES, "What is censoring?") is None
+    assert not (tmp_path / f"{COURSE}.jsonl").exists()
+
+
+def test_cortex_embeddings_use_the_callers_session(tmp_path, monkeypatch):
+    sessions = []
+
+    def fake_embed_text_768(model, text, session=None):
+        sessions.append(session)
+        return [1.0] * 768
+
+    monkeypatch.setattr("utility.cache.embed_text_768", fake_embed_text_768)
+    cache = SemanticAnswerCache(cache_dir=str(tmp_path), embed=CortexEmbedder())
+    session = object()
+
+    cache.add(COURSE, MODEL, LECTURES, "What is a hazard ratio?", "A ratio of hazards.", session=session)
+    cache.lookup(COURSE, MODEL, LECTURES, "What is a survival curve?", session=session)
+
+    assert sessions == [session, session]
+
+
+def test_retriever_passes_its_session_to_cortex(tmp_path, monkeypatch):
+    retriever = suite.fake_retriever(200)
+    completions, embeddings = [], []
+    monkeypatch.setattr(
+        "pipeline.retrieve.Complete",
+        lambda model, prompt, stream=False, session=None: completions.append(session) or iter(["Yes."]),
+    )
+    monkeypatch.setattr("utility.cache.embed_text_768", lambda model, text, session=None: embeddings.append(session) or [1.0] * 768)
+    monkeypatch.setattr("pipeline.retrieve.answer_cache", SemanticAnswerCache(cache_dir=str(tmp_path), embed=CortexEmbedder()))
+    retriever.use_answer_cache = True
+
+    "".join(retriever.complete("What is a hazard ratio?", {"pdf": [], "video": []}, [], lecture_names=LECTURES))
+    retriever.contextualize("And its confidence interval?", [{"role": "user", "content": "What is a hazard ratio?"}])
+
+    assert completions == [retriever.session, retriever.session]
+    assert embeddings and all(session is retriever.session for session in embeddings)
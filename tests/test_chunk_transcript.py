@@ -0,0 +1,96 @@
+from dataclasses import astuple
+import random
+
+import pytest
+
+from utility.data_models import VideoSection, Video, chunk_transcript
+
+
+def reference_chunks(transcript: list[dict], chunk_size: int, overlap: int) -> list[VideoSection]:
+    """
+    The chunker Video._chunk_text had before chunk_transcript, rescanning the transcript
+    for every window. The only change is skipping windows with no sentence, where it
+    used to crash on round(None).
+    """
+    chunks = []
+    current_start = transcript[0]["start"]
+    current_end = current_start + chunk_size
+
+    while current_start < transcript[-1]["end"]:
+        chunk_text = []
+        chunk_start = None
+        chunk_end = None
+
+        for segment in transcript:
+            if segment["end"] < current_start:
+                continue
+            if segment["start"] > current_end:
+                break
+
+            if chunk_start is None:
+                chunk_start = max(segment["start"], current_start)
+
+            chunk_text.append(segment["text"])
+            chunk_end = segment["end"]
+
+        if chunk_start is not None:
+            chunks.append(
+                VideoSection(
+                    text=" ".join(chunk_text),
+                    start=round(chunk_start, 1),
+                    end=round(chunk_end, 1),
+                )
+            )
+
+        current_start += chunk_size - overlap
+        current_end = current_start + chunk_size
+
+    return chunks
+
+
+def random_transcript(rnd: random.Random, num_sentences: int, max_gap: float) -> list[dict]:
+    transcript, time = [], rnd.uniform(0, 5)
+    for idx in range(num_sentences):
+        duration = rnd.uniform(0.5, 12)
+        transcript.append({"start": time, "end": time + duration, "text": f"sentence {idx}."})
+        time += duration + rnd.uniform(0, max_gap)
+    return transcript
+
+
+CONFIGS = [(60, 10), (30, 5), (120, 20), (10, 9), (45, 0)]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_reference(seed):
+    rnd = random.Random(seed)
+    transcript = random_transcript(rnd, rnd.randint(1, 300), max_gap=2.0)
+    results = chunk_transcript(transcript, CONFIGS)
+    for chunk_size, overlap in CONFIGS:
+        expected = reference_chunks(transcript, chunk_size, overlap)
+        assert [astuple(chunk) for chunk in results[(chunk_size, overlap)]] == [astuple(chunk) for chunk in expected]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_reference_with_long_silences(seed):
+    rnd = random.Random(seed)
+    # Gaps of up to 200 seconds leave whole windows without a sentence
+    transcript = random_transcript(rnd, rnd.randint(2, 100), max_gap=200.0)
+    for chunk_size, overlap in CONFIGS:
+        chunks = chunk_transcript(transcript, [(chunk_size, overlap)])[(chunk_size, overlap)]
+        assert [astuple(chunk) for chunk in chunks] == [astuple(chunk) for chunk in reference_chunks(transcript, chunk_size, overlap)]
+        assert all(chunk.text for chunk in chunks)
+
+
+def test_video_chunk_text_delegates():
+    transcript = random_transcript(random.Random(0), 50, max_gap=1.0)
+    video = Video(file_path="lecture.mp4", cache=None)
+    assert video._chunk_text(transcript, 60, 10) == chunk_transcript(transcript, [(60, 10)])[(60, 10)]
+
+
+def test_empty_transcript():
+    assert chunk_transcript([], [(60, 10)]) == {(60, 10): []}
+
+
+def test_overlap_must_be_smaller_than_chunk_size():
+    with pytest.raises(ValueError):
+        chunk_transcript([{"start": 0.0, "end": 1.0, "text": "a."}], [(10, 10)])
@@ -0,0 +1,43 @@
+from pipeline.context import ContextBudget, budget_history, budget_passages, estimate_tokens
+
+
+def exchange(question: str, answer: str) -> list[dict]:
+    return [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+
+
+def test_history_keeps_whole_exchanges():
+    history = (
+        exchange("What is overfitting?", "When a model memorizes noise in the training data.")
+        + exchange("How do I spot it?", "Validation loss rises while training loss keeps falling.")
+    )
+    last_exchange = sum(estimate_tokens(message["content"]) for message in history[2:])
+
+    # Room for the last answer and part of its question, but not the whole exchange
+    kept, used = budget_history(history, last_exchange - 1)
+    assert kept == [] and used == 0
+
+    kept, used = budget_history(history, last_exchange + 1)
+    assert kept == history[2:] and used == last_exchange
+
+    kept, _ = budget_history(history, 10_000)
+    assert kept == history
+
+
+def test_history_drops_leading_orphan_reply():
+    history = exchange("What is bias?", "Systematic error.") + exchange("And variance?", "Sensitivity to the sample.")
+    kept, _ = budget_history(history[1:], 10_000)
+    assert kept == history[2:]
+
+
+def test_passages_use_per_type_budgets_with_default():
+    text = "Regularization penalizes large weights. " * 20
+    passages = [
+        {"content_type": content_type, "text": text}
+        for content_type in ("pdf", "video", "slides", "pdf")
+    ]
+    budget = ContextBudget(passages={"pdf": 30, "video": 0}, default_passages=15)
+
+    kept, used = budget_passages(passages, budget)
+
+    assert [passage["content_type"] for passage in kept] == ["pdf", "slides", "pdf"]
+    assert used["pdf"] <= 30 and used["video"] == 0 and 0 < used["slides"] <= 15
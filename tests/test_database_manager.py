@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+
+from benchmarks.fakes import FakeSnowflakeConnection
+from utility.database_manager import DatabaseManager
+
+
+@pytest.fixture
+def db_manager():
+    DatabaseManager.invalidate_catalog()
+    yield DatabaseManager(FakeSnowflakeConnection(), database="d", schema="s")
+    DatabaseManager.invalidate_catalog()
+
+
+def test_catalog_of_a_course_ingested_before_the_manifest(db_manager):
+    # Chunk tables as the ingestion of the time left them, no manifest
+    db_manager._run_query("CREATE TABLE legacy_video (text STRING, start_time INTEGER, end_time INTEGER, file_name STRING, lecture_name STRING)")
+    db_manager._run_query("CREATE TABLE legacy_pdf (text STRING, page_num INTEGER, file_name STRING, lecture_name STRING)")
+    for start_time in (0, 50, 100):
+        db_manager._run_query(
+            "INSERT INTO legacy_video VALUES (?, ?, ?, ?, ?)", ["words", start_time, start_time + 60, "intro.mp4", "lecture_1"]
+        )
+    db_manager._run_query("INSERT INTO legacy_pdf VALUES ('words', 1, 'slides.pdf', 'lecture_2')")
+    tables = set(db_manager._list_tables())
+
+    catalog = db_manager.get_catalog(["legacy", "never_ingested"])
+
+    assert catalog == {"legacy": {"lecture_1": {"intro.mp4"}, "lecture_2": {"slides.pdf"}}, "never_ingested": {}}
+    assert set(db_manager._list_tables()) == tables
+
+
+def test_catalog_reads_the_manifest_once_there_is_one(db_manager):
+    db_manager.create_table("course")
+    db_manager._run_query("INSERT INTO course_video (text, file_name, lecture_name) VALUES ('words', 'old.mp4', 'lecture_1')")
+    db_manager._run_query("INSERT INTO course_manifest (file_name, lecture_name) VALUES ('new.mp4', 'lecture_1')")
+
+    assert db_manager.get_catalog(["course"]) == {"course": {"lecture_1": {"new.mp4"}}}
+
+
+def test_other_statements_wait_for_an_open_transaction(db_manager):
+    db_manager.create_table("course")
+    other = DatabaseManager(db_manager.conn, database="d", schema="s")
+    done = threading.Event()
+
+    def read_manifest():
+        other.get_manifest("course")
+        done.set()
+
+    with db_manager._transaction():
+        db_manager._run_query("INSERT INTO course_manifest (file_name, lecture_name) VALUES ('a.pdf', 'lecture_1')")
+        reader = threading.Thread(target=read_manifest)
+        reader.start()
+        assert not done.wait(0.2)
+    reader.join(5)
+    assert done.is_set()
+
+
+def test_failed_transaction_rolls_back(db_manager):
+    db_manager.create_table("course")
+    with pytest.raises(RuntimeError):
+        with db_manager._transaction():
+            db_manager._run_query("INSERT INTO course_manifest (file_name, lecture_name) VALUES ('a.pdf', 'lecture_1')")
+            raise RuntimeError("load failed")
+    assert db_manager.get_manifest("course") == {}
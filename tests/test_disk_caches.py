@@ -0,0 +1,105 @@
+import os
+import time
+
+import pypdfium2 as pdfium
+
+from utility.audio import AudioCache
+from utility.cache import evict_lru_files
+from utility.ffmpeg import run_ffmpeg
+from utility.page_renders import PageRenderCache
+from utility.video_clips import ClipCache
+
+
+def write_files(directory, count: int, size: int = 100) -> list:
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = directory / f"{i}.bin"
+        path.write_bytes(b"x" * size)
+        # Oldest first, so file 0 is the least recently used
+        os.utime(path, (time.time() - count + i, time.time() - count + i))
+        paths.append(path)
+    return paths
+
+
+def test_evict_lru_files_spares_every_kept_path(tmp_path):
+    paths = write_files(tmp_path, 5)
+
+    removed = evict_lru_files(tmp_path, 100, keep={paths[0], paths[1]})
+
+    assert removed == 3
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["0.bin", "1.bin"]
+
+
+def test_render_pages_keeps_every_returned_page(tmp_path):
+    pdf_path = tmp_path / "slides.pdf"
+    pdf = pdfium.PdfDocument.new()
+    for _ in range(4):
+        pdf.new_page(612, 792)
+    pdf.save(str(pdf_path))
+    pdf.close()
+
+    # Far too small for even one page, so only the pages being shown may survive
+    cache = PageRenderCache(cache_dir=str(tmp_path / "pages"), max_bytes=1, dpi=20)
+    pages = cache.render_pages(str(pdf_path), [1, 2, 3])
+
+    assert sorted(pages) == [1, 2, 3]
+    assert all(os.path.exists(path) for path in pages.values())
+
+
+def make_video(path, seconds: int) -> str:
+    run_ffmpeg([
+        "-y", "-f", "lavfi", "-i", f"testsrc=size=64x48:rate=10:duration={seconds}",
+        "-c:v", "mpeg4", "-g", "10", str(path),
+    ])
+    return str(path)
+
+
+def test_clip_cache_bounds_web_copies_and_indexes(tmp_path):
+    videos = [make_video(tmp_path / f"lecture{i}.mp4", 3) for i in range(3)]
+    cache = ClipCache(cache_dir=str(tmp_path / "clips"), max_web_bytes=1, max_index_bytes=1)
+
+    clips = []
+    for video in videos:
+        clip_path, start, end = cache.get_clip(video, 1.2, 1.8)
+        assert os.path.exists(clip_path) and start >= 0 and end > start
+        clips.append(clip_path)
+
+    # Only the files of the last video survive, every other one was over the limit
+    assert len(list((tmp_path / "clips" / "web").glob("*.mp4"))) == 1
+    assert len(list((tmp_path / "clips" / "keyframes").glob("*.json"))) == 1
+
+    # Evicted copies and indexes are rebuilt on demand and cut the same clip
+    assert cache.get_clip(videos[0], 1.2, 1.8)[0] == clips[0]
+
+
+def make_lecture(path, seconds: int) -> str:
+    run_ffmpeg([
+        "-y", "-f", "lavfi", "-i", f"testsrc=size=64x48:rate=10:duration={seconds}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+        "-c:v", "mpeg4", "-c:a", "aac", "-shortest", str(path),
+    ])
+    return str(path)
+
+
+def test_audio_cache_keeps_tracks_until_released(tmp_path):
+    videos = [make_lecture(tmp_path / f"lecture{i}.mp4", 2) for i in range(3)]
+    cache = AudioCache(cache_dir=str(tmp_path / "audio"), max_bytes=1)
+
+    # Both tracks are still being transcribed, neither may go
+    first, _ = cache.extract(videos[0])
+    second, _ = cache.extract(videos[1])
+    assert os.path.exists(first) and os.path.exists(second)
+
+    # A second user of the first track keeps it pinned after the first one is done
+    assert cache.extract(videos[0])[0] == first
+    cache.release(first)
+    cache.release(second)
+    third, _ = cache.extract(videos[2])
+    assert os.path.exists(first) and not os.path.exists(second)
+
+    # Once released, the next extraction evicts them
+    cache.release(first)
+    cache.release(third)
+    assert cache.extract(videos[1])[0] == second
+    assert not os.path.exists(first) and not os.path.exists(third) and os.path.exists(second)
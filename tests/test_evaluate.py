@@ -0,0 +1,76 @@
+import pandas as pd
+
+from benchmarks import suite
+from benchmarks.fakes import FakeCortexSearchService, fake_cortex
+from pipeline.evaluate import INGESTED_CHUNK_CONFIG, METRICS, EvalConfig, Evaluator, summarize
+from utility.search_backend import CortexSearchBackend, LocalSearchBackend, local_index_dir
+
+QUESTION = "how is risk estimated from imaging features"
+
+
+def test_build_prompt_matches_complete_without_touching_the_retriever():
+    retriever = suite.fake_retriever(200)
+    documents = retriever.retrieve(QUESTION, suite.LECTURES[:6])
+    history = [{"role": "user", "content": "What is risk?"}, {"role": "assistant", "content": "A probability."}]
+
+    messages, passages, tokens = retriever.build_prompt(QUESTION, documents, history)
+
+    assert retriever.context_tokens == {}
+    assert passages and all(passage["text"] in messages[-1]["content"] for passage in passages)
+    assert messages[1:3] == history
+    assert tokens["total"] >= tokens["pdf"] + tokens["video"] + tokens["question"]
+    # The prompt sent by complete is the same one
+    assert retriever._build_messages(QUESTION, documents, history) == messages
+    assert retriever.context_tokens == tokens
+
+
+class FakeModel:
+    """Answers every prompt and gives every judgement full marks"""
+
+    def __call__(self, model, prompt, stream=False):
+        return iter(["Risk ", "is ", "ranked."]) if stream else "Reason: fine.\nScore: 3"
+
+
+def test_unmatched_lectures_are_skipped_under_the_lecture_filter(monkeypatch, caplog):
+    evaluator = Evaluator(None, "course", suite.LECTURES[:2], rate=0, workers=2, complete=FakeModel())
+    monkeypatch.setattr(evaluator, "retriever_for", lambda config, index_dirs: suite.fake_retriever(200))
+    questions = {suite.LECTURES[0]: [QUESTION], "lecture_renamed": [QUESTION, "what is a hazard ratio"]}
+
+    results = evaluator.run([EvalConfig(filter="course"), EvalConfig(filter="lecture")], questions)
+
+    assert "lecture_renamed" in caplog.text
+    assert results.groupby("config").size().to_dict() == {"cortex baseline course": 3, "cortex baseline lecture": 1}
+    assert "error" not in results
+
+    row = evaluator.evaluate_question(EvalConfig(filter="lecture"), suite.fake_retriever(200), QUESTION, "lecture_renamed")
+    assert "not a processed lecture" in row["error"] and "retrieve_ms" not in row
+
+
+def test_summarize_when_every_question_failed():
+    results = pd.DataFrame([{"config": "60s/10s course", "lecture": "l", "question": "q", "error": "timeout"}] * 3)
+
+    summary = summarize(results)
+
+    assert summary.loc["60s/10s course", "questions"] == 3
+    assert summary.loc["60s/10s course", "errors"] == 3
+    assert summary[METRICS].isna().all(axis=None)
+
+
+def test_chunk_configs_search_locally_next_to_the_cortex_baseline(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    chunks = suite.synthetic_chunks(20)
+    for content_type, rows in chunks.items():
+        LocalSearchBackend.build(local_index_dir("course", content_type), rows)
+    LocalSearchBackend.build("video_60_10", chunks["video"][:10])
+    services = {f"course_{content_type}": FakeCortexSearchService(rows) for content_type, rows in chunks.items()}
+
+    with fake_cortex(services, FakeModel()) as session:
+        evaluator = Evaluator(session, "course", suite.LECTURES, complete=FakeModel())
+        retriever = evaluator.retriever_for(EvalConfig(INGESTED_CHUNK_CONFIG), {INGESTED_CHUNK_CONFIG: "video_60_10"})
+        baseline = evaluator.retriever_for(EvalConfig(), {})
+
+    # The ingested chunks are searched like every other configuration, only Cortex is apart
+    assert all(isinstance(service, LocalSearchBackend) for service, _ in retriever.search_targets.values())
+    assert retriever.video_service.index_dir.name == "video_60_10"
+    assert all(isinstance(service, CortexSearchBackend) for service, _ in baseline.search_targets.values())
+    assert [EvalConfig().name, EvalConfig(INGESTED_CHUNK_CONFIG).name] == ["cortex baseline course", "60s/10s course"]
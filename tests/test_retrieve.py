@@ -0,0 +1,27 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import suite
+from benchmarks.fakes import FakeComplete
+
+HISTORY = [
+    {"role": "user", "content": "What is risk stratification?"},
+    {"role": "assistant", "content": "It ranks patients by their predicted risk of an outcome."},
+]
+
+
+def test_stats_add_up_across_concurrent_turns(monkeypatch):
+    retriever = suite.fake_retriever(200)
+    # Rewrites come back unchanged, so every speculative search is a hit
+    monkeypatch.setattr("pipeline.retrieve.Complete", FakeComplete())
+    queries = ["and how is it validated?", "and what about calibration?", "What is a hazard ratio?"] * 10
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        list(executor.map(lambda query: retriever.retrieve_for_turn(query, HISTORY, suite.LECTURES[:6]), queries))
+
+    stats = retriever.stats()
+    rewrite, speculation = stats["rewrite"], stats["speculation"]
+    assert rewrite["turns"] == len(queries) == rewrite["rewrites"] + rewrite["skipped"]
+    assert speculation["speculations"] == rewrite["rewrites"] == speculation["hits"]
+    # Each hit searched once speculatively, each standalone question once directly
+    for search in stats["search"].values():
+        assert search["calls"] == len(queries) and search["timeouts"] == search["errors"] == 0
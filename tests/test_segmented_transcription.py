@@ -0,0 +1,94 @@
+import pytest
+
+from utility.audio import plan_cuts
+from utility.ffmpeg import run_ffmpeg
+from utility.transcription import FakeTranscriber, SegmentedTranscriber, stitch_transcripts
+
+
+def make_audio(path, duration: float, silences: list[tuple[float, float]]) -> str:
+    """Write a tone of duration seconds, muted during each (start, end) silence"""
+    mute = "+".join(f"between(t,{start},{end})" for start, end in silences) or "0"
+    run_ffmpeg([
+        "-y", "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+        "-af", f"volume=enable='{mute}':volume=0", str(path),
+    ])
+    return str(path)
+
+
+def sentence(text: str, start: float, end: float) -> dict:
+    return {"text": text, "start": start, "end": end}
+
+
+def test_plan_cuts_prefers_silences(tmp_path):
+    audio = make_audio(tmp_path / "lecture.wav", 30, [(9, 11)])
+
+    cuts = plan_cuts(audio, 30, segment_seconds=10, search_seconds=3)
+
+    # The first cut lands in the middle of the silence, the second has none to use
+    assert len(cuts) == 2
+    assert cuts[0][0] == pytest.approx(10, abs=0.2) and cuts[0][1]
+    assert cuts[1] == (pytest.approx(20, abs=0.2), False)
+
+
+def test_plan_cuts_leaves_short_audio_whole(tmp_path):
+    audio = make_audio(tmp_path / "short.wav", 12, [])
+    assert plan_cuts(audio, 12, segment_seconds=10) == []
+
+
+def test_stitch_shifts_sentences_by_offset():
+    parts = [
+        ("One. Two.", [sentence("One.", 0.5, 2.0), sentence("Two.", 3.0, 5.0)]),
+        ("Three.", [sentence("Three.", 1.0, 2.5)]),
+    ]
+
+    whole, sentences = stitch_transcripts(parts, [0.0, 10.0], [True])
+
+    assert whole == "One. Two. Three."
+    assert [(s["text"], s["start"], s["end"]) for s in sentences] == [
+        ("One.", 0.5, 2.0), ("Two.", 3.0, 5.0), ("Three.", 11.0, 12.5),
+    ]
+
+
+def test_stitch_joins_sentences_split_by_a_cut():
+    parts = [
+        ("", [sentence("The prior comes from.", 6.0, 9.8)]),
+        ("", [sentence("Bayes rule.", 0.2, 1.5), sentence("Next topic.", 3.0, 4.0)]),
+    ]
+
+    _, sentences = stitch_transcripts(parts, [0.0, 10.0], [False])
+
+    # The capital is kept, it may be a proper noun
+    assert sentences[0] == sentence("The prior comes from Bayes rule.", 6.0, 11.5)
+    assert [s["text"] for s in sentences[1:]] == ["Next topic."]
+
+
+@pytest.mark.parametrize(
+    "in_silence, head_end, tail_start",
+    [(True, 9.8, 0.2), (False, 8.0, 0.2), (False, 9.8, 2.0)],
+)
+def test_stitch_keeps_sentences_apart(in_silence, head_end, tail_start):
+    parts = [
+        ("", [sentence("First part.", 6.0, head_end)]),
+        ("", [sentence("Second part.", tail_start, tail_start + 1)]),
+    ]
+
+    _, sentences = stitch_transcripts(parts, [0.0, 10.0], [in_silence])
+
+    assert [s["text"] for s in sentences] == ["First part.", "Second part."]
+
+
+def test_segmented_transcriber_end_to_end(tmp_path):
+    audio = make_audio(tmp_path / "lecture.wav", 30, [(9, 11)])
+    # Every segment comes back with a sentence at its start and one running into its end
+    fake = FakeTranscriber(sentences=[sentence("Intro.", 0.1, 3.0), sentence("So the.", 6.0, 9.95)])
+    transcriber = SegmentedTranscriber(fake, segment_seconds=10, search_seconds=3)
+
+    _, sentences = transcriber.transcribe(audio)
+
+    assert fake.calls == 3
+    texts = [s["text"] for s in sentences]
+    # Only the cut at 20s, outside a silence, joins its neighbours
+    assert texts == ["Intro.", "So the.", "Intro.", "So the Intro.", "So the."]
+    starts = [s["start"] for s in sentences]
+    assert starts == pytest.approx([0.1, 6.0, 10.1, 16.0, 26.0], abs=0.2)
+    assert sentences[3]["end"] == pytest.approx(23.0, abs=0.2)
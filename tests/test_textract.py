@@ -0,0 +1,33 @@
+import pypdfium2 as pdfium
+import pytest
+
+from benchmarks.fakes import FakeS3, FakeTextract
+from utility.textract import TextractExtractor
+
+
+def make_pdf(path, num_pages: int) -> str:
+    pdf = pdfium.PdfDocument.new()
+    for _ in range(num_pages):
+        pdf.new_page(200, 200)
+    pdf.save(str(path))
+    pdf.close()
+    return str(path)
+
+
+def test_jobs_running_past_the_timeout_fail(tmp_path):
+    s3 = FakeS3()
+    textract = FakeTextract(s3, job_overhead=60.0)
+    extractor = TextractExtractor(s3, textract, "bucket", poll_interval=0.01, timeout=0.1)
+
+    with pytest.raises(TimeoutError, match="job-0 .* still IN_PROGRESS after 0.1s"):
+        extractor.extract(make_pdf(tmp_path / "notes.pdf", 2), [1, 2])
+    # The upload is cleaned up like after a failed job
+    assert s3.objects == {}
+
+
+def test_jobs_finishing_in_time_are_collected(tmp_path):
+    s3 = FakeS3()
+    textract = FakeTextract(s3, job_overhead=0.05, page_time=0.0)
+    extractor = TextractExtractor(s3, textract, "bucket", pages_per_job=1, poll_interval=0.01, timeout=5.0)
+
+    assert extractor.extract(make_pdf(tmp_path / "notes.pdf", 2), [1, 2]) == {1: "", 2: ""}
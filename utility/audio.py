@@ -0,0 +1,291 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from utility.cache import evict_lru_files, list_cache_files
+from utility.ffmpeg import run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class AudioProfile:
+    """
+    How the audio track of a lecture is written for transcription.
+
+    Attributes:
+        name (str): Profile name
+        extension (str): Output file extension, which picks the container
+        codec (str): ffmpeg audio encoder
+        sample_rate (Optional[int]): Output sample rate in Hz, None to keep the source's
+        channels (Optional[int]): Output channel count, None to keep the source's
+        bitrate (Optional[str]): Encoder bitrate such as "24k", None for the encoder default
+        encoder_options (tuple): Extra encoder arguments
+        copy_codecs (dict): Source codecs stream copied instead of re-encoded, mapped to the extension they are written with
+    """
+
+    name: str
+    extension: str
+    codec: str
+    sample_rate: Optional[int] = 16000
+    channels: Optional[int] = 1
+    bitrate: Optional[str] = None
+    encoder_options: tuple = ()
+    copy_codecs: dict = field(default_factory=dict)
+
+    def encode_args(self) -> list[str]:
+        args = ["-c:a", self.codec]
+        if self.sample_rate:
+            args += ["-ar", str(self.sample_rate)]
+        if self.channels:
+            args += ["-ac", str(self.channels)]
+        if self.bitrate:
+            args += ["-b:a", self.bitrate]
+        return args + list(self.encoder_options)
+
+
+# Speech needs no more than mono 16 kHz, Opus keeps it intelligible at a few kB per second. The
+# speech tuned mode at the lowest complexity encodes twice as fast as the default for a smaller file
+_OPUS = dict(extension="ogg", codec="libopus", bitrate="24k", encoder_options=("-application", "voip", "-compression_level", "0"))
+
+AUDIO_PROFILES = {
+    "opus": AudioProfile("opus", **_OPUS),
+    "flac": AudioProfile("flac", "flac", "flac"),
+    # Reuses the source audio as is when it is already in a codec Deepgram accepts, else Opus
+    "copy": AudioProfile("copy", **_OPUS, copy_codecs={"aac": "m4a", "mp3": "mp3", "opus": "ogg", "vorbis": "ogg"}),
+    # What moviepy's write_audiofile produced before, full quality stereo mp3
+    "mp3": AudioProfile("mp3", "mp3", "libmp3lame", sample_rate=44100, channels=None),
+}
+
+
+def parse_duration(ffmpeg_log: str) -> Optional[float]:
+    """Get the input duration in seconds from ffmpeg's log output"""
+    match = re.search(r"Duration:\s*(\d+):(\d+):([\d.]+)", ffmpeg_log)
+    if match is None:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def probe_audio_codec(file_path: str) -> Optional[str]:
+    """Get the codec of the first audio stream without decoding anything"""
+    # Without an output ffmpeg only reads the headers and exits with an error
+    match = re.search(r"Stream #0:\d+.*?: Audio: (\w+)", run_ffmpeg(["-i", file_path], check=False))
+    return match.group(1) if match else None
+
+
+def probe_duration(file_path: str) -> Optional[float]:
+    """Get the duration of a media file in seconds without decoding anything"""
+    return parse_duration(run_ffmpeg(["-i", file_path], check=False))
+
+
+def find_silences(
+    file_path: str, start: float, duration: float, noise_db: float = -35.0, min_silence: float = 0.5
+) -> list[tuple[float, float]]:
+    """
+    Find the silences in a stretch of audio, only decoding that stretch.
+
+    Args:
+        file_path (str): Path to the audio
+        start (float): Start of the stretch in seconds
+        duration (float): Length of the stretch in seconds
+        noise_db (float): Level below which audio counts as silent
+        min_silence (float): Shortest silence in seconds
+
+    Returns:
+        list: (start, end) of every silence in absolute seconds
+    """
+    output = run_ffmpeg([
+        "-ss", f"{start:.3f}", "-t", f"{duration:.3f}", "-i", file_path,
+        "-map", "0:a:0", "-af", f"silencedetect=n={noise_db}dB:d={min_silence}", "-f", "null", "-",
+    ])
+    starts = [max(float(t), 0.0) for t in re.findall(r"silence_start: (-?[\d.]+)", output)]
+    ends = [float(t) for t in re.findall(r"silence_end: ([\d.]+)", output)]
+    # A silence still going at the end of the stretch is never closed
+    ends += [duration] * (len(starts) - len(ends))
+    return [(start + silence_start, start + silence_end) for silence_start, silence_end in zip(starts, ends)]
+
+
+def plan_cuts(
+    file_path: str, duration: float, segment_seconds: float, search_seconds: float = 30.0, **silence_args
+) -> list[tuple[float, bool]]:
+    """
+    Pick where to cut audio into segments of about segment_seconds. Each cut goes in the
+    middle of the longest silence within search_seconds of its target, or at the target
+    itself when there is none. The last segment may run up to a quarter longer rather
+    than leave a short one.
+
+    Returns:
+        list: (cut time, whether it falls in a silence) in time order
+    """
+    cuts = []
+    previous = 0.0
+    while duration - previous > segment_seconds * 1.25:
+        target = previous + segment_seconds
+        window_start = max(target - search_seconds, previous + segment_seconds / 2)
+        silences = find_silences(file_path, window_start, target + search_seconds - window_start, **silence_args)
+        if silences:
+            silence_start, silence_end = max(silences, key=lambda s: (s[1] - s[0], -abs((s[0] + s[1]) / 2 - target)))
+            cuts.append(((silence_start + silence_end) / 2, True))
+        else:
+            cuts.append((target, False))
+        previous = cuts[-1][0]
+    return cuts
+
+
+# Containers whose segments come out right when stream copied. FLAC and MP3 segments keep
+# headers describing the whole file, so those are re-encoded to FLAC in Ogg instead.
+SPLIT_COPY_EXTENSIONS = {".m4a", ".ogg"}
+
+
+def split_audio(file_path: str, cut_times: list[float], out_dir: str) -> list[tuple[str, float, float]]:
+    """
+    Cut audio at the given times in one ffmpeg pass, without re-encoding when the
+    container allows. Copied cuts land on the packet boundary nearest each time, a few
+    milliseconds off at most.
+
+    Returns:
+        list: (segment path, actual start, actual end) in time order
+    """
+    extension = Path(file_path).suffix
+    if extension in SPLIT_COPY_EXTENSIONS:
+        codec_args = ["-c", "copy"]
+    else:
+        codec_args, extension = AUDIO_PROFILES["flac"].encode_args(), ".ogg"
+    list_path = os.path.join(out_dir, "segments.csv")
+    run_ffmpeg([
+        "-y", "-i", file_path, "-map", "0:a:0", *codec_args,
+        "-f", "segment", "-segment_times", ",".join(f"{t:.3f}" for t in cut_times),
+        "-segment_list", list_path, "-segment_list_type", "csv", "-reset_timestamps", "1",
+        os.path.join(out_dir, f"segment%04d{extension}"),
+    ])
+    segments = []
+    with open(list_path, "r") as f:
+        for line in f:
+            name, start, end = line.strip().rsplit(",", 2)
+            segments.append((os.path.join(out_dir, name), float(start), float(end)))
+    return segments
+
+
+class AudioCache:
+    """
+    Disk cache of lecture audio tracks extracted for transcription.
+
+    Each track is written by a single ffmpeg pass with the chosen AudioProfile, or stream
+    copied when the profile allows the source codec, so no frames are decoded in Python.
+    Tracks are keyed by video path, size and mtime together with the profile, and are
+    evicted least recently used first once they exceed max_bytes. The video duration is
+    kept next to each track, so a cache hit never opens the video.
+
+    Every track extract returns stays pinned until it is released, so concurrent ingests
+    never evict a track another one is still splitting or uploading.
+
+    Args:
+        cache_dir (str): Directory for the audio tracks
+        max_bytes (int): Size limit of the cache
+        profile (str): Name of the default AudioProfile
+    """
+
+    def __init__(self, cache_dir: str = ".cache/audio", max_bytes: int = 1 << 30, profile: str = "copy"):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.profile = profile
+        # Track path -> extracts not released yet, never evicted while above zero
+        self._pins: Counter[Path] = Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _video_key(file_path: str, profile: str) -> str:
+        stat = os.stat(file_path)
+        key_source = f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}:{profile}"
+        return hashlib.sha256(key_source.encode()).hexdigest()[:24]
+
+    def extract(self, file_path: str, profile: Optional[str] = None) -> tuple[str, Optional[float]]:
+        """
+        Get the audio track of a video, extracting it on first use. The track is pinned
+        against eviction until release is called with its path.
+
+        Args:
+            file_path (str): Path to the video
+            profile (Optional[str]): Name of the AudioProfile, the cache's default if None
+
+        Returns:
+            tuple: Contains (audio path, video duration in seconds)
+        """
+        profile = AUDIO_PROFILES[profile or self.profile]
+        key = self._video_key(file_path, profile.name)
+        info_path = self.cache_dir / "info" / f"{key}.json"
+        if info_path.exists():
+            with open(info_path, "r") as f:
+                info = json.load(f)
+            audio_path = self.cache_dir / "tracks" / info["file_name"]
+            with self._lock:
+                if audio_path.exists():
+                    logger.info("Audio file already exists, skipping conversion")
+                    # Reusing a track counts as a use for LRU eviction
+                    os.utime(audio_path)
+                    self._pins[audio_path] += 1
+                    return str(audio_path), info["duration"]
+
+        codec_args = profile.encode_args()
+        extension = profile.extension
+        if profile.copy_codecs:
+            source_codec = probe_audio_codec(file_path)
+            if source_codec in profile.copy_codecs:
+                codec_args, extension = ["-c:a", "copy"], profile.copy_codecs[source_codec]
+
+        tracks_dir = self.cache_dir / "tracks"
+        tracks_dir.mkdir(parents=True, exist_ok=True)
+        audio_path = tracks_dir / f"{key}.{extension}"
+        tmp_path = tracks_dir / f"{key}.{os.getpid()}.{threading.get_ident()}.tmp.{extension}"
+        with self._lock:
+            self._pins[audio_path] += 1
+        start_time = time.perf_counter()
+        try:
+            output = run_ffmpeg(["-y", "-i", file_path, "-map", "0:a:0", "-vn", *codec_args, str(tmp_path)])
+            os.replace(tmp_path, audio_path)
+        except Exception:
+            self.release(audio_path)
+            raise
+        duration = parse_duration(output)
+
+        audio_bytes = audio_path.stat().st_size
+        logger.info(
+            f"Extracted audio of {os.path.basename(file_path)} ({profile.name}, {' '.join(codec_args)}) in "
+            f"{time.perf_counter() - start_time:.2f}s: {audio_bytes / (1 << 20):.2f} MB from "
+            f"{os.path.getsize(file_path) / (1 << 20):.2f} MB of video"
+        )
+
+        info_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_info = info_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_info, "w") as f:
+            json.dump({"file_name": audio_path.name, "duration": duration, "profile": profile.name}, f)
+        os.replace(tmp_info, info_path)
+
+        with self._lock:
+            evict_lru_files(tracks_dir, self.max_bytes, keep=set(self._pins))
+        return str(audio_path), duration
+
+    def release(self, audio_path: str):
+        """Unpin a track returned by extract once it was transcribed, letting it be evicted again"""
+        audio_path = Path(audio_path)
+        with self._lock:
+            if self._pins[audio_path] > 1:
+                self._pins[audio_path] -= 1
+            else:
+                self._pins.pop(audio_path, None)
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in list_cache_files(self.cache_dir / "tracks"))
+
+
+# Shared by the ingest pipeline and every Video
+audio_cache = AudioCache()
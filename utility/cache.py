@@ -0,0 +1,410 @@
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Hashable, Iterable, Optional
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+from snowflake.cortex import embed_text_768
+
+
+class LRUTTLCache:
+    """
+    Thread-safe in-memory cache with least-recently-used eviction and a time to live.
+
+    Entries older than ttl seconds are treated as missing, and once maxsize entries are
+    stored the least recently used one is dropped. Hits and misses are counted.
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Get a cached value, or None if it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def evict_if(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Delete every entry whose key matches the predicate"""
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+@lru_cache(maxsize=1 << 16)
+def _feature_bucket(feature: str, dim: int) -> int:
+    # A stable hash, so embeddings match across processes
+    digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % dim
+
+
+def embed_text(text: str, dim: int = 4096) -> np.ndarray:
+    """
+    Embeds text locally as a unit-length vector of hashed word unigrams, word bigrams and
+    character trigrams. Cheap enough to run on every question and good at catching
+    rewordings that share most of their terms.
+    """
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f" {word} "
+        features += [padded[i : i + 3] for i in range(len(padded) - 2)]
+
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in features:
+        vector[_feature_bucket(feature, dim)] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+# Words that flip or bound the meaning of a question while barely changing its wording
+NEGATIONS = {"not", "no", "never", "without", "none", "neither", "nor", "cannot", "nothing"}
+COMPARATORS = {
+    "under", "over", "above", "below", "less", "more", "fewer", "greater", "higher", "lower",
+    "before", "after", "older", "younger", "better", "worse", "least", "most", "increase",
+    "decrease", "increases", "decreases", "larger", "smaller", "minimum", "maximum", "first", "last",
+}
+NUMBER_WORDS = {
+    word: str(value)
+    for value, word in enumerate(
+        "zero one two three four five six seven eight nine ten eleven twelve thirteen fourteen "
+        "fifteen sixteen seventeen eighteen nineteen twenty".split()
+    )
+}
+MARKER_STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "do", "does", "did", "of", "in", "on", "for",
+    "to", "and", "or", "with", "by", "from", "what", "why", "how", "when", "which", "who", "than",
+}
+
+
+def meaning_markers(text: str) -> tuple:
+    """
+    Get the parts of a question whose change flips its meaning: the numbers in order,
+    whether it is negated, the comparison words in order and the content words in order.
+    """
+    words = re.findall(r"[a-z0-9]+(?:'t)?", text.lower().replace("\u2019", "'"))
+    numbers = tuple(NUMBER_WORDS.get(word, word) for word in words if word.isdigit() or word in NUMBER_WORDS)
+    negated = any(word in NEGATIONS or word.endswith("n't") for word in words)
+    comparators = tuple(word for word in words if word in COMPARATORS)
+    content = tuple(word for word in words if word not in MARKER_STOPWORDS)
+    return numbers, negated, comparators, content
+
+
+def same_meaning_markers(query: str, other: str) -> bool:
+    """
+    Whether two similar questions agree on what embeddings are weak at telling apart:
+    numbers, negation, comparisons, and the order of the same words ("CT vs MRI" and
+    "MRI vs CT"). A False only costs a cache miss.
+    """
+    numbers, negated, comparators, content = meaning_markers(query)
+    other_numbers, other_negated, other_comparators, other_content = meaning_markers(other)
+    if (numbers, negated, comparators) != (other_numbers, other_negated, other_comparators):
+        return False
+    return content == other_content or sorted(content) != sorted(other_content)
+
+
+def normalize_question(text: str) -> str:
+    """Lowercase text with whitespace collapsed and the closing punctuation dropped"""
+    return " ".join(text.lower().split()).rstrip("?!. ")
+
+
+class CortexEmbedder:
+    """
+    Embeds text with Cortex EMBED_TEXT_768 as a unit-length vector. Recent texts are
+    memoized, so a question looked up and then added is embedded once.
+
+    Args:
+        model (str): Cortex embedding model
+        session (Optional[Session]): Snowpark session used when the caller passes none
+    """
+
+    def __init__(self, model: str = "snowflake-arctic-embed-m-v1.5", session=None):
+        self.model = model
+        self.session = session
+        self.name = f"cortex:{model}"
+        self._memo = LRUTTLCache(maxsize=1024, ttl=3600.0)
+
+    def __call__(self, text: str, session=None) -> np.ndarray:
+        vector = self._memo.get(text)
+        if vector is None:
+            vector = np.asarray(embed_text_768(self.model, text, session=session or self.session), dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            vector = vector / norm if norm else vector
+            self._memo.set(text, vector)
+        return vector
+
+
+class SemanticAnswerCache:
+    """
+    Cache of LLM answers looked up by question similarity.
+
+    Answers are scoped to a course, model and exact set of selected lectures. A lookup
+    hits when the cosine similarity of the question embeddings reaches threshold and the
+    questions agree on numbers, negation, comparisons and word order (same_meaning_markers).
+    Questions are embedded semantically with Cortex by default. Entries are persisted per
+    course as JSON lines under cache_dir together with their embedding, so answers
+    pre-computed by the warm-up command are picked up by a running app on its next lookup
+    without embedding them again. The file is rewritten with the newest max_entries once it
+    grows a quarter past that.
+
+    A lookup only embeds the question when it could hit: entries are indexed by scope and
+    meaning markers, a question asked verbatim before is answered from that index, and a
+    question no entry shares markers with misses without a Cortex call. Lookups and adds
+    take the caller's Snowpark session for the Cortex embedding calls, since the active
+    session is ambiguous in an app that holds more than one.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = ".cache/answers",
+        threshold: float = 0.9,
+        max_entries: int = 2000,
+        embed: Optional[Callable[[str], np.ndarray]] = None,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.embed = embed or CortexEmbedder()
+        # Stored with every entry, entries of another embedder are embedded again on load
+        self.embedder_name = getattr(self.embed, "name", getattr(self.embed, "__name__", "custom"))
+        # course -> (file mtime when loaded, entries, stacked embeddings, marker index)
+        self._courses: dict[str, tuple[Optional[float], list[dict], np.ndarray, dict]] = {}
+        # course -> lines in its file, to know when to trim it
+        self._file_lines: dict[str, int] = {}
+        # course -> times it was invalidated, so warm-ups of older data can stop
+        self._generations: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _course_file(self, course_name: str) -> Path:
+        return self.cache_dir / f"{course_name}.jsonl"
+
+    def _embed(self, text: str, session) -> np.ndarray:
+        # Only Cortex embedders call out with a session
+        if session is not None and isinstance(self.embed, CortexEmbedder):
+            return self.embed(text, session=session)
+        return self.embed(text)
+
+    def _entry_vector(self, entry: dict, session) -> np.ndarray:
+        if entry.get("embedder") == self.embedder_name and "embedding" in entry:
+            return np.frombuffer(base64.b64decode(entry["embedding"]), dtype=np.float32)
+        vector = self._embed(entry["query"], session)
+        entry.update(embedder=self.embedder_name, embedding=base64.b64encode(vector.astype(np.float32).tobytes()).decode())
+        return vector
+
+    @staticmethod
+    def _marker_key(scope: list, query: str) -> tuple:
+        """Entries under the same key are the only ones same_meaning_markers can accept"""
+        numbers, negated, comparators, _ = meaning_markers(query)
+        return json.dumps(scope), numbers, negated, comparators
+
+    def _index(self, entries: list[dict]) -> dict[tuple, list[int]]:
+        index = {}
+        for idx, entry in enumerate(entries):
+            index.setdefault(self._marker_key(entry["scope"], entry["query"]), []).append(idx)
+        return index
+
+    def _load(self, course_name: str, session=None) -> tuple[list[dict], np.ndarray, dict]:
+        """Loads a course's entries, re-reading the file if another process appended to it"""
+        course_file = self._course_file(course_name)
+        mtime = course_file.stat().st_mtime if course_file.exists() else None
+        loaded = self._courses.get(course_name)
+        if loaded is not None and loaded[0] == mtime:
+            return loaded[1:]
+
+        entries = []
+        if mtime is not None:
+            with open(course_file, "r") as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+        self._file_lines[course_name] = len(entries)
+        entries = entries[-self.max_entries :]
+        vectors = np.stack([self._entry_vector(entry, session) for entry in entries]) if entries else None
+        index = self._index(entries)
+        self._courses[course_name] = (mtime, entries, vectors, index)
+        return entries, vectors, index
+
+    @staticmethod
+    def _scope(model_name: str, lecture_names: list[str]) -> list:
+        return [model_name, sorted(set(lecture_names))]
+
+    def lookup(
+        self, course_name: str, model_name: str, lecture_names: list[str], query: str, session=None
+    ) -> Optional[str]:
+        """Get the answer of the most similar cached question in the same scope, if similar enough"""
+        scope = self._scope(model_name, lecture_names)
+        key = self._marker_key(scope, query)
+        with self._lock:
+            entries, vectors, index = self._load(course_name, session)
+            candidates = [idx for idx in index.get(key, []) if same_meaning_markers(query, entries[idx]["query"])]
+            normalized = normalize_question(query)
+            exact = [idx for idx in candidates if normalize_question(entries[idx]["query"]) == normalized]
+            if exact or not candidates:
+                return self._count(entries[exact[-1]]["answer"] if exact else None)
+            answers = [entries[idx]["answer"] for idx in candidates]
+            candidate_vectors = vectors[candidates]
+
+        # Embedding is a Cortex call, made outside the lock every session shares
+        scores = candidate_vectors @ self._embed(query, session)
+        best = int(np.argmax(scores))
+        with self._lock:
+            return self._count(answers[best] if scores[best] >= self.threshold else None)
+
+    def _count(self, answer: Optional[str]) -> Optional[str]:
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return answer
+
+    def add(self, course_name: str, model_name: str, lecture_names: list[str], query: str, answer: str, session=None):
+        vector = self._embed(query, session)
+        with self._lock:
+            entries, vectors, index = self._load(course_name, session)
+            scope = self._scope(model_name, lecture_names)
+            entry = {
+                "scope": scope,
+                "query": query,
+                "answer": answer,
+                "created_at": time.time(),
+                "embedder": self.embedder_name,
+                "embedding": base64.b64encode(vector.astype(np.float32).tobytes()).decode(),
+            }
+            dropped = max(len(entries) + 1 - self.max_entries, 0)
+            entries = (entries + [entry])[dropped:]
+            vectors = vector[None, :] if vectors is None else np.concatenate([vectors, vector[None, :]])[dropped:]
+            index = {
+                key: [idx - dropped for idx in positions if idx >= dropped]
+                for key, positions in index.items()
+                if positions[-1] >= dropped
+            }
+            index.setdefault(self._marker_key(scope, query), []).append(len(entries) - 1)
+
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            course_file = self._course_file(course_name)
+            file_lines = self._file_lines.get(course_name, 0) + 1
+            if file_lines > self.max_entries * 1.25:
+                # Written aside and swapped in, so readers never see a partial file
+                tmp_path = course_file.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+                with open(tmp_path, "w") as f:
+                    f.writelines(json.dumps(kept) + "\n" for kept in entries)
+                os.replace(tmp_path, course_file)
+                file_lines = len(entries)
+            else:
+                with open(course_file, "a") as f:
+                    f.write(json.dumps(entry) + "\n")
+            self._file_lines[course_name] = file_lines
+            self._courses[course_name] = (course_file.stat().st_mtime, entries, vectors, index)
+
+    def invalidate(self, course_name: str):
+        """Drop every answer of a course, in memory and on disk"""
+        with self._lock:
+            self._courses.pop(course_name, None)
+            self._file_lines.pop(course_name, None)
+            self._generations[course_name] = self._generations.get(course_name, 0) + 1
+            self._course_file(course_name).unlink(missing_ok=True)
+
+    def generation(self, course_name: str) -> int:
+        """Times the course was invalidated in this process"""
+        with self._lock:
+            return self._generations.get(course_name, 0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def list_cache_files(directory: Path, pattern: str = "*") -> list[tuple[float, int, Path]]:
+    """Get (mtime, size, path) of every finished file in a disk cache, skipping temporary files"""
+    files = []
+    for path in Path(directory).glob(pattern):
+        if ".tmp" in path.name or not path.is_file():
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    return files
+
+
+def evict_lru_files(directory: Path, max_bytes: int, pattern: str = "*", keep: Iterable[Path] = ()) -> int:
+    """
+    Delete the least recently used files of a disk cache until it fits in max_bytes.
+    Files count as used when their mtime is bumped, files in keep are never deleted.
+
+    Returns:
+        int: Number of files deleted
+    """
+    keep = {Path(path) for path in keep}
+    files = sorted(list_cache_files(directory, pattern), key=lambda file: file[0])
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for _, size, path in files:
+        if total <= max_bytes:
+            break
+        if path in keep:
+            continue
+        path.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+    return removed
+
+
+# Search results shared by every session, keys start with the course name
+retrieval_cache = LRUTTLCache(maxsize=1024, ttl=600.0)
+# Answers shared by every session and the warm-up command
+answer_cache = SemanticAnswerCache()
+
+
+def invalidate_course(course_name: str) -> int:
+    """Drop every cached result and answer derived from a course's data"""
+    answer_cache.invalidate(course_name)
+    return retrieval_cache.evict_if(lambda key: key[0] == course_name)
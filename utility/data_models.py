@@ -1,17 +1,20 @@
-from dataclasses import dataclass, asdict
-from typing import Optional
-import httpx
+from dataclasses import dataclass, asdict, field
+from typing import ClassVar, Optional
 import json
-import time
 import os
 import re
 import logging
 
-import boto3
-import streamlit as st
 from moviepy.video.io.VideoFileClip import VideoFileClip
-from deepgram import DeepgramClient, PrerecordedOptions, FileSource
-from langchain_community.document_loaders import AmazonTextractPDFLoader
+from langchain_core.documents import Document
+import pypdfium2 as pdfium
+
+from utility.audio import AudioCache, audio_cache
+from utility.page_renders import pdfium_lock
+from utility.textract import TextractExtractor, TextractJob, default_extractor
+from utility.tracing import tracer
+from utility.transcription import DeepgramTranscriber
+from utility.transcript_cache import TranscriptCache, transcript_cache
 
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning, module="moviepy")
@@ -28,6 +31,74 @@ class VideoSection:
     end: float
 
 
+def chunk_transcript(
+    transcript: list[dict], chunk_configs: list[tuple[int, int]]
+) -> dict[tuple[int, int], list[VideoSection]]:
+    """
+    Splits a sentence-level transcript into overlapping time windows for several
+    (chunk_size, overlap) configurations at once.
+
+    Sentences are expected in time order, as Deepgram returns them. The start/end
+    times and texts are collected once and every configuration is then a single
+    two-pointer walk over them, so chunking is linear in the number of sentences.
+
+    Args:
+        transcript (list[dict]): List of transcript segments with start/end times and text
+        chunk_configs (list[tuple[int, int]]): (chunk_size, overlap) pairs in seconds
+
+    Returns:
+        dict: Maps each (chunk_size, overlap) pair to its list of chunks
+
+    Raises:
+        ValueError: If an overlap is not smaller than its chunk size
+    """
+    starts = [segment["start"] for segment in transcript]
+    ends = [segment["end"] for segment in transcript]
+    texts = [segment["text"] for segment in transcript]
+
+    results = {}
+    for chunk_size, overlap in chunk_configs:
+        if overlap >= chunk_size:
+            raise ValueError(
+                f"Overlap ({overlap}s) must be smaller than chunk size ({chunk_size}s)"
+            )
+        if (chunk_size, overlap) in results:
+            continue
+
+        chunks = []
+        if transcript:
+            first = last = 0
+            current_start = starts[0]
+            current_end = current_start + chunk_size
+
+            # Sliding Window: both pointers only ever move forward
+            while current_start < ends[-1]:
+                # Drop segments that ended before the window
+                while first < len(ends) and ends[first] < current_start:
+                    first += 1
+                # Take segments that start inside the window
+                while last < len(starts) and starts[last] <= current_end:
+                    last += 1
+
+                # Windows falling entirely inside a silence have no text
+                if first < last:
+                    chunks.append(
+                        VideoSection(
+                            text=" ".join(texts[first:last]),
+                            start=round(max(starts[first], current_start), 1),
+                            end=round(ends[last - 1], 1),
+                        )
+                    )
+
+                # Handles overlap
+                current_start += chunk_size - overlap
+                current_end = current_start + chunk_size
+
+        results[(chunk_size, overlap)] = chunks
+
+    return results
+
+
 @dataclass
 class Video:
     """
@@ -38,19 +109,97 @@ class Video:
         duration (Optional[int]): Duration of the video in seconds
         whole_transcript (Optional[str]): Complete transcript of the video
         sentence_level_transcript (Optional[list[dict]]): Transcript broken down into sentences with timestamps
+        transcriber: Speech-to-text backend, DeepgramTranscriber unless a stand-in is given
+        cache (Optional[TranscriptCache]): On-disk transcript cache, None to always transcribe
+        audio (AudioCache): Where the audio track sent for transcription is extracted to
+        audio_profile (Optional[str]): Name of the AudioProfile to extract with, the audio cache's default if None
     """
 
+    # Bump when transcription or chunking changes in a way that should trigger re-ingestion
+    extractor_version: ClassVar[str] = "1"
+
     file_path: str
     duration: Optional[int] = None
     transcript: Optional[str] = None
     chunks: Optional[list[VideoSection]] = None
+    sentence_level_transcript: Optional[list[dict]] = None
+    transcriber: DeepgramTranscriber = field(default_factory=DeepgramTranscriber, repr=False)
+    cache: Optional[TranscriptCache] = field(default=transcript_cache, repr=False)
+    audio: AudioCache = field(default=audio_cache, repr=False)
+    audio_profile: Optional[str] = None
 
-    def _transcribe(self):
+    def _cache_key(self) -> str:
+        return self.cache.make_key(self.file_path, self.transcriber.model, self.transcriber.options)
+
+    def _load_cached_transcript(self) -> bool:
         """
-        Transcribes a video file using Deepgram API.
+        Restores duration and transcript from the cache.
 
-        Args:
-            file_path (str): Path to the video file
+        Returns:
+            bool: Whether a cached transcript was found
+        """
+        if self.cache is None:
+            return False
+
+        cached = self.cache.get(self._cache_key())
+        if cached is None:
+            return False
+
+        logger.info("Transcript found in cache, skipping transcription")
+        self.duration = cached["duration"]
+        self.whole_transcript = cached["transcript"]
+        self.sentence_level_transcript = cached["sentences"]
+        return True
+
+    def _extract_audio(self) -> str:
+        """
+        Extracts the audio track into the audio cache (unless already there) and records the
+        duration. The track stays pinned in the cache until _transcribe_audio is done with it.
+
+        Returns:
+            str: Path to the audio file
+        """
+        with tracer.span("video.extract_audio", profile=self.audio_profile or self.audio.profile) as span:
+            audio_file_path, duration = self.audio.extract(self.file_path, self.audio_profile)
+            if duration is None:
+                # ffmpeg could not tell from the container, so read it the slow way
+                with VideoFileClip(self.file_path) as video_file:
+                    duration = video_file.duration
+            self.duration = int(duration)
+            span.set_attributes(audio_bytes=os.path.getsize(audio_file_path), duration=self.duration)
+        return audio_file_path
+
+    def _transcribe_audio(self, audio_file_path: str):
+        """
+        Sends the audio to the transcriber and stores the result in the cache. The track
+        extracted by _extract_audio is released from the audio cache either way.
+        """
+        try:
+            audio_bytes = os.path.getsize(audio_file_path)
+            logger.info(f"Uploading {audio_bytes / (1 << 20):.2f} MB of audio for {os.path.basename(self.file_path)}")
+            with tracer.span("video.transcribe", model=self.transcriber.model, audio_bytes=audio_bytes) as span:
+                self.whole_transcript, self.sentence_level_transcript = self.transcriber.transcribe(audio_file_path)
+                span.set_attribute("sentences", len(self.sentence_level_transcript))
+        finally:
+            self.audio.release(audio_file_path)
+
+        if self.cache is not None:
+            self.cache.put(
+                self._cache_key(),
+                self.file_path,
+                self.transcriber.model,
+                self.transcriber.options,
+                self.duration,
+                self.whole_transcript,
+                self.sentence_level_transcript,
+            )
+
+        logger.info("Transcription completed successfully")
+
+    def _transcribe(self):
+        """
+        Transcribes a video file, reusing the cached transcript when the same file
+        was already transcribed with the same model and options.
 
         Returns:
             tuple: Contains (duration, whole_transcript, sentence_level_transcript)
@@ -63,52 +212,10 @@ class Video:
         if not os.path.exists(self.file_path):
             raise FileNotFoundError(f"File not found: {self.file_path}")
 
-        audio_file_name = os.path.splitext(os.path.basename(self.file_path))[0] + ".mp3"
-        audio_file_path = os.path.join(os.path.dirname(self.file_path), audio_file_name)
-        video_file = VideoFileClip(self.file_path)
-
-        if os.path.exists(audio_file_path):
-            logger.info("Audio file already exists, skipping conversion")
-        else:
-            logger.info("Converting video to audio")
-            video_file.audio.write_audiofile(audio_file_path, logger=None)
-        
-        # STEP 1 Create a Deepgram client using the API key
-        deepgram = DeepgramClient(api_key=st.secrets.deepgram.api_key)
-
-        with open(audio_file_path, "rb") as file:
-            buffer_data = file.read()
-
-        payload: FileSource = {
-            "buffer": buffer_data,
-        }
-
-        # Configure Deepgram options for audio analysis
-        options = PrerecordedOptions(
-            model="nova-2-video",
-            smart_format=True,
-        )
-
-        logger.info("Converting speech to text")
-        # Call the transcribe_file method with the text payload and options
-        start_time = time.time()
-        response = deepgram.listen.rest.v("1").transcribe_file(
-            payload, options, timeout=httpx.Timeout(300, connect=10)
-        )
-        print(f"Time taken: {time.time() - start_time}")
-
-        # Parse the response
-        results = json.loads(response.to_json())["results"]
-        results = results["channels"][0]["alternatives"][0]
-        whole_transcript = results["transcript"]
-        sentence_level_transcript = []
-
-        for paragraph in results["paragraphs"]["paragraphs"]:
-            for sentence in paragraph["sentences"]:
-                sentence_level_transcript.append(sentence)
+        if not self._load_cached_transcript():
+            self._transcribe_audio(self._extract_audio())
 
-        logger.info("Transcription completed successfully")
-        return int(video_file.duration), whole_transcript, sentence_level_transcript
+        return self.duration, self.whole_transcript, self.sentence_level_transcript
 
     def _chunk_text(self, transcript: list[dict], chunk_size: int, overlap: int) -> list[VideoSection]:
         """
@@ -122,105 +229,150 @@ class Video:
         Returns:
             list[dict]: List of chunks containing text, start and end times
         """
-        chunks = []
-        current_start = transcript[0]["start"]
-        current_end = current_start + chunk_size
-
-        # Sliding Window
-        while current_start < transcript[-1]["end"]:
-            chunk_text = []
-            chunk_start = None
-            chunk_end = None
-
-            # Collect segments that fall within current window
-            for segment in transcript:
-                if segment["end"] < current_start:
-                    continue
-                if segment["start"] > current_end:
-                    break
-
-                if chunk_start is None:
-                    chunk_start = max(segment["start"], current_start)
-
-                chunk_text.append(segment["text"])
-                chunk_end = segment["end"]
-
-            chunks.append(
-                VideoSection(
-                    text=" ".join(chunk_text),
-                    start=round(chunk_start, 1),
-                    end=round(chunk_end, 1),
-                )
-            )
-
-            # Handles overlap
-            current_start += chunk_size - overlap
-            current_end = current_start + chunk_size
-
-        return chunks
+        return chunk_transcript(transcript, [(chunk_size, overlap)])[(chunk_size, overlap)]
 
     def process_content(self, chunk_size: int = 60, overlap: int = 10):
         """
         Processes the video content by calling the transcribe method and storing the results.
+        Calling it again with another chunk size or overlap re-chunks without transcribing.
         """
-        self.duration, self.whole_transcript, sentence_level_transcript = self._transcribe()
-        self.chunks = self._chunk_text(sentence_level_transcript, chunk_size, overlap)
+        if self.sentence_level_transcript is None:
+            self.duration, self.whole_transcript, self.sentence_level_transcript = self._transcribe()
+        self.chunks = self._chunk_text(self.sentence_level_transcript, chunk_size, overlap)
 
 
 @dataclass
 class NoteSection:
     text: str
     page_num: int
+    # "text_layer" when read from the PDF itself, "textract" when OCRed
+    extraction: str = "textract"
+
+
+def clean_page_text(text: str) -> str:
+    text = re.sub(r'[\n\r]+', ' ', text)
+    text = re.sub(r'\s{2,}', ' ', text)
+    return text.strip()
+
+
+def is_usable_text_layer(text: str, min_chars: int = 40, min_word_ratio: float = 0.6) -> bool:
+    """
+    Check whether the embedded text of a page can stand in for OCR. Scanned pages have
+    little or no text, and broken font encodings show up as replacement characters or
+    tokens that are not words.
+    """
+    text = clean_page_text(text)
+    if len(text) < min_chars or text.count("\ufffd") > len(text) * 0.01:
+        return False
+    tokens = text.split()
+    words = [token for token in tokens if re.search(r"[A-Za-z]{2,}", token)]
+    return len(words) >= len(tokens) * min_word_ratio
 
 
 @dataclass
 class Note:
+    # Bump when extraction or page cleaning changes in a way that should trigger re-ingestion
+    extractor_version: ClassVar[str] = "3"
+
     file_path: str
     num_pages: Optional[int] = None
     content: Optional[str] = None
     chunks: Optional[list[NoteSection]] = None
-
-    def _load_document(self):
-        """
-        Loads a PDF document using Amazon Textract and returns the content.
-        """
-        session = boto3.Session(
-            aws_access_key_id=st.secrets.aws.access_key_id,
-            aws_secret_access_key=st.secrets.aws.secret_access_key,
-            region_name=st.secrets.aws.default_region,
+    # Read pages with a usable embedded text layer locally, only OCR the rest
+    use_text_layer: bool = True
+    # Page number -> text of pages read from the text layer, and pages left for Textract
+    text_layer_pages: dict[int, str] = field(default_factory=dict, init=False, repr=False)
+    ocr_pages: list[int] = field(default_factory=list, init=False, repr=False)
+    # Defaults to the extractor shared by every note
+    textract: Optional[TextractExtractor] = field(default=None, repr=False)
+
+    def _read_text_layer(self):
+        """Split pages into ones with a usable text layer and ones that need OCR"""
+        with pdfium_lock:
+            pdf = pdfium.PdfDocument(self.file_path)
+            try:
+                page_texts = [pdf[idx].get_textpage().get_text_range() for idx in range(len(pdf))]
+            finally:
+                pdf.close()
+
+        self.text_layer_pages, self.ocr_pages = {}, []
+        for page_num, text in enumerate(page_texts, start=1):
+            if self.use_text_layer and is_usable_text_layer(text):
+                self.text_layer_pages[page_num] = text
+            else:
+                self.ocr_pages.append(page_num)
+        logger.info(
+            f"{os.path.basename(self.file_path)}: {len(self.text_layer_pages)} pages from the text layer, "
+            f"{len(self.ocr_pages)} for Textract"
         )
-        bucket_name = st.secrets.aws.bucket_name
-        file_name = os.path.basename(self.file_path)
-        bucket_file_path = f"s3://{bucket_name}/{file_name}"
 
-        logger.info(f"Uploading file to {bucket_file_path}")
-        bucket = session.client("s3")
-        bucket.upload_file(Filename=self.file_path, Bucket=bucket_name, Key=file_name)
+    def _upload(self) -> list[TextractJob]:
+        """
+        Reads the text layer, then uploads the pages that need OCR in batches and starts
+        an asynchronous Textract job for each.
 
-        logger.info("Extracting content from PDF")
-        textract = session.client("textract")
-        loader = AmazonTextractPDFLoader(bucket_file_path, client=textract)
-        documents = loader.load()
+        Returns:
+            list[TextractJob]: Started jobs, empty when no page needs OCR
+        """
+        with tracer.span("note.read_text_layer") as span:
+            self._read_text_layer()
+            span.set_attributes(text_layer_pages=len(self.text_layer_pages), ocr_pages=len(self.ocr_pages))
+        if not self.ocr_pages:
+            return []
+        self.textract = self.textract or default_extractor()
+        with tracer.span("note.textract_submit", pages=len(self.ocr_pages)):
+            return self.textract.submit(self.file_path, self.ocr_pages)
+
+    def _extract(self, jobs: list[TextractJob]) -> list:
+        """
+        Combines the text layer pages with the Textract output of the OCR pages, collected
+        as each job finishes.
 
-        bucket.delete_object(Bucket=bucket_name, Key=file_name)
+        Returns:
+            list[Document]: One document per page, in page order
+        """
+        documents = [
+            Document(page_content=text, metadata={"page": page_num, "extraction": "text_layer"})
+            for page_num, text in self.text_layer_pages.items()
+        ]
+        if jobs:
+            logger.info("Extracting content from PDF")
+            self.textract = self.textract or default_extractor()
+            with tracer.span("note.textract_collect", jobs=len(jobs)):
+                pages = self.textract.collect(jobs)
+            for page_num, text in pages.items():
+                documents.append(Document(page_content=text, metadata={"page": page_num, "extraction": "textract"}))
+        return sorted(documents, key=lambda doc: doc.metadata["page"])
+
+    def _split_pages(self, documents: list):
+        """
+        Cleans the extracted pages into one NoteSection per page.
 
+        Returns:
+            tuple: Contains (num_pages, whole_content, chunks)
+        """
         whole_content = ""
         chunks = []
 
         for doc in documents:
             # Clean text content, remove newlines
-            content = re.sub(r'[\n\r]+', ' ', doc.page_content)
-            content = re.sub(r'\s{2,}', ' ', content)
-            content = content.strip()
+            content = clean_page_text(doc.page_content)
 
             page = doc.metadata["page"]
             whole_content += f"{'-'*20}PAGE {page}{'-'*20}\n{content}\n\n"
-            chunks.append(NoteSection(text=content, page_num=page))
+            chunks.append(NoteSection(text=content, page_num=page, extraction=doc.metadata.get("extraction", "textract")))
 
         logger.info("Content extraction completed successfully")
 
         return len(documents), whole_content, chunks
 
+    def _load_document(self):
+        """
+        Loads a PDF document from its text layer, using Amazon Textract for pages without
+        a usable one, and returns the content.
+        """
+        return self._split_pages(self._extract(self._upload()))
+
         # TODO: Try capturing each page as a still and extract content using LLM
 
     def process_content(self):
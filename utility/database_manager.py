@@ -1,37 +1,104 @@
 from snowflake.connector.connection import SnowflakeConnection
+from contextlib import contextmanager
+from tempfile import TemporaryDirectory
+from datetime import datetime, timezone
+from typing import Optional
+from pathlib import Path
+import threading
+import uuid
+import pyarrow as pa
+import pyarrow.parquet as pq
 import streamlit as st
 
+from utility.cache import invalidate_course
+from utility.search_backend import delete_local_indexes
+
+@st.cache_resource
+def snowpark_session():
+    """
+    The app's one Snowpark session, shared by every portal session and the ingest warm-up.
+    Cortex calls without an explicit session fail once a process holds two.
+    """
+    return st.connection("snowflake").session()
+
+
+LOAD_STAGE = "snowtrail_load_stage"
+TABLE_COLUMNS = {
+    "video": ["text", "start_time", "end_time", "file_name", "lecture_name"],
+    "pdf": ["text", "page_num", "file_name", "lecture_name", "extraction"],
+}
+
 
 class DatabaseManager:
-    def __init__(self, conn: SnowflakeConnection):
+    # Process-wide catalog: course -> lecture -> names of processed files.
+    # Shared by every session, invalidated per course whenever ingest or delete runs.
+    _catalog: dict[str, dict[str, set[str]]] = {}
+    _catalog_lock = threading.Lock()
+    # Every session shares the one Snowflake connection, and a transaction belongs to the
+    # connection rather than a cursor. Every statement takes this lock and a transaction
+    # holds it until COMMIT, so no other session's statements land inside it.
+    _conn_lock = threading.RLock()
+
+    def __init__(
+        self,
+        conn: SnowflakeConnection,
+        bulk_load_threshold: int = 1000,
+        database: Optional[str] = None,
+        schema: Optional[str] = None,
+    ):
+        """
+        Args:
+            conn (SnowflakeConnection): Connection used for every query
+            bulk_load_threshold (int): Batches with at least this many rows are loaded through
+                a stage with PUT + COPY instead of INSERT with bound parameters
+            database (Optional[str]): Database name, defaults to the one in secrets.toml
+            schema (Optional[str]): Schema name, defaults to the one in secrets.toml
+        """
         self.conn = conn
+        self.bulk_load_threshold = bulk_load_threshold
+        self.database = database or st.secrets["connections"]["snowflake"]["database"]
+        self.schema = schema or st.secrets["connections"]["snowflake"]["schema"]
+        self._load_stage_ready = False
         self._init_database()
     
     def _init_database(self):
         create_db = f"""
-        CREATE DATABASE IF NOT EXISTS {st.secrets["connections"]["snowflake"]["database"]}
+        CREATE DATABASE IF NOT EXISTS {self.database}
         """
         self._run_query(create_db)
 
         create_schema = f"""
-        CREATE SCHEMA IF NOT EXISTS {st.secrets["connections"]["snowflake"]["schema"]}
+        CREATE SCHEMA IF NOT EXISTS {self.schema}
         """
         self._run_query(create_schema)
 
     def _run_query(self, query: str, params=None, return_results: bool = False):
-        cursor = self.conn.cursor()
-        try:
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
-            if return_results:
-                return cursor.fetchall()
-            return True
-        except Exception as e:
-            raise Exception(f"Error executing query: {str(e)}")
-        finally:
-            cursor.close()
+        with DatabaseManager._conn_lock:
+            cursor = self.conn.cursor()
+            try:
+                if params:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
+                if return_results:
+                    return cursor.fetchall()
+                return True
+            except Exception as e:
+                raise Exception(f"Error executing query: {str(e)}")
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def _transaction(self):
+        """Run the block's statements as one transaction, rolled back if the block raises"""
+        with DatabaseManager._conn_lock:
+            self._run_query("BEGIN")
+            try:
+                yield
+                self._run_query("COMMIT")
+            except Exception:
+                self._run_query("ROLLBACK")
+                raise
 
     def create_table(self, course_name: str):
         video_table = f"{course_name}_video"
@@ -52,14 +119,33 @@ class DatabaseManager:
             text STRING,
             page_num INTEGER,
             file_name STRING,
-            lecture_name STRING
+            lecture_name STRING,
+            extraction STRING
         )
         """
+        # Tables created before pages recorded how they were extracted
+        pdf_migration_query = f"ALTER TABLE {pdf_table} ADD COLUMN IF NOT EXISTS extraction STRING"
         
+        # One row per ingested file, used to skip unchanged files on re-ingestion
+        manifest_query = f"""
+        CREATE TABLE IF NOT EXISTS {course_name}_manifest (
+            file_name STRING,
+            lecture_name STRING,
+            content_type STRING,
+            content_hash STRING,
+            extractor_version STRING,
+            chunk_config STRING,
+            num_chunks INTEGER,
+            processed_at TIMESTAMP_NTZ
+        )
+        """
+
         self._run_query(video_query)
         self._run_query(pdf_query)
+        self._run_query(pdf_migration_query)
+        self._run_query(manifest_query)
     
-    def insert_data(self, course_name: str, data: list[tuple], content_type: str):
+    def insert_data(self, course_name: str, data: list[tuple], content_type: str, bulk: Optional[bool] = None):
         """
         Generic method to insert data into video or pdf tables
         
@@ -67,31 +153,235 @@ class DatabaseManager:
             course_name (str): Name of the course to insert into
             data (list[tuple]): List of data tuples to insert
             content_type (str): Type of content - "video" or "pdf"
+            bulk (Optional[bool]): Force the staged bulk load on or off,
+                by default it is used for batches of at least bulk_load_threshold rows
         """
         print(f'Inserting {content_type} data into {course_name}')
-        if content_type == "video":
-            columns = "(text, start_time, end_time, file_name, lecture_name)"
-            placeholders = "(?, ?, ?, ?, ?)"
-        elif content_type == "pdf":
-            columns = "(text, page_num, file_name, lecture_name)" 
-            placeholders = "(?, ?, ?, ?)"
-        else:
+        if content_type not in TABLE_COLUMNS:
             raise ValueError(f"Invalid content type: {content_type}")
 
         table_name = f'{course_name}_{content_type}'
+        column_names = TABLE_COLUMNS[content_type]
+
+        if bulk is None:
+            bulk = len(data) >= self.bulk_load_threshold
+        if bulk and data:
+            self._bulk_load(table_name, column_names, data)
+            return
+
+        columns = f"({', '.join(column_names)})"
+        placeholders = f"({', '.join('?' for _ in column_names)})"
         insert_query = f"""
         INSERT INTO {table_name} {columns}
         VALUES {placeholders}
         """
 
-        cursor = self.conn.cursor()
+        with DatabaseManager._conn_lock:
+            cursor = self.conn.cursor()
+            try:
+                cursor.executemany(insert_query, data)
+            except Exception as e:
+                raise Exception(f"Error inserting data into table {table_name}: {str(e)}")
+            finally:
+                cursor.close()
+
+    def _create_load_stage(self):
+        """
+        Creates the session's temporary load stage once. This is DDL, which commits any open
+        transaction, so callers loading inside a transaction create it before BEGIN.
+        """
+        if not self._load_stage_ready:
+            self._run_query(f"CREATE TEMPORARY STAGE IF NOT EXISTS {LOAD_STAGE}")
+            self._load_stage_ready = True
+
+    def _bulk_load(self, table_name: str, column_names: list[str], data: list[tuple]):
+        """
+        Writes the batch to a single Parquet file, uploads it to a temporary stage and
+        loads it with one COPY INTO, instead of sending every row as bound parameters.
+        """
+        columns = {name: [row[idx] for row in data] for idx, name in enumerate(column_names)}
+
+        with TemporaryDirectory() as tmp_dir:
+            # Unique name, COPY INTO skips files whose name and content it already loaded
+            file_name = f"{table_name}_{uuid.uuid4().hex}.parquet"
+            file_path = Path(tmp_dir) / file_name
+            pq.write_table(pa.table(columns), file_path, compression="snappy")
+
+            try:
+                self._create_load_stage()
+                self._run_query(
+                    f"PUT 'file://{file_path.as_posix()}' @{LOAD_STAGE}/{table_name} "
+                    "AUTO_COMPRESS = FALSE OVERWRITE = TRUE"
+                )
+                self._run_query(f"""
+                COPY INTO {table_name}
+                FROM @{LOAD_STAGE}/{table_name}/{file_name}
+                FILE_FORMAT = (TYPE = PARQUET)
+                MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE
+                PURGE = TRUE
+                """)
+            except Exception as e:
+                raise Exception(f"Error bulk loading data into table {table_name}: {str(e)}")
+
+    def get_manifest(self, course_name: str) -> dict[tuple[str, str], dict]:
+        """
+        Get the manifest of every ingested file in a course.
+
+        Returns:
+            dict: Maps (lecture_name, file_name) to its manifest entry
+        """
+        query = f"""
+        SELECT lecture_name, file_name, content_type, content_hash, extractor_version, chunk_config, num_chunks
+        FROM {course_name}_manifest
+        """
+        results = self._run_query(query, return_results=True)
+        return {
+            (lecture_name, file_name): {
+                "content_type": content_type,
+                "content_hash": content_hash,
+                "extractor_version": extractor_version,
+                "chunk_config": chunk_config,
+                "num_chunks": num_chunks,
+            }
+            for lecture_name, file_name, content_type, content_hash, extractor_version, chunk_config, num_chunks in results
+        }
+
+    def replace_file_chunks(
+        self,
+        course_name: str,
+        content_type: str,
+        lecture_name: str,
+        file_name: str,
+        data: list[tuple],
+        content_hash: str,
+        extractor_version: str,
+        chunk_config: str,
+    ):
+        """
+        Atomically swaps the chunks of a single file and records it in the manifest.
+        Either the old chunks and manifest entry or the new ones are visible, never a mix,
+        so a failed run can simply be retried.
+        """
+        self.replace_files_chunks(course_name, [
+            {
+                "content_type": content_type,
+                "lecture_name": lecture_name,
+                "file_name": file_name,
+                "rows": data,
+                "content_hash": content_hash,
+                "extractor_version": extractor_version,
+                "chunk_config": chunk_config,
+            }
+        ])
+
+    def replace_files_chunks(self, course_name: str, files: list[dict]):
+        """
+        Atomically swaps the chunks of several files and records them in the manifest, in
+        one transaction. The rows of every file are inserted together per table, so a batch
+        of small files still reaches bulk_load_threshold and goes through the staged load.
+
+        Args:
+            course_name (str): Name of the course
+            files (list[dict]): Per file: content_type, lecture_name, file_name, rows,
+                content_hash, extractor_version and chunk_config
+        """
+        rows = {content_type: [] for content_type in TABLE_COLUMNS}
+        for file in files:
+            rows[file["content_type"]].extend(file["rows"])
+        bulk = {content_type: len(data) >= self.bulk_load_threshold for content_type, data in rows.items()}
+        if any(bulk.values()):
+            self._create_load_stage()
+
+        manifest_entries = [
+            (
+                file["file_name"],
+                file["lecture_name"],
+                file["content_type"],
+                file["content_hash"],
+                file["extractor_version"],
+                file["chunk_config"],
+                len(file["rows"]),
+            )
+            for file in files
+        ]
+
         try:
-            cursor.executemany(insert_query, data)
-        except Exception as e:
-            raise Exception(f"Error inserting data into table {table_name}: {str(e)}")
+            with self._transaction():
+                for content_type in TABLE_COLUMNS:
+                    file_keys = [(file["lecture_name"], file["file_name"]) for file in files if file["content_type"] == content_type]
+                    self._delete_files_rows(course_name, content_type, file_keys)
+                    if rows[content_type]:
+                        self.insert_data(course_name, rows[content_type], content_type, bulk=bulk[content_type])
+                self._insert_manifest(course_name, manifest_entries)
         finally:
-            cursor.close()
-    
+            self.invalidate_catalog(course_name)
+
+    def _insert_manifest(self, course_name: str, entries: list[tuple]):
+        """
+        Args:
+            entries (list[tuple]): (file_name, lecture_name, content_type, content_hash,
+                extractor_version, chunk_config, num_chunks) per file
+        """
+        processed_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        with DatabaseManager._conn_lock:
+            cursor = self.conn.cursor()
+            try:
+                cursor.executemany(
+                    f"""
+                    INSERT INTO {course_name}_manifest
+                    (file_name, lecture_name, content_type, content_hash, extractor_version, chunk_config, num_chunks, processed_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    [entry + (processed_at,) for entry in entries],
+                )
+            except Exception as e:
+                raise Exception(f"Error recording files in {course_name}_manifest: {str(e)}")
+            finally:
+                cursor.close()
+
+    def get_unrecorded_files(self, course_name: str) -> dict[tuple[str, str], tuple[str, int]]:
+        """
+        Get the files that have chunks but no manifest entry, left by ingestions from
+        before the manifest existed.
+
+        Returns:
+            dict: Maps (lecture_name, file_name) to (content_type, number of chunks)
+        """
+        manifest = self.get_manifest(course_name)
+        files = {}
+        for content_type in TABLE_COLUMNS:
+            query = f"SELECT lecture_name, file_name, COUNT(*) FROM {course_name}_{content_type} GROUP BY lecture_name, file_name"
+            for lecture_name, file_name, num_chunks in self._run_query(query, return_results=True):
+                if (lecture_name, file_name) not in manifest:
+                    files[(lecture_name, file_name)] = (content_type, num_chunks)
+        return files
+
+    def record_files(self, course_name: str, entries: list[tuple]):
+        """Add manifest entries for files whose chunks are already loaded, see _insert_manifest for the entries"""
+        if entries:
+            self._insert_manifest(course_name, entries)
+            self.invalidate_catalog(course_name)
+
+    def remove_file(self, course_name: str, content_type: str, lecture_name: str, file_name: str):
+        """Atomically removes the chunks and manifest entry of a file that no longer exists"""
+        try:
+            with self._transaction():
+                self._delete_file_rows(course_name, content_type, lecture_name, file_name)
+        finally:
+            self.invalidate_catalog(course_name)
+
+    def _delete_file_rows(self, course_name: str, content_type: str, lecture_name: str, file_name: str):
+        self._delete_files_rows(course_name, content_type, [(lecture_name, file_name)])
+
+    def _delete_files_rows(self, course_name: str, content_type: str, file_keys: list[tuple[str, str]]):
+        """Delete the chunks and manifest entries of (lecture_name, file_name) pairs, one statement per table"""
+        if not file_keys:
+            return
+        condition = " OR ".join("(lecture_name = ? AND file_name = ?)" for _ in file_keys)
+        params = [value for file_key in file_keys for value in file_key]
+        for table_name in [f"{course_name}_{content_type}", f"{course_name}_manifest"]:
+            self._run_query(f"DELETE FROM {table_name} WHERE {condition}", params)
+
     def create_search_service(self, course_name: str):
         print(f'Creating search service for {course_name}')
         for content_type in ["pdf", "video"]:
@@ -109,20 +399,67 @@ class DatabaseManager:
             """
             self._run_query(service_query)
 
-    def get_files_in_lecture(self, course_name: str, lecture_name: str):
-        unique_files = set()
-        for content_type in ['video', 'pdf']:
-            table_name = f'{course_name}_{content_type}'
-            query = f"""
-            SELECT DISTINCT file_name 
-            FROM {table_name}
-            WHERE lecture_name = '{lecture_name}'
-            """
-            results = self._run_query(query, return_results=True)
-            for result in results:
-                unique_files.add(result[0])
+    def get_chunks(self, course_name: str, content_type: str) -> list[dict]:
+        """Get every chunk row of a course table as column -> value"""
+        columns = TABLE_COLUMNS[content_type]
+        query = f"SELECT {', '.join(columns)} FROM {course_name}_{content_type}"
+        results = self._run_query(query, return_results=True)
+        return [dict(zip(columns, row)) for row in results]
+
+    def get_catalog(self, course_names: list[str]) -> dict[str, dict[str, set[str]]]:
+        """
+        Get the processed files of every lecture in the given courses.
+
+        Courses missing from the process-wide cache are fetched together in one query.
 
-        return list(unique_files)
+        Returns:
+            dict: Maps course -> lecture -> set of processed file names
+        """
+        with DatabaseManager._catalog_lock:
+            missing = [course for course in course_names if course not in DatabaseManager._catalog]
+            if missing:
+                DatabaseManager._catalog.update(self._query_catalog(missing))
+            return {course: DatabaseManager._catalog[course] for course in course_names}
+
+    def _query_catalog(self, course_names: list[str]) -> dict[str, dict[str, set[str]]]:
+        # Courses ingested before the manifest existed are read from their chunk tables until
+        # the next ingestion records them, courses never ingested have nothing processed.
+        # Reading the catalog never creates tables.
+        tables = {table_name.lower() for table_name in self._list_tables()}
+        selects, params = [], []
+        for course_name in course_names:
+            if f"{course_name}_manifest".lower() in tables:
+                sources = [f"{course_name}_manifest"]
+            else:
+                sources = [
+                    f"{course_name}_{content_type}"
+                    for content_type in TABLE_COLUMNS
+                    if f"{course_name}_{content_type}".lower() in tables
+                ]
+            for source in sources:
+                selects.append(f"SELECT DISTINCT ? AS course_name, lecture_name, file_name FROM {source}")
+                params.append(course_name)
+
+        catalog = {course_name: {} for course_name in course_names}
+        if not selects:
+            return catalog
+        results = self._run_query("\nUNION ALL\n".join(selects), params, return_results=True)
+        for course_name, lecture_name, file_name in results:
+            catalog[course_name].setdefault(lecture_name, set()).add(file_name)
+        return catalog
+
+    @classmethod
+    def invalidate_catalog(cls, course_name: Optional[str] = None):
+        """Drop a course (or every course) from the catalog cache"""
+        with cls._catalog_lock:
+            if course_name is None:
+                cls._catalog.clear()
+            else:
+                cls._catalog.pop(course_name, None)
+
+    def get_files_in_lecture(self, course_name: str, lecture_name: str):
+        """Get the names of the files in a lecture that were processed successfully"""
+        return list(self.get_catalog([course_name])[course_name].get(lecture_name, set()))
 
     def delete_collection(self, course_name: str):
         for content_type in ['video', 'pdf']:
@@ -137,16 +474,24 @@ class DatabaseManager:
             """
             self._run_query(delete_service_query)
 
-    def list_collections(self):
+        self._run_query(f"DROP TABLE IF EXISTS {course_name}_manifest")
+        delete_local_indexes(course_name)
+        self.invalidate_catalog(course_name)
+        invalidate_course(course_name)
+
+    def _list_tables(self) -> list[str]:
+        """Get the names of the tables in the current schema"""
         list_tables_query = f"""
         SELECT TABLE_NAME 
         FROM INFORMATION_SCHEMA.TABLES
         WHERE TABLE_SCHEMA = CURRENT_SCHEMA();
         """
         results = self._run_query(list_tables_query, return_results=True)
-        table_names = [result[0] for result in results]
+        return [result[0] for result in results]
+
+    def list_collections(self):
         courses = set()
-        for table_name in table_names:
+        for table_name in self._list_tables():
             if table_name.endswith('_video'):
                 # Remove _video suffix and add to courses
                 course_name = table_name[:-6]
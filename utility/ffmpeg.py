@@ -0,0 +1,12 @@
+import subprocess
+
+import imageio_ffmpeg
+
+
+def run_ffmpeg(args: list[str], check: bool = True) -> str:
+    """Run the ffmpeg binary bundled with moviepy, returning its log output"""
+    command = [imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-nostdin", *args]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if check and result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.strip().splitlines()[-1:]}")
+    return result.stderr
@@ -1,7 +1,17 @@
 from pathlib import Path
+import hashlib
 import shutil
 
 
+def file_hash(file_path, block_size: int = 1 << 20) -> str:
+    """Get the sha256 digest of a file, reading it in fixed-size blocks"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        while block := file.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
 class FileManager:
     def __init__(self):
         self.base_path = Path("courses")
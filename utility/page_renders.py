@@ -0,0 +1,112 @@
+from pathlib import Path
+from typing import Iterable, Optional
+import logging
+import os
+import threading
+
+import pypdfium2 as pdfium
+
+from utility.cache import evict_lru_files, list_cache_files
+from utility.file_manager import file_hash
+
+logger = logging.getLogger(__name__)
+
+# pdfium is not thread safe, every document operation goes through this lock
+pdfium_lock = threading.Lock()
+
+
+class PageRenderCache:
+    """
+    Disk cache of PDF pages rendered to WebP images.
+
+    Renders are keyed by the hash of the PDF bytes, the page number and the DPI, so a
+    re-uploaded file never shows stale pages. Once the cache exceeds max_bytes the least
+    recently shown pages are evicted.
+
+    Args:
+        cache_dir (str): Directory for the rendered pages
+        max_bytes (int): Size limit of the cache
+        dpi (int): Default render resolution
+        quality (int): WebP quality, 0 to 100
+    """
+
+    def __init__(self, cache_dir: str = ".cache/pages", max_bytes: int = 256 << 20, dpi: int = 100, quality: int = 80):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.dpi = dpi
+        self.quality = quality
+        # (path, size, mtime) -> (file hash, page count), so reruns never re-read the PDF
+        self._file_memo: dict[tuple, tuple[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _file_info(self, file_path: str) -> tuple[str, int]:
+        stat = os.stat(file_path)
+        memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        if memo_key not in self._file_memo:
+            with pdfium_lock:
+                pdf = pdfium.PdfDocument(file_path)
+                try:
+                    num_pages = len(pdf)
+                finally:
+                    pdf.close()
+            self._file_memo[memo_key] = (file_hash(file_path), num_pages)
+        return self._file_memo[memo_key]
+
+    def page_count(self, file_path: str) -> int:
+        return self._file_info(file_path)[1]
+
+    def _render_path(self, file_path: str, page_num: int, dpi: int) -> Path:
+        return self.cache_dir / f"{self._file_info(file_path)[0][:24]}_p{page_num}_{dpi}dpi.webp"
+
+    def render_pages(self, file_path: str, page_nums: Iterable[int], dpi: Optional[int] = None) -> dict[int, str]:
+        """
+        Get images of pages (numbered from 1), rendering the missing ones with a single
+        open of the PDF. Pages outside the document are left out.
+
+        Returns:
+            dict: Maps page number -> image path
+        """
+        dpi = dpi or self.dpi
+        num_pages = self.page_count(file_path)
+        page_nums = [page_num for page_num in dict.fromkeys(page_nums) if 1 <= page_num <= num_pages]
+        paths = {page_num: self._render_path(file_path, page_num, dpi) for page_num in page_nums}
+
+        missing = [page_num for page_num, path in paths.items() if not path.exists()]
+        for page_num, path in paths.items():
+            if page_num not in missing:
+                # Showing a page counts as a use for LRU eviction
+                os.utime(path)
+
+        if missing:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with pdfium_lock:
+                pdf = pdfium.PdfDocument(file_path)
+                try:
+                    for page_num in missing:
+                        image = pdf[page_num - 1].render(scale=dpi / 72).to_pil()
+                        path = paths[page_num]
+                        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+                        image.save(tmp_path, format="WEBP", quality=self.quality)
+                        os.replace(tmp_path, path)
+                finally:
+                    pdf.close()
+            # Every page about to be returned is kept, even if they alone exceed max_bytes
+            with self._lock:
+                evict_lru_files(self.cache_dir, self.max_bytes, "*.webp", keep=set(paths.values()))
+
+        return {page_num: str(path) for page_num, path in paths.items()}
+
+    def render(self, file_path: str, page_num: int, dpi: Optional[int] = None) -> Optional[str]:
+        """Get the image of a single page, or None if the page does not exist"""
+        return self.render_pages(file_path, [page_num], dpi).get(page_num)
+
+    def prepare(self, file_path: str, dpi: Optional[int] = None) -> None:
+        """Render every page ahead of time, called at ingest"""
+        self.render_pages(file_path, range(1, self.page_count(file_path) + 1), dpi)
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in list_cache_files(self.cache_dir, "*.webp"))
+
+
+# Shared by the ingest pipeline and every portal session
+page_cache = PageRenderCache()
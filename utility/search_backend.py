@@ -0,0 +1,243 @@
+from abc import ABC, abstractmethod
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+
+import numpy as np
+import streamlit as st
+
+from utility.cache import embed_text
+
+SEARCH_BACKENDS = ["cortex", "local"]
+
+
+def configured_backend() -> str:
+    """Get the search backend set under [search] in secrets.toml, Cortex Search by default"""
+    backend = st.secrets.get("search", {}).get("backend", "cortex")
+    if backend not in SEARCH_BACKENDS:
+        raise ValueError(f"Unknown search backend: {backend}")
+    return backend
+
+
+class SearchBackend(ABC):
+    """Searches the chunks of one course table, with Cortex Search semantics"""
+
+    @abstractmethod
+    def search(self, query: str, columns: list[str], limit: int, filter: Optional[dict] = None) -> list[dict]:
+        """
+        Get the chunks most relevant to a query.
+
+        Args:
+            query (str): Search query
+            columns (list[str]): Columns to return for every result
+            limit (int): Maximum number of results
+            filter (Optional[dict]): Cortex Search filter using @eq, @or, @and and @not
+
+        Returns:
+            list[dict]: Results ordered by relevance, each with the requested columns
+        """
+
+
+class CortexSearchBackend(SearchBackend):
+    def __init__(self, service):
+        self.service = service
+
+    def search(self, query: str, columns: list[str], limit: int, filter: Optional[dict] = None) -> list[dict]:
+        return self.service.search(query, columns=columns, limit=limit, filter=filter or {}).results
+
+
+def tokenize(text: str) -> list[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def matches_filter(row: dict, filter: dict) -> bool:
+    """Evaluate a Cortex Search filter against a single row"""
+    if not filter:
+        return True
+    if len(filter) != 1:
+        return all(matches_filter(row, {op: value}) for op, value in filter.items())
+
+    op, value = next(iter(filter.items()))
+    if op == "@eq":
+        return all(row.get(column) == expected for column, expected in value.items())
+    if op == "@or":
+        return any(matches_filter(row, clause) for clause in value)
+    if op == "@and":
+        return all(matches_filter(row, clause) for clause in value)
+    if op == "@not":
+        return not matches_filter(row, value)
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+
+class LocalSearchBackend(SearchBackend):
+    """
+    In-process hybrid search over the chunk rows of one course table.
+
+    Relevance is a weighted sum of BM25 over the text (scaled to the best match) and the
+    cosine similarity of locally hashed embeddings. The postings and embeddings are stored
+    as .npy files opened memory-mapped, so loading an index costs almost nothing and pages
+    are only read when a search touches them. Rebuilding the index is picked up by every
+    backend open on it at its next search.
+
+    Args:
+        index_dir (str): Directory written by LocalSearchBackend.build
+        alpha (float): Weight of BM25 against vector similarity, between 0 and 1
+    """
+
+    dim = 1024
+    k1 = 1.5
+    b = 0.75
+
+    def __init__(self, index_dir: str, alpha: float = 0.5):
+        self.index_dir = Path(index_dir)
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._build_id = None
+        # Filters repeat across a session (same lectures selected), so their masks are kept
+        self._mask_cache: dict[str, np.ndarray] = {}
+
+    @classmethod
+    def build(cls, index_dir: str, rows: list[dict]) -> None:
+        """
+        Write an index over chunk rows, each with a text key plus any columns to filter or
+        return. The new index replaces the previous one atomically.
+        """
+        index_dir = Path(index_dir)
+        build_id = uuid.uuid4().hex
+        build_dir = index_dir / build_id
+        build_dir.mkdir(parents=True)
+
+        vocab: dict[str, int] = {}
+        postings: dict[int, list[tuple[int, int]]] = {}
+        doc_lengths = np.zeros(len(rows), dtype=np.float32)
+        vectors = np.zeros((len(rows), cls.dim), dtype=np.float32)
+        for doc_id, row in enumerate(rows):
+            tokens = tokenize(row["text"])
+            doc_lengths[doc_id] = len(tokens)
+            for term, count in Counter(tokens).items():
+                term_id = vocab.setdefault(term, len(vocab))
+                postings.setdefault(term_id, []).append((doc_id, count))
+            vectors[doc_id] = embed_text(row["text"], cls.dim)
+
+        # CSR layout: the postings of term t are doc_ids/term_freqs[offsets[t]:offsets[t + 1]]
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        doc_ids, term_freqs = [], []
+        for term_id in range(len(vocab)):
+            term_postings = postings[term_id]
+            offsets[term_id + 1] = offsets[term_id] + len(term_postings)
+            doc_ids.extend(doc_id for doc_id, _ in term_postings)
+            term_freqs.extend(count for _, count in term_postings)
+
+        np.save(build_dir / "offsets.npy", offsets)
+        np.save(build_dir / "doc_ids.npy", np.array(doc_ids, dtype=np.int32))
+        np.save(build_dir / "term_freqs.npy", np.array(term_freqs, dtype=np.float32))
+        np.save(build_dir / "doc_lengths.npy", doc_lengths)
+        np.save(build_dir / "vectors.npy", vectors)
+        with open(build_dir / "vocab.json", "w") as f:
+            json.dump(vocab, f)
+        with open(build_dir / "rows.json", "w") as f:
+            json.dump(rows, f, default=str)
+
+        current_path = index_dir / "CURRENT"
+        tmp_path = index_dir / f"CURRENT.{build_id}.tmp"
+        tmp_path.write_text(build_id)
+        os.replace(tmp_path, current_path)
+
+        # Backends with an older build mapped keep reading it, unlinked files stay valid until unmapped
+        for old_dir in index_dir.iterdir():
+            if old_dir.is_dir() and old_dir.name != build_id:
+                shutil.rmtree(old_dir, ignore_errors=True)
+
+    @staticmethod
+    def exists(index_dir: str) -> bool:
+        return (Path(index_dir) / "CURRENT").exists()
+
+    def _load(self):
+        """Map the current build, unless it is the one already loaded"""
+        build_id = (self.index_dir / "CURRENT").read_text().strip()
+        if build_id == self._build_id:
+            return
+
+        build_dir = self.index_dir / build_id
+        self.offsets = np.load(build_dir / "offsets.npy", mmap_mode="r")
+        self.doc_ids = np.load(build_dir / "doc_ids.npy", mmap_mode="r")
+        self.term_freqs = np.load(build_dir / "term_freqs.npy", mmap_mode="r")
+        self.doc_lengths = np.load(build_dir / "doc_lengths.npy")
+        self.vectors = np.load(build_dir / "vectors.npy", mmap_mode="r")
+        with open(build_dir / "vocab.json", "r") as f:
+            self.vocab = json.load(f)
+        with open(build_dir / "rows.json", "r") as f:
+            self.rows = json.load(f)
+
+        num_docs = len(self.rows)
+        doc_freqs = np.diff(self.offsets)
+        self.idf = np.log(1 + (num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        average_length = self.doc_lengths.mean() if num_docs else 0.0
+        self.length_norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / (average_length or 1.0))
+        self._mask_cache.clear()
+        self._build_id = build_id
+
+    def _filter_mask(self, filter: Optional[dict]) -> Optional[np.ndarray]:
+        if not filter:
+            return None
+        cache_key = json.dumps(filter, sort_keys=True)
+        if cache_key not in self._mask_cache:
+            self._mask_cache[cache_key] = np.array([matches_filter(row, filter) for row in self.rows], dtype=bool)
+        return self._mask_cache[cache_key]
+
+    def _bm25(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.rows), dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs, freqs = self.doc_ids[start:end], self.term_freqs[start:end]
+            scores[docs] += self.idf[term_id] * freqs * (self.k1 + 1) / (freqs + self.length_norm[docs])
+        return scores
+
+    def search(self, query: str, columns: list[str], limit: int, filter: Optional[dict] = None) -> list[dict]:
+        with self._lock:
+            self._load()
+            if not self.rows:
+                return []
+
+            bm25 = self._bm25(query)
+            if bm25.max() > 0:
+                bm25 /= bm25.max()
+            similarity = self.vectors @ embed_text(query, self.dim)
+            scores = self.alpha * bm25 + (1 - self.alpha) * similarity
+
+            limit = min(limit, len(self.rows))
+            mask = self._filter_mask(filter)
+            if mask is not None:
+                scores = np.where(mask, scores, -np.inf)
+                limit = min(limit, int(mask.sum()))
+            if limit <= 0:
+                return []
+
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            top = top[np.argsort(-scores[top])]
+            return [{column: self.rows[idx].get(column) for column in columns} for idx in top]
+
+
+def local_index_dir(course_name: str, content_type: str, base_dir: str = ".cache/search") -> str:
+    return str(Path(base_dir) / f"{course_name}_{content_type}")
+
+
+def build_local_indexes(db_manager, course_name: str, base_dir: str = ".cache/search") -> None:
+    """Index the chunk tables of a course for the local backend"""
+    for content_type in ["pdf", "video"]:
+        rows = db_manager.get_chunks(course_name, content_type)
+        LocalSearchBackend.build(local_index_dir(course_name, content_type, base_dir), rows)
+
+
+def delete_local_indexes(course_name: str, base_dir: str = ".cache/search") -> None:
+    for content_type in ["pdf", "video"]:
+        shutil.rmtree(local_index_dir(course_name, content_type, base_dir), ignore_errors=True)
@@ -0,0 +1,214 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from tempfile import TemporaryDirectory
+from typing import Optional
+import logging
+import os
+import threading
+import time
+import uuid
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+import pypdfium2 as pdfium
+import streamlit as st
+
+from utility.page_renders import pdfium_lock
+
+logger = logging.getLogger(__name__)
+
+_clients: dict[str, object] = {}
+_clients_lock = threading.Lock()
+
+
+def aws_client(service_name: str):
+    """
+    Get a client shared by the whole process. boto3 clients are thread safe, while
+    creating a session and client per file costs credential resolution and a new
+    connection pool every time.
+    """
+    with _clients_lock:
+        if service_name not in _clients:
+            session = boto3.Session(
+                aws_access_key_id=st.secrets.aws.access_key_id,
+                aws_secret_access_key=st.secrets.aws.secret_access_key,
+                region_name=st.secrets.aws.default_region,
+            )
+            _clients[service_name] = session.client(service_name)
+        return _clients[service_name]
+
+
+def write_pages(src_path: str, page_nums: list[int], dst_path: str):
+    """Write a PDF with the given pages (numbered from 1) of another"""
+    with pdfium_lock:
+        pdf = pdfium.PdfDocument(src_path)
+        subset = pdfium.PdfDocument.new()
+        try:
+            subset.import_pages(pdf, [page_num - 1 for page_num in page_nums])
+            subset.save(dst_path)
+        finally:
+            subset.close()
+            pdf.close()
+
+
+@dataclass
+class TextractJob:
+    """An asynchronous text detection job over some pages of a PDF"""
+
+    key: str
+    job_id: str
+    # Page numbers in the original PDF, in the order they appear in the uploaded one
+    page_nums: list[int]
+
+
+class TextractExtractor:
+    """
+    Extracts text from PDF pages with asynchronous Textract jobs.
+
+    Pages are split into batches of pages_per_job, every batch is uploaded as its own PDF
+    (multipart above multipart_threshold bytes) and gets its own text detection job, and
+    the jobs are polled concurrently so each batch is collected as soon as it finishes.
+
+    Args:
+        s3: S3 client
+        textract: Textract client
+        bucket_name (str): Bucket Textract reads from
+        pages_per_job (int): Pages per uploaded batch and job
+        max_jobs_in_flight (int): Batches uploaded, started and polled at the same time
+        multipart_threshold (int): Size in bytes above which uploads are split into parts
+        poll_interval (float): First wait between status checks, doubled up to max_poll_interval
+        timeout (float): Seconds a job may run before waiting on it fails with TimeoutError
+    """
+
+    def __init__(
+        self,
+        s3,
+        textract,
+        bucket_name: str,
+        pages_per_job: int = 4,
+        max_jobs_in_flight: int = 8,
+        multipart_threshold: int = 8 << 20,
+        poll_interval: float = 0.5,
+        max_poll_interval: float = 5.0,
+        timeout: float = 600.0,
+    ):
+        self.s3 = s3
+        self.textract = textract
+        self.bucket_name = bucket_name
+        self.pages_per_job = pages_per_job
+        self.max_jobs_in_flight = max_jobs_in_flight
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold, multipart_chunksize=multipart_threshold, max_concurrency=4
+        )
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.timeout = timeout
+
+    def submit(self, file_path: str, page_nums: list[int]) -> list[TextractJob]:
+        """Upload the pages in batches and start a text detection job for each"""
+        batches = [page_nums[i : i + self.pages_per_job] for i in range(0, len(page_nums), self.pages_per_job)]
+        with TemporaryDirectory() as tmp_dir, ThreadPoolExecutor(max_workers=self.max_jobs_in_flight) as executor:
+            futures = [
+                executor.submit(self._submit_batch, file_path, batch, os.path.join(tmp_dir, f"{idx}.pdf"))
+                for idx, batch in enumerate(batches)
+            ]
+            jobs, errors = [], []
+            for future in futures:
+                try:
+                    jobs.append(future.result())
+                except Exception as e:
+                    errors.append(e)
+
+        if errors:
+            # Nothing will collect the jobs that did start, so clean up their uploads here
+            for job in jobs:
+                self._delete(job)
+            raise errors[0]
+        return jobs
+
+    def _submit_batch(self, file_path: str, page_nums: list[int], batch_path: str) -> TextractJob:
+        write_pages(file_path, page_nums, batch_path)
+        key = f"{uuid.uuid4().hex}/{os.path.basename(file_path)}"
+        logger.info(f"Uploading pages {page_nums} to s3://{self.bucket_name}/{key}")
+        self.s3.upload_file(Filename=batch_path, Bucket=self.bucket_name, Key=key, Config=self.transfer_config)
+        response = self.textract.start_document_text_detection(
+            DocumentLocation={"S3Object": {"Bucket": self.bucket_name, "Name": key}}
+        )
+        return TextractJob(key=key, job_id=response["JobId"], page_nums=page_nums)
+
+    def collect(self, jobs: list[TextractJob]) -> dict[int, str]:
+        """
+        Wait for the jobs, gathering each one's pages as soon as it succeeds. Uploaded
+        batches are deleted whatever the outcome.
+
+        Returns:
+            dict: Maps original page number -> text, one line per detected line
+        """
+        pages = {}
+        if not jobs:
+            return pages
+        with ThreadPoolExecutor(max_workers=self.max_jobs_in_flight) as executor:
+            futures = [executor.submit(self._collect_job, job) for job in jobs]
+            for future in as_completed(futures):
+                pages.update(future.result())
+        return pages
+
+    def _collect_job(self, job: TextractJob) -> dict[int, str]:
+        try:
+            response = self._wait(job)
+            lines: dict[int, list[str]] = {}
+            while True:
+                for block in response["Blocks"]:
+                    if block["BlockType"] == "LINE":
+                        lines.setdefault(block["Page"], []).append(block["Text"])
+                if "NextToken" not in response:
+                    break
+                response = self.textract.get_document_text_detection(JobId=job.job_id, NextToken=response["NextToken"])
+            # Pages without any line still get an entry
+            return {page_num: "\n".join(lines.get(idx, [])) for idx, page_num in enumerate(job.page_nums, start=1)}
+        finally:
+            self._delete(job)
+
+    def _wait(self, job: TextractJob) -> dict:
+        """Poll a job with exponential backoff until it is done or timeout, returning its first result page"""
+        interval = self.poll_interval
+        deadline = time.monotonic() + self.timeout
+        while True:
+            response = self.textract.get_document_text_detection(JobId=job.job_id)
+            status = response["JobStatus"]
+            if status in ("SUCCEEDED", "PARTIAL_SUCCESS"):
+                return response
+            if status == "FAILED":
+                raise RuntimeError(f"Textract job {job.job_id} failed: {response.get('StatusMessage')}")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(
+                    f"Textract job {job.job_id} for pages {job.page_nums} still {status} after {self.timeout:g}s"
+                )
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, self.max_poll_interval)
+
+    def _delete(self, job: TextractJob):
+        try:
+            self.s3.delete_object(Bucket=self.bucket_name, Key=job.key)
+        except Exception as e:
+            logger.warning(f"Failed to delete s3://{self.bucket_name}/{job.key}: {e}")
+
+    def extract(self, file_path: str, page_nums: list[int]) -> dict[int, str]:
+        return self.collect(self.submit(file_path, page_nums))
+
+
+_default_extractor: Optional[TextractExtractor] = None
+
+
+def default_extractor() -> TextractExtractor:
+    """Get the extractor shared by every Note, built on the pooled clients"""
+    global _default_extractor
+    with _clients_lock:
+        if _default_extractor is not None:
+            return _default_extractor
+    extractor = TextractExtractor(aws_client("s3"), aws_client("textract"), st.secrets.aws.bucket_name)
+    with _clients_lock:
+        if _default_extractor is None:
+            _default_extractor = extractor
+        return _default_extractor
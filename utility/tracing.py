@@ -0,0 +1,226 @@
+from contextvars import ContextVar, copy_context
+from pathlib import Path
+from typing import Any, Callable, Optional
+import json
+import logging
+import os
+import threading
+import time
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Span:
+    """A timed operation with attributes, part of the trace of its root span"""
+
+    def __init__(self, tracer: "Tracer", name: str, parent: Optional["Span"], attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.root: Span = parent.root if parent else self
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        # Spans of the trace that ended so far, kept on the root only
+        self.finished: list[Span] = []
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def end(self, error: Optional[BaseException] = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.root.finished.append(self)
+        self.tracer._export(self)
+
+    def breakdown(self) -> list[dict]:
+        """
+        Get the spans of this trace that ended, in start order.
+
+        Returns:
+            list[dict]: name, depth below the root, start offset and duration in milliseconds, attributes
+        """
+        def depth(span: Span) -> int:
+            return 0 if span.parent is None else depth(span.parent) + 1
+
+        return [
+            {
+                "name": span.name,
+                "depth": depth(span),
+                "start_ms": (span.start_ns - self.start_ns) / 1e6,
+                "duration_ms": span.duration_ms,
+                "attributes": dict(span.attributes),
+            }
+            for span in sorted(self.root.finished, key=lambda span: span.start_ns)
+        ]
+
+    def to_otlp(self) -> dict:
+        """The span in the OTLP/JSON span encoding"""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent.span_id if self.parent else "",
+            "name": self.name,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        self.end(exc)
+
+
+class _NoopSpan:
+    """Stands in for every span while tracing is off, so instrumented code costs a method call"""
+
+    name = ""
+    attributes: dict = {}
+    duration_ms = 0.0
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def end(self, error: Optional[BaseException] = None):
+        pass
+
+    def breakdown(self) -> list[dict]:
+        return []
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def __bool__(self) -> bool:
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    Records spans and appends every finished one to a JSONL file, one OTLP/JSON span per line.
+
+    Spans nest through a context variable, so a span started inside another one is its
+    child, including in threads started through propagate. Unless enabled is given, tracing
+    is turned on by `enabled = true` under [tracing] in secrets.toml. While it is off every
+    span is NOOP_SPAN and nothing is recorded.
+
+    Args:
+        path (str): File the spans are appended to
+        enabled (Optional[bool]): Whether to record spans, read from secrets.toml if None
+    """
+
+    def __init__(self, path: str = ".cache/traces/spans.jsonl", enabled: Optional[bool] = None):
+        self.path = Path(path)
+        self._enabled = enabled
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        if self._enabled is None:
+            try:
+                self._enabled = bool(st.secrets.get("tracing", {}).get("enabled", False))
+            except Exception:
+                # No secrets.toml, e.g. in the benchmarks and CLI tools
+                self._enabled = False
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value: bool):
+        self._enabled = value
+
+    def span(self, name: str, **attributes):
+        """A span for a with block, made the current one inside it"""
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, _current_span.get(), attributes)
+
+    def start_span(self, name: str, parent: Optional[Span] = None, **attributes):
+        """
+        A span ended by calling its end method, for work that does not fit a with block such
+        as a stream consumed by the caller. It does not become the current span, parent
+        defaults to the current one.
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, parent or _current_span.get(), attributes)
+
+    @staticmethod
+    def current_span():
+        return _current_span.get() or NOOP_SPAN
+
+    def activate(self, span):
+        """Make a span started with start_span the current one inside a with block, without ending it"""
+        return _Activation(span) if span else NOOP_SPAN
+
+    def propagate(self, fn: Callable) -> Callable:
+        """Wrap fn to run with the current span, for handing work to an executor thread. Wrap once per submission."""
+        if not self.enabled:
+            return fn
+        context = copy_context()
+        return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+    def _export(self, span: Span):
+        line = json.dumps(span.to_otlp())
+        try:
+            with self._lock:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "a") as f:
+                    f.write(line + "\n")
+        except OSError as e:
+            logger.warning(f"Failed to export span {span.name}: {e}")
+
+
+class _Activation:
+    def __init__(self, span: Span):
+        self.span = span
+
+    def __enter__(self) -> Span:
+        self._token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+
+
+# Shared by the retriever, the ingest pipeline, the loaders and the portals
+tracer = Tracer()
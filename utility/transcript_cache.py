@@ -0,0 +1,179 @@
+from pathlib import Path
+from typing import Optional
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+
+from utility.file_manager import file_hash
+
+
+class TranscriptCache:
+    """
+    Persistent on-disk cache of video transcripts.
+
+    Entries are content addressed: the key is a hash of the media file bytes together
+    with the transcription model and options, so renaming or moving a lecture keeps
+    its cache entry while re-uploading a changed file (or switching model) misses.
+    """
+
+    def __init__(self, cache_dir: str = ".cache/transcripts"):
+        self.cache_dir = Path(cache_dir)
+        # (path, size, mtime) -> file hash, so repeated lookups skip re-hashing
+        self._hash_memo: dict[tuple, str] = {}
+
+    def file_hash(self, file_path: str, block_size: int = 1 << 20) -> str:
+        """Get the sha256 digest of a file, reading it in fixed-size blocks"""
+        stat = os.stat(file_path)
+        memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        if memo_key in self._hash_memo:
+            return self._hash_memo[memo_key]
+
+        self._hash_memo[memo_key] = file_hash(file_path, block_size)
+        return self._hash_memo[memo_key]
+
+    def make_key(self, file_path: str, model: str, options: dict) -> str:
+        """Build the cache key for a media file transcribed with a model and options"""
+        options_str = json.dumps(options, sort_keys=True)
+        key_source = f"{self.file_hash(file_path)}:{model}:{options_str}"
+        return hashlib.sha256(key_source.encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str) -> Optional[dict]:
+        """Get a cached entry, or None if it is missing or unreadable"""
+        entry_path = self._entry_path(key)
+        if not entry_path.exists():
+            return None
+        try:
+            with open(entry_path, "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def put(
+        self,
+        key: str,
+        file_path: str,
+        model: str,
+        options: dict,
+        duration: int,
+        transcript: str,
+        sentences: list[dict],
+    ) -> None:
+        """Store a transcript, writing to a temporary file first so readers never see partial entries"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        entry = {
+            "key": key,
+            "file_name": os.path.basename(file_path),
+            "file_hash": self.file_hash(file_path),
+            "model": model,
+            "options": options,
+            "created_at": time.time(),
+            "duration": duration,
+            "transcript": transcript,
+            "sentences": sentences,
+        }
+        entry_path = self._entry_path(key)
+        tmp_path = entry_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, entry_path)
+
+    def list_entries(self) -> list[dict]:
+        """Get a summary of every cached transcript, newest first"""
+        if not self.cache_dir.exists():
+            return []
+
+        entries = []
+        for entry_path in self.cache_dir.glob("*.json"):
+            entry = self.get(entry_path.stem)
+            if entry is None:
+                continue
+            entries.append(
+                {
+                    "key": entry["key"],
+                    "file_name": entry["file_name"],
+                    "model": entry["model"],
+                    "duration": entry["duration"],
+                    "num_sentences": len(entry["sentences"]),
+                    "created_at": entry["created_at"],
+                    "size_bytes": entry_path.stat().st_size,
+                }
+            )
+        return sorted(entries, key=lambda e: e["created_at"], reverse=True)
+
+    def total_size(self) -> int:
+        """Get the total size of the cache in bytes"""
+        return sum(entry["size_bytes"] for entry in self.list_entries())
+
+    def evict(self, key: str) -> bool:
+        """Delete a single entry, returning whether it existed"""
+        entry_path = self._entry_path(key)
+        if entry_path.exists():
+            entry_path.unlink()
+            return True
+        return False
+
+    def evict_file(self, file_path: str) -> int:
+        """Delete every entry for a media file, whatever model produced it"""
+        file_hash = self.file_hash(file_path)
+        removed = 0
+        for entry_path in list(self.cache_dir.glob("*.json")):
+            entry = self.get(entry_path.stem)
+            if entry and entry["file_hash"] == file_hash:
+                removed += self.evict(entry_path.stem)
+        return removed
+
+    def evict_older_than(self, max_age: float) -> int:
+        """Delete entries created more than max_age seconds ago"""
+        cutoff = time.time() - max_age
+        removed = 0
+        for entry in self.list_entries():
+            if entry["created_at"] < cutoff:
+                removed += self.evict(entry["key"])
+        return removed
+
+    def clear(self) -> int:
+        """Delete every entry"""
+        return sum(self.evict(entry["key"]) for entry in self.list_entries())
+
+
+# Shared by every Video, so the file hashes memoized for one ingestion carry over to the next
+transcript_cache = TranscriptCache()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or evict cached transcripts")
+    parser.add_argument("--cache-dir", default=".cache/transcripts")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="List cached transcripts")
+    evict_parser = subparsers.add_parser("evict", help="Evict entries by key or media file")
+    evict_parser.add_argument("target", help="Cache key or path to a media file")
+    prune_parser = subparsers.add_parser("prune", help="Evict entries older than N days")
+    prune_parser.add_argument("days", type=float)
+    subparsers.add_parser("clear", help="Evict every entry")
+    args = parser.parse_args()
+
+    cache = TranscriptCache(args.cache_dir)
+    if args.command == "list":
+        for entry in cache.list_entries():
+            print(
+                f"{entry['key'][:12]}  {entry['file_name']}  {entry['model']}  "
+                f"{entry['duration']}s  {entry['num_sentences']} sentences  "
+                f"{entry['size_bytes'] / 1024:.1f} KB"
+            )
+        print(f"Total: {cache.total_size() / 1024:.1f} KB")
+    elif args.command == "evict":
+        if os.path.isfile(args.target):
+            removed = cache.evict_file(args.target)
+        else:
+            removed = int(cache.evict(args.target))
+        print(f"Evicted {removed} entries")
+    elif args.command == "prune":
+        print(f"Evicted {cache.evict_older_than(args.days * 86400)} entries")
+    elif args.command == "clear":
+        print(f"Evicted {cache.clear()} entries")
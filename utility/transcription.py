@@ -0,0 +1,248 @@
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+import json
+import time
+import os
+import logging
+from typing import Optional
+
+import httpx
+import streamlit as st
+from deepgram import DeepgramClient, PrerecordedOptions, FileSource
+
+from utility.audio import plan_cuts, probe_duration, split_audio
+
+logger = logging.getLogger(__name__)
+
+
+def parse_deepgram_results(results: dict) -> tuple[str, list[dict]]:
+    """
+    Pulls the whole transcript and the sentence list out of a Deepgram response.
+
+    Args:
+        results (dict): The "results" object of a pre-recorded transcription response
+
+    Returns:
+        tuple: Contains (whole_transcript, sentence_level_transcript)
+    """
+    results = results["channels"][0]["alternatives"][0]
+    whole_transcript = results["transcript"]
+    sentence_level_transcript = []
+
+    for paragraph in results["paragraphs"]["paragraphs"]:
+        for sentence in paragraph["sentences"]:
+            sentence_level_transcript.append(sentence)
+
+    return whole_transcript, sentence_level_transcript
+
+
+def iter_file_chunks(file_path: str, chunk_size: int = 1 << 20):
+    """Yields a file in fixed-size pieces so uploads never hold more than one piece in memory"""
+    with open(file_path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+
+class DeepgramTranscriber:
+    """
+    Transcribes audio files with Deepgram's pre-recorded API.
+
+    The model name and options are exposed so that callers can key caches on them.
+    Audio is streamed from disk in upload_chunk_size pieces rather than read whole.
+    """
+
+    def __init__(
+        self,
+        model: str = "nova-2-video",
+        smart_format: bool = True,
+        timeout: int = 300,
+        upload_chunk_size: int = 1 << 20,
+        api_key: Optional[str] = None,
+        transport: Optional[httpx.BaseTransport] = None,
+    ):
+        self.model = model
+        self.options = {"smart_format": smart_format}
+        self.timeout = timeout
+        self.upload_chunk_size = upload_chunk_size
+        self.api_key = api_key
+        # Custom httpx transport, e.g. httpx.MockTransport for offline benchmarks
+        self.transport = transport
+
+    def transcribe(self, audio_file_path: str) -> tuple[str, list[dict]]:
+        """
+        Sends an audio file to Deepgram.
+
+        Returns:
+            tuple: Contains (whole_transcript, sentence_level_transcript)
+        """
+        # STEP 1 Create a Deepgram client using the API key
+        deepgram = DeepgramClient(api_key=self.api_key or st.secrets.deepgram.api_key)
+
+        payload: FileSource = {
+            "stream": iter_file_chunks(audio_file_path, self.upload_chunk_size),
+        }
+        # A known length lets httpx send a plain body instead of chunked encoding
+        headers = {"Content-Length": str(os.path.getsize(audio_file_path))}
+        kwargs = {"transport": self.transport} if self.transport else {}
+
+        # Configure Deepgram options for audio analysis
+        options = PrerecordedOptions(model=self.model, **self.options)
+
+        logger.info("Converting speech to text")
+        # Call the transcribe_file method with the text payload and options
+        start_time = time.time()
+        response = deepgram.listen.rest.v("1").transcribe_file(
+            payload,
+            options,
+            headers=headers,
+            timeout=httpx.Timeout(self.timeout, connect=10),
+            **kwargs,
+        )
+        logger.info(f"Transcribed {os.path.basename(audio_file_path)} in {time.time() - start_time:.1f}s")
+
+        return parse_deepgram_results(json.loads(response.to_json())["results"])
+
+
+def stitch_transcripts(
+    parts: list[tuple[str, list[dict]]], offsets: list[float], in_silence: list[bool], join_gap: float = 1.0
+) -> tuple[str, list[dict]]:
+    """
+    Joins the transcripts of consecutive audio segments into one.
+
+    Sentence times are shifted by each segment's offset. A cut outside a silence can
+    split a sentence in two, so when the last sentence before such a cut and the first
+    one after it both touch the cut (within join_gap seconds) they become one sentence.
+    The period added to the first half is dropped, the capital of the second half is kept
+    since there is no telling a sentence start from a proper noun or "I".
+
+    Args:
+        parts (list): (whole_transcript, sentence_level_transcript) of every segment
+        offsets (list): Start of every segment in seconds
+        in_silence (list): Whether each cut, between segment i and i + 1, fell in a silence
+        join_gap (float): How close to a cut a sentence has to end or start to be joined
+
+    Returns:
+        tuple: Contains (whole_transcript, sentence_level_transcript)
+    """
+    sentences = []
+    for idx, ((_, part), offset) in enumerate(zip(parts, offsets)):
+        shifted = [
+            {**sentence, "start": round(sentence["start"] + offset, 3), "end": round(sentence["end"] + offset, 3)}
+            for sentence in part
+        ]
+        if idx and not in_silence[idx - 1] and sentences and shifted:
+            head, tail = sentences[-1], shifted[0]
+            if head["end"] >= offset - join_gap and tail["start"] <= offset + join_gap:
+                # Both halves come back punctuated as whole sentences
+                head_text = head["text"].rstrip().rstrip(".")
+                tail_text = tail["text"].lstrip()
+                sentences[-1] = {**head, "text": f"{head_text} {tail_text}", "end": tail["end"]}
+                shifted = shifted[1:]
+        sentences.extend(shifted)
+
+    whole_transcript = " ".join(text.strip() for text, _ in parts if text.strip())
+    return whole_transcript, sentences
+
+
+class SegmentedTranscriber:
+    """
+    Transcribes long audio as segments cut on silences, concurrently.
+
+    Audio longer than a quarter over segment_seconds is cut near every segment_seconds
+    (see utility.audio.plan_cuts), the segments go to the wrapped transcriber with at most
+    max_workers requests in flight across every file, and the sentence lists are stitched
+    back with absolute timestamps. Shorter audio goes to the wrapped transcriber whole.
+
+    The model name and options are the wrapped transcriber's, so cached transcripts
+    stay valid whichever way they were made.
+
+    Args:
+        transcriber: Transcriber the segments go to, e.g. DeepgramTranscriber
+        segment_seconds (float): Target segment length
+        max_workers (int): Segments transcribed at the same time
+        search_seconds (float): How far from a target cut to look for a silence
+        join_gap (float): See stitch_transcripts
+    """
+
+    def __init__(
+        self,
+        transcriber,
+        segment_seconds: float = 600.0,
+        max_workers: int = 4,
+        search_seconds: float = 30.0,
+        join_gap: float = 1.0,
+    ):
+        self.transcriber = transcriber
+        self.segment_seconds = segment_seconds
+        self.search_seconds = search_seconds
+        self.join_gap = join_gap
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    @property
+    def model(self) -> str:
+        return self.transcriber.model
+
+    @property
+    def options(self) -> dict:
+        return self.transcriber.options
+
+    def transcribe(self, audio_file_path: str) -> tuple[str, list[dict]]:
+        """
+        Sends an audio file to the wrapped transcriber, in segments if it is long.
+
+        Returns:
+            tuple: Contains (whole_transcript, sentence_level_transcript)
+        """
+        duration = probe_duration(audio_file_path)
+        cuts = plan_cuts(audio_file_path, duration, self.segment_seconds, self.search_seconds) if duration else []
+        if not cuts:
+            return self.transcriber.transcribe(audio_file_path)
+
+        with TemporaryDirectory() as tmp_dir:
+            segments = split_audio(audio_file_path, [cut_time for cut_time, _ in cuts], tmp_dir)
+            logger.info(
+                f"Transcribing {os.path.basename(audio_file_path)} as {len(segments)} segments, "
+                f"{sum(in_silence for _, in_silence in cuts)} of {len(cuts)} cuts in silences"
+            )
+            start_time = time.time()
+            parts = list(self._executor.map(self.transcriber.transcribe, [path for path, _, _ in segments]))
+            logger.info(f"Transcribed {len(segments)} segments in {time.time() - start_time:.1f}s")
+
+        return stitch_transcripts(
+            parts, [start for _, start, _ in segments], [in_silence for _, in_silence in cuts], self.join_gap
+        )
+
+
+class FakeTranscriber:
+    """
+    Offline stand-in for DeepgramTranscriber.
+
+    Returns a fixed sentence list (or evenly spaced synthetic sentences) and counts
+    how often it was called, so caching and chunking can be exercised without network.
+    """
+
+    def __init__(
+        self,
+        sentences: Optional[list[dict]] = None,
+        num_sentences: int = 20,
+        sentence_duration: float = 5.0,
+        model: str = "fake",
+    ):
+        if sentences is None:
+            sentences = [
+                {
+                    "text": f"Sentence number {i}.",
+                    "start": round(i * sentence_duration, 2),
+                    "end": round((i + 1) * sentence_duration - 0.5, 2),
+                }
+                for i in range(num_sentences)
+            ]
+        self.sentences = sentences
+        self.model = model
+        self.options = {}
+        self.calls = 0
+
+    def transcribe(self, audio_file_path: str) -> tuple[str, list[dict]]:
+        self.calls += 1
+        sentences = [dict(sentence) for sentence in self.sentences]
+        return " ".join(sentence["text"] for sentence in sentences), sentences
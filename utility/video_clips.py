@@ -0,0 +1,154 @@
+from pathlib import Path
+from typing import Optional
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+from utility.cache import evict_lru_files, list_cache_files
+from utility.ffmpeg import run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+
+def faststart_remux(src_path: str, dst_path: str) -> None:
+    """Copy the streams of an mp4 into a new file with the moov atom up front, so players can seek before it downloads"""
+    tmp_path = f"{dst_path}.{os.getpid()}.{threading.get_ident()}.tmp.mp4"
+    run_ffmpeg(["-y", "-i", src_path, "-c", "copy", "-map", "0", "-movflags", "+faststart", tmp_path])
+    os.replace(tmp_path, dst_path)
+
+
+def keyframe_times(file_path: str) -> list[float]:
+    """Get the timestamps of every video keyframe, only decoding the keyframes"""
+    output = run_ffmpeg(["-skip_frame", "nokey", "-i", file_path, "-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-"])
+    return sorted(float(pts) for pts in re.findall(r"pts_time:\s*([\d.]+)", output))
+
+
+class ClipCache:
+    """
+    Disk cache of faststart copies of lecture videos and short clips cut from them.
+
+    Clips are cut without re-encoding, so they start on the keyframe at or before the
+    requested start and end on the first keyframe after the requested end. Clips,
+    faststart copies and keyframe indexes each have their own size limit, and are
+    evicted least recently used first once they exceed it.
+
+    Args:
+        cache_dir (str): Directory for the remuxed videos, keyframe indexes and clips
+        max_bytes (int): Size limit of the clips
+        max_web_bytes (int): Size limit of the faststart copies
+        max_index_bytes (int): Size limit of the keyframe indexes
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = ".cache/clips",
+        max_bytes: int = 512 << 20,
+        max_web_bytes: int = 4 << 30,
+        max_index_bytes: int = 16 << 20,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_web_bytes = max_web_bytes
+        self.max_index_bytes = max_index_bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _video_key(file_path: str) -> str:
+        """Identify a video by path, size and mtime, so lookups never read the file"""
+        stat = os.stat(file_path)
+        key_source = f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        return hashlib.sha256(key_source.encode()).hexdigest()[:24]
+
+    def web_copy(self, file_path: str) -> str:
+        """Get the faststart copy of a video, remuxing it on first use"""
+        web_dir = self.cache_dir / "web"
+        web_dir.mkdir(parents=True, exist_ok=True)
+        web_path = web_dir / f"{self._video_key(file_path)}.mp4"
+        try:
+            # Serving a copy counts as a use for LRU eviction
+            os.utime(web_path)
+            return str(web_path)
+        except FileNotFoundError:
+            pass
+
+        logger.info(f"Remuxing {file_path} with faststart")
+        faststart_remux(file_path, str(web_path))
+        # The copy just made is about to be served, it is never evicted
+        with self._lock:
+            evict_lru_files(web_dir, self.max_web_bytes, "*.mp4", keep={web_path})
+        return str(web_path)
+
+    def keyframes(self, file_path: str) -> list[float]:
+        """
+        Get the keyframe times of the faststart copy of a video. The index is keyed by the
+        original video, since the copy's mtime changes every time it is used.
+        """
+        index_path = self.cache_dir / "keyframes" / f"{self._video_key(file_path)}.json"
+        try:
+            # Reading an index counts as a use for LRU eviction
+            os.utime(index_path)
+            with open(index_path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+
+        times = keyframe_times(self.web_copy(file_path))
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = index_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(times, f)
+        os.replace(tmp_path, index_path)
+        with self._lock:
+            evict_lru_files(index_path.parent, self.max_index_bytes, "*.json", keep={index_path})
+        return times
+
+    def prepare(self, file_path: str) -> None:
+        """Remux and index a video ahead of time, called at ingest"""
+        self.keyframes(file_path)
+
+    def get_clip(self, file_path: str, start_time: float, end_time: float) -> tuple[str, float, float]:
+        """
+        Get a clip covering start_time to end_time of a video.
+
+        Returns:
+            tuple: Contains (clip path, start_time and end_time relative to the clip)
+        """
+        times = self.keyframes(file_path)
+        clip_start = max((t for t in times if t <= start_time), default=0.0)
+        clip_end: Optional[float] = min((t for t in times if t > end_time), default=None)
+
+        clip_dir = self.cache_dir / "clips"
+        clip_dir.mkdir(parents=True, exist_ok=True)
+        end_label = f"{clip_end:.3f}" if clip_end is not None else "end"
+        clip_path = clip_dir / f"{self._video_key(file_path)}_{clip_start:.3f}_{end_label}.mp4"
+
+        if clip_path.exists():
+            # Reading a clip counts as a use for LRU eviction
+            os.utime(clip_path)
+        else:
+            args = ["-y", "-ss", f"{clip_start:.3f}", "-i", self.web_copy(file_path)]
+            if clip_end is not None:
+                args += ["-t", f"{clip_end - clip_start:.3f}"]
+            tmp_path = f"{clip_path}.{os.getpid()}.{threading.get_ident()}.tmp.mp4"
+            args += ["-c", "copy", "-map", "0", "-avoid_negative_ts", "make_zero", "-movflags", "+faststart", tmp_path]
+            run_ffmpeg(args)
+            os.replace(tmp_path, clip_path)
+            # The clip just cut is the one being requested, it is never evicted
+            self._evict(keep={clip_path})
+
+        return str(clip_path), start_time - clip_start, end_time - clip_start
+
+    def _evict(self, keep: set[Path]):
+        """Delete the least recently used clips until the clips fit in max_bytes"""
+        with self._lock:
+            evict_lru_files(self.cache_dir / "clips", self.max_bytes, "*.mp4", keep=keep)
+
+    def clips_size(self) -> int:
+        return sum(size for _, size, _ in list_cache_files(self.cache_dir / "clips", "*.mp4"))
+
+
+# Shared by the ingest pipeline and every student session
+clip_cache = ClipCache()